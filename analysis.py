@@ -5,10 +5,15 @@
 __author__ = "David Sedlák"
 __email__ = "xsedla1d@stud.fit.vutbr.cz"
 
+import argparse
+
 from matplotlib import pyplot as plt
+import numpy as np
 import pandas as pd
 import seaborn as sns
 
+from download import CountCube, DataDownloader
+
 
 def get_dataframe(filename: str, verbose: bool = False) -> pd.DataFrame:
     """Parse dataframe from pickle file.
@@ -25,7 +30,9 @@ def get_dataframe(filename: str, verbose: bool = False) -> pd.DataFrame:
     Parsed dataframe
     """
     df = pd.read_pickle(filename)
-    df["date"] = df["p2a"].astype("datetime64")
+    # snapshots exported by DataDownloader.export_dataframe already have it
+    if "date" not in df:
+        df["date"] = df["p2a"].astype("datetime64")
     orig_size = df.memory_usage(deep=True).sum()
     # cat_cols = ["p36", "p37", "weekday(p2a)", "p6", "p7", "p8", "p9", "p10", "p11",
     #             "p12", "p13a", "p13b", "p13c", "p15", "p16", "p17", "p18", "p19",
@@ -43,14 +50,56 @@ def get_dataframe(filename: str, verbose: bool = False) -> pd.DataFrame:
     return df
 
 
+def count_frame(data, column, labels, unit=None):
+    """Count accidents by region, labels of column values and optionally date.
+
+    Accidents are counted from count cube, so only aggregates are processed.
+
+    Parameters
+    ----------
+    data : CountCube or pd.DataFrame
+        Count cube of the column from DataDownloader.get_cube, or dataframe with
+        region, p2a and the column, which is counted by CountCube.from_columns.
+    column : String
+        Name of the counted column.
+    labels : Dictionary
+        Labels of counted values {value : label}, values with the same label are
+        summed, other values are left out.
+    unit : String, optional
+        Dates are grouped by given unit of CountCube.group_dates and stored in
+        date column, when set.
+    Returns
+    -------
+    Dataframe with columns region, date (when unit is set), column with labels
+    and "Počet nehod", with all combinations including zero counts.
+    """
+    cube = data if isinstance(data, CountCube) else CountCube.from_columns(data, column)
+    values = list(labels)
+    cube = cube.select(values=values)
+    if unit is None:
+        keys, counts = np.array([None]), cube.total()[:, np.newaxis]
+    else:
+        keys, counts = cube.group_dates(unit)
+    region, key, value = np.meshgrid(np.arange(len(cube.regions)), np.arange(len(keys)),
+                                     np.arange(len(values)), indexing="ij")
+    frame = pd.DataFrame({
+        "region": np.asarray(cube.regions)[region.ravel()],
+        "date": keys[key.ravel()],
+        column: np.asarray([labels[value] for value in values])[value.ravel()],
+        "Počet nehod": counts.ravel(),
+    })
+    group = ["region", column] if unit is None else ["region", "date", column]
+    return frame.groupby(group)["Počet nehod"].sum().reset_index()
+
+
 def plot_roadtype(df: pd.DataFrame, fig_location: str = None,
                   show_figure: bool = False):
     """Plot roadtype categorical plot.
 
     Parameters
     ----------
-    df : pd.DataFrame
-        Dataframe
+    df : CountCube or pd.DataFrame
+        Count cube of p21 or dataframe, see count_frame.
     fig_location : String
         Path where to save the resulting figure.
     show_figure : Bool
@@ -60,7 +109,7 @@ def plot_roadtype(df: pd.DataFrame, fig_location: str = None,
         return
 
     # TODO sharex? sharey?
-    df["p21"] = df["p21"].map({
+    grouped = count_frame(df, "p21", {
         0: "Jiná komunikace",
         1: "Dvoupruhová komunikace",
         2: "Třípruhová komunikace",
@@ -69,8 +118,8 @@ def plot_roadtype(df: pd.DataFrame, fig_location: str = None,
         5: "Vícepruhová komunikace",
         6: "Rychlostní komunikace"
     })
-    df["Počet nehod"] = 1
-    grouped = df.groupby(["region", "p21"]).agg({"Počet nehod": "sum"}).reset_index()
+    # only combinations with accidents are drawn
+    grouped = grouped[grouped["Počet nehod"] > 0]
     displayed_regions = ["PHA", "JHM", "OLK", "ZLK"]
 
     sns.set_theme()
@@ -91,8 +140,8 @@ def plot_animals(df: pd.DataFrame, fig_location: str = None,
 
     Parameters
     ----------
-    df : pd.DataFrame
-        Dataframe
+    df : CountCube or pd.DataFrame
+        Count cube of p10 or dataframe, see count_frame.
     fig_location : String
         Path where to save the resulting figure.
     show_figure : Bool
@@ -102,7 +151,9 @@ def plot_animals(df: pd.DataFrame, fig_location: str = None,
     if not fig_location and not show_figure:
         return
 
-    df["p10"] = df["p10"].map({
+    if not isinstance(df, CountCube):
+        df = CountCube.from_columns(df, "p10")
+    df = count_frame(df.select(end="2021-01-01"), "p10", {
         1: "řidičem",
         2: "řidičem",
         4: "zvěří",
@@ -111,10 +162,11 @@ def plot_animals(df: pd.DataFrame, fig_location: str = None,
         6: "jiné",
         7: "jiné",
         0: "jiné"
-    })
-    df["Počet nehod"] = 1
-    df = df[df["date"] < "2021-01-01"]
-    df = df.groupby(["region", df['date'].dt.month, "p10"]).agg({"Počet nehod": "sum"})
+    }, unit="M")
+    # months of all years are summed
+    df["date"] = df["date"].to_numpy().astype("datetime64[M]").astype(np.int64) % 12 + 1
+    df = df.groupby(["region", "date", "p10"]).agg({"Počet nehod": "sum"})
+    df = df[df["Počet nehod"] > 0]
     displayed_regions = ["PHA", "JHM", "OLK", "ZLK"]
 
     sns.set_theme()
@@ -135,8 +187,8 @@ def plot_conditions(df: pd.DataFrame, fig_location: str = None,
 
     Parameters
     ----------
-    df : pd.DataFrame
-        Dataframe
+    df : CountCube or pd.DataFrame
+        Count cube of p18 or dataframe, see count_frame.
     fig_location : String
         Path where to save the resulting figure.
     show_figure : Bool
@@ -146,7 +198,14 @@ def plot_conditions(df: pd.DataFrame, fig_location: str = None,
     if not fig_location and not show_figure:
         return
 
-    df["p18"] = df["p18"].map({
+    displayed_regions = ["PHA", "JHM", "OLK", "ZLK"]
+    # displayed_regions = ["JHM", "MSK", "OLK", "ZLK"]
+    if not isinstance(df, CountCube):
+        df = CountCube.from_columns(df, "p18")
+    df = df.select([region for region in displayed_regions if region in df.regions],
+                   start="2016-01-01", end="2021-01-01")
+    # months are drawn at their first day
+    df = count_frame(df, "p18", {
         1: "neztížené",
         2: "mlha",
         3: "na počátku deště",
@@ -154,17 +213,11 @@ def plot_conditions(df: pd.DataFrame, fig_location: str = None,
         5: "sněžení",
         6: "náledí",
         7: "vítr"
-    })
-    df = df[df["p18"] != 0]
-    displayed_regions = ["PHA", "JHM", "OLK", "ZLK"]
-    # displayed_regions = ["JHM", "MSK", "OLK", "ZLK"]
-    df = df[df["region"].isin(displayed_regions)]
-    df["Počet nehod"] = 1
-    df = df[df["date"] < "2021-01-01"]
-    df = df[df["date"] >= "2016-01-01"]
-    df = pd.pivot_table(df, columns="p18", index=["date", "region"],
+    }, unit="M")
+    df = df.pivot_table(columns="p18", index=["region", "date"],
                         values="Počet nehod", aggfunc="sum")
-    df = df.unstack(level=1).resample("M").sum().stack("region").swaplevel(0, 1)
+    # conditions without any accident are left out
+    df = df.loc[:, df.sum() > 0]
     df = df.melt(ignore_index=False).reset_index()
     df = df.rename(columns={"p18": "Podmínky"})
 
@@ -182,8 +235,42 @@ def plot_conditions(df: pd.DataFrame, fig_location: str = None,
         plt.show()
 
 
+def main(argv=None):
+    """Main function
+
+    Parameters
+    ----------
+    argv Argument vector passed to the ArgumentParser.
+    Following arguments are defined and can be passed from command line:
+        --force : Draw plots even when they are up to date.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Draw plots even when neither data nor plotting code changed."
+    )
+    args = parser.parse_args(argv)
+
+    from render import FigureJob, stale_figures
+    # plotting function and counted column of each plot
+    plots = {
+        FigureJob("roadtype", "analysis", "plot_roadtype", "outputs/01_roadtype.png"):
+            (plot_roadtype, "p21"),
+        FigureJob("animals", "analysis", "plot_animals", "outputs/02_animals.png"):
+            (plot_animals, "p10"),
+        FigureJob("conditions", "analysis", "plot_conditions", "outputs/03_conditions.png"):
+            (plot_conditions, "p18"),
+    }
+    cache, stale = stale_figures(list(plots), force=args.force)
+    # plots are drawn from count cubes, so the whole dataset isn't loaded
+    downloader = DataDownloader()
+    for job, key in stale.items():
+        plot, column = plots[job]
+        plot(downloader.get_cube(column), job.fig_location, True)
+        cache.store(job, key)
+    cache.save()
+
+
 if __name__ == "__main__":
-    dataframe = get_dataframe("accidents.pkl.gz", verbose=True)
-    plot_roadtype(dataframe, fig_location="outputs/01_roadtype.png", show_figure=True)
-    plot_animals(dataframe, "outputs/02_animals.png", True)
-    plot_conditions(dataframe, "outputs/03_conditions.png", True)
+    main()
@@ -5,12 +5,19 @@
 __author__ = "David Sedlák"
 __email__ = "xsedla1d@stud.fit.vutbr.cz"
 
+import argparse
 import os
 
+import numpy as np
 import pandas as pd
 import seaborn as sns
 from matplotlib import pyplot as plt
 
+from download import CountCube, DataDownloader
+
+# values of p11 meaning influence of alcohol
+alcohol_values = [1, 3, 5, 6, 7, 8, 9]
+
 
 def get_dataframe(filename: str) -> pd.DataFrame:
     """Parse dataframe from pickle file.
@@ -24,38 +31,121 @@ def get_dataframe(filename: str) -> pd.DataFrame:
     Parsed dataframe
     """
     df = pd.read_pickle(filename)
-    df["datum"] = df["p2a"].astype("datetime64")
+    # snapshots exported by DataDownloader.export_dataframe have "date" already
+    df["datum"] = df["date"] if "date" in df else df["p2a"].astype("datetime64")
 
     return df
 
 
+def iter_dataframes(data, columns):
+    """Iterate over dataframe or chunks of dataset as dataframes.
+
+    Parameters
+    ----------
+    data : pd.DataFrame or Iterable
+        Dataframe or iterable of dictionaries {header : ndarray}, e.g. chunks
+        produced by DataDownloader.iter_chunks.
+    columns : List
+        Columns used from the chunks.
+    Returns
+    -------
+    Iterator of dataframes
+    """
+    if isinstance(data, pd.DataFrame):
+        yield data
+        return
+    for chunk in data:
+        df = pd.DataFrame({column: chunk[column] for column in columns})
+        if "p2a" in df:
+            df["datum"] = df["p2a"]
+        yield df
+
+
+def count_alcohol(data, key, columns, weights=None):
+    """Count accidents with and without influence of alcohol for each key value.
+
+    Counts are summed chunk by chunk, so whole dataset doesn't have to be loaded.
+
+    Parameters
+    ----------
+    data : pd.DataFrame or Iterable
+        Dataframe or chunks of dataset, see iter_dataframes.
+    key : Callable
+        Function returning series with key values for given dataframe, rows with
+        missing key are counted under NaN key.
+    columns : List
+        Columns used from the chunks, besides p11.
+    weights : Callable, optional
+        Function returning series with weights of rows for given dataframe, which
+        are summed instead of counting the rows.
+    Returns
+    -------
+    Dataframe with key values as index and columns False and True with number of
+    accidents without and with influence of alcohol.
+    """
+    counts = None
+    for df in iter_dataframes(data, ["p11"] + columns):
+        alcohol = df["p11"].isin(alcohol_values)
+        weight = pd.Series(1, index=df.index) if weights is None else weights(df)
+        part = weight.groupby([key(df), alcohol],
+                              dropna=False).sum().unstack(fill_value=0)
+        counts = part if counts is None else counts.add(part, fill_value=0)
+    return counts.reindex(columns=[False, True], fill_value=0).astype("int64")
+
+
+def count_alcohol_days(cube):
+    """Count accidents with and without influence of alcohol for each day of the week.
+
+    Parameters
+    ----------
+    cube : CountCube
+        Count cube of p11, e.g. from DataDownloader.get_cube.
+    Returns
+    -------
+    Dataframe in format of count_alcohol with days of the week (0 is Monday) as
+    index, accidents without date are counted under NaN key.
+    """
+    alcohol = np.isin(cube.values, alcohol_values)
+    days, counts = cube.group_dates("weekday")
+    counts = counts.sum(axis=0)
+    undated = cube.total().sum(axis=0) - counts.sum(axis=0)
+    counts = np.vstack([counts, undated])
+    index = pd.Index(np.append(days.astype(np.float64), np.nan), name="day")
+    return pd.DataFrame({False: counts[:, ~alcohol].sum(axis=1),
+                         True: counts[:, alcohol].sum(axis=1)}, index=index)
+
+
 def plot_alcohol(df: pd.DataFrame, fig_location: str = None,
                  show_figure: bool = False):
     """Plot week days and number of accidents with influence of alcohol
 
     Parameters
     ----------
-    df : pd.DataFrame
-        Dataframe
+    df : CountCube, pd.DataFrame or Iterable
+        Count cube of p11, dataframe which is counted by CountCube.from_columns or
+        chunks of dataset, see iter_dataframes.
     fig_location : String
         Path where to save the resulting figure.
     show_figure : Bool
         When set to True, figure is shown on the screen.
     """
-    # create column with day of the week for each accident
-    df["day"] = df["datum"].dt.dayofweek
-    # create column to aggregate over
-    df["Počet nehod"] = 1
-
-    alcohol_mask = df["p11"].isin([1, 3, 5, 6, 7, 8, 9])
-    alcohol_df = df[alcohol_mask].copy()
-    no_alcohol_df = df[~alcohol_mask].copy()
+    # count accidents for each day of the week
+    if isinstance(df, pd.DataFrame):
+        df = CountCube.from_columns(df, "p11")
+    if isinstance(df, CountCube):
+        counts = count_alcohol_days(df)
+    else:
+        counts = count_alcohol(df, lambda df: df["datum"].dt.dayofweek.rename("day"),
+                               ["p2a"])
+    alcohol_count = counts[True].sum()
+    no_alcohol_count = counts[False].sum()
+    counts = counts[counts.index.notna()]
+    grouped_alcohol = counts[True].to_frame("Počet nehod")
+    grouped_no_alcohol = counts[False].to_frame("Počet nehod")
     # print absolute and relative number of alcohol accidents
-    print(f"Absolutní počet nehod pod vlivem alkoholu: {len(alcohol_df)}")
-    print(f"Relativní počet nehod pod vlivem alkoholu: {len(alcohol_df) / len(no_alcohol_df) * 100:.2f} %")
+    print(f"Absolutní počet nehod pod vlivem alkoholu: {alcohol_count}")
+    print(f"Relativní počet nehod pod vlivem alkoholu: {alcohol_count / no_alcohol_count * 100:.2f} %")
 
-    grouped_alcohol = alcohol_df.groupby(["day"]).agg({"Počet nehod": "sum"})
-    grouped_no_alcohol = no_alcohol_df.groupby(["day"]).agg({"Počet nehod": "sum"})
     # calculate relative ratio of accidents involving alcohol
     grouped_alcohol_relative = grouped_alcohol / (grouped_alcohol + grouped_no_alcohol) * 100
 
@@ -96,22 +186,19 @@ def calculate_alcohol_causalities(df: pd.DataFrame, verbose: bool = False):
 
     Parameters
     ----------
-    df : pd.DataFrame
-        Dataframe
+    df : pd.DataFrame or Iterable
+        Dataframe or chunks of dataset, see iter_dataframes.
     verbose : Bool
         When set to True, print the output to stdout.
     Returns
     -------
     Absolute and relative number of casualties
     """
-    alcohol_mask = df["p11"].isin([1, 3, 5, 6, 7, 8, 9])
-    df["alcohol"] = False
-    df.loc[alcohol_mask, "alcohol"] = True
-    # drop invalid values
-    df = df.drop(df[df["p13a"] < 0].index)
-    grouped = df.groupby(["alcohol"]).agg({"p13a": "sum"})
-    absolute_alcohol_causalities = grouped.loc[True]["p13a"]
-    no_alcohol_causalities = grouped.loc[False]["p13a"]
+    # invalid values are not counted
+    grouped = count_alcohol(df, lambda df: pd.Series(0, index=df.index), ["p13a"],
+                            weights=lambda df: df["p13a"].clip(lower=0))
+    absolute_alcohol_causalities = grouped.loc[0, True]
+    no_alcohol_causalities = grouped.loc[0, False]
     relative_alcohol_causalities = 100 * absolute_alcohol_causalities / (absolute_alcohol_causalities +
                                                                          no_alcohol_causalities)
     if verbose:
@@ -126,18 +213,15 @@ def alcohol_vehicle_category(df: pd.DataFrame, verbose: bool = False):
 
     Parameters
     ----------
-    df : pd.DataFrame
-        Dataframe
+    df : pd.DataFrame or Iterable
+        Dataframe or chunks of dataset, see iter_dataframes.
     verbose : Bool
         When set to True, print the output to stdout.
     Returns
     -------
     Resulting dataframe.
     """
-    # drop invalid and unknown values
-    df = df.drop(df[(df["p44"] < 0) | (df["p44"] == 17) | (df["p44"] == 18)].index)
-
-    df["Druh vozidla"] = df["p44"].map({
+    vehicles = {
         0: "Moped",
         1: "Malý motocykl",
         2: "Motocykl",
@@ -156,17 +240,21 @@ def alcohol_vehicle_category(df: pd.DataFrame, verbose: bool = False):
         15: "Jiné nemotorové",
         16: "Vlak",
         18: "Jiné"
-    })
+    }
 
-    alcohol_mask = df["p11"].isin([1, 3, 5, 6, 7, 8, 9])
-    df["Poměr nehod"] = 1
-    df_alcohol = df[alcohol_mask].copy()
-    df_no_alcohol = df[~alcohol_mask].copy()
+    def vehicle(df):
+        # invalid and unknown values are not counted
+        valid = (df["p44"] >= 0) & (df["p44"] != 17) & (df["p44"] != 18)
+        return df["p44"].where(valid).map(vehicles).rename("Druh vozidla")
 
-    alcohol_grouped = df_alcohol.groupby(["Druh vozidla"]).agg({"Poměr nehod": "sum"})
-    no_alcohol_grouped = df_no_alcohol.groupby(["Druh vozidla"]).agg({"Poměr nehod": "sum"})
+    counts = count_alcohol(df, vehicle, ["p44"])
+    counts = counts[counts.index.notna()]
+    alcohol_grouped = counts[True].to_frame("Poměr nehod")
+    no_alcohol_grouped = counts[False].to_frame("Poměr nehod")
 
     result = 100 * alcohol_grouped / (alcohol_grouped + no_alcohol_grouped)
+    # categories with accidents of one kind only are left out
+    result = result.where((alcohol_grouped > 0) & (no_alcohol_grouped > 0))
     result = result.dropna().sort_values("Poměr nehod", ascending=False)
     if verbose:
         print("Tabulka relativních počtů nehod pod vlivem alkoholu v jednotlivých kategoriích:")
@@ -176,8 +264,36 @@ def alcohol_vehicle_category(df: pd.DataFrame, verbose: bool = False):
     return result
 
 
+def main(argv=None):
+    """Main function
+
+    Parameters
+    ----------
+    argv Argument vector passed to the ArgumentParser.
+    Following arguments are defined and can be passed from command line:
+        --force : Draw the plot even when it is up to date.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Draw the plot even when neither data nor plotting code changed."
+    )
+    args = parser.parse_args(argv)
+
+    from render import FigureJob, stale_figures
+    job = FigureJob("alcohol", "doc", "plot_alcohol", "outputs/alcohol_fig.pdf")
+    cache, stale = stale_figures([job], force=args.force)
+    # the plot is drawn from count cube, tables are counted chunk by chunk
+    downloader = DataDownloader()
+    if job in stale:
+        plot_alcohol(downloader.get_cube("p11"), job.fig_location, show_figure=True)
+        cache.store(job, stale[job])
+        cache.save()
+    calculate_alcohol_causalities(downloader.iter_chunks(columns=["p11", "p13a"]),
+                                  verbose=True)
+    alcohol_vehicle_category(downloader.iter_chunks(columns=["p11", "p44"]), verbose=True)
+
+
 if __name__ == "__main__":
-    dataframe = get_dataframe("accidents.pkl.gz")
-    plot_alcohol(dataframe, "outputs/alcohol_fig.pdf", show_figure=True)
-    calculate_alcohol_causalities(dataframe, verbose=True)
-    alcohol_vehicle_category(dataframe, verbose=True)
+    main()
@@ -5,17 +5,30 @@
 __author__ = "David Sedlák"
 __email__ = "xsedla1d@stud.fit.vutbr.cz"
 
+import argparse
+import collections
+import contextlib
 import csv
+import functools
 import glob
 import gzip
+import hashlib
 import io
+import itertools
+import json
 import numpy as np
 import os
 import pickle
 import regex as re
 import requests
+import shutil
+import tempfile
+import threading
+import time
 import zipfile
 from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from email.utils import formatdate
 
 
 def int_validator(val, ranges=None, invalid_value=-1):
@@ -93,6 +106,1098 @@ def date_validator(val, invalid_value=np.datetime64('nat')):
         return invalid_value
 
 
+def _ascii_digits_to_int(values):
+    """Convert array of strings consisting only of ASCII digits to integers.
+
+    Conversion works directly on the code points of fixed width numpy strings,
+    which is much faster than casting each string separately.
+
+    Parameters
+    ----------
+    values : ndarray of str
+        Values to convert.
+    Returns
+    -------
+    Tuple (ints, converted), where converted is mask of values which consist only
+    of ASCII digits and ints holds their converted value (0 elsewhere).
+    """
+    values = np.ascontiguousarray(values)
+    width = values.dtype.itemsize // 4
+    ints = np.zeros(values.size, dtype=np.int64)
+    if not values.size or not width:
+        return ints, np.zeros(values.size, dtype=bool)
+
+    codes = values.view(np.uint32).reshape(values.size, width)
+    present = codes != 0
+    digits = codes.astype(np.int64) - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+    # strings are padded by zeros, values with more than 18 digits could overflow
+    converted = ((is_digit | ~present).all(axis=1) & present[:, 0]
+                 & (present.sum(axis=1) <= 18))
+    for i in range(min(width, 18)):
+        ints = np.where(present[:, i], ints * 10 + digits[:, i], ints)
+    ints[~converted] = 0
+    return ints, converted
+
+
+def int_array_validator(values, ranges=None, invalid_value=-1):
+    """Validate and convert whole array of integer like values at once.
+
+    Vectorized counterpart of int_validator, which produces exactly the same
+    results. Plain decimal values are converted in bulk, the remaining (usually
+    only a handful of distinct) values are converted by int() one by one.
+
+    Parameters
+    ----------
+    values : array_like of str
+        Values to convert and validate.
+    ranges : Iterable, optional
+        Iterable containing tuples specifying allowed ranges, see int_validator.
+    invalid_value : Int, optional
+        Value used for entries which can't be converted or are out of range.
+    Returns
+    -------
+    ndarray of int64 with converted and validated values.
+    """
+    values = np.char.strip(np.asarray(values, dtype=str))
+    ints, valid = _ascii_digits_to_int(values)
+
+    # int() also accepts signs, underscores etc., handle those per unique value
+    rest = np.flatnonzero(~valid)
+    if rest.size:
+        uniq, inverse = np.unique(values[rest], return_inverse=True)
+        uniq_ints = np.zeros(uniq.shape, dtype=np.int64)
+        uniq_valid = np.zeros(uniq.shape, dtype=bool)
+        for i, val in enumerate(uniq):
+            try:
+                uniq_ints[i] = int(val)
+                uniq_valid[i] = True
+            except ValueError:
+                pass
+        ints[rest] = uniq_ints[inverse]
+        valid[rest] = uniq_valid[inverse]
+
+    if ranges:
+        in_range = np.zeros(values.shape, dtype=bool)
+        for (left, right) in ranges:
+            in_range |= (left <= ints) & (ints <= right)
+        valid &= in_range
+    return np.where(valid, ints, invalid_value)
+
+
+def float_array_validator(values, invalid_value=float("NaN")):
+    """Convert whole array of float like values at once.
+
+    Vectorized counterpart of float_validator, which produces exactly the same
+    results.
+
+    Parameters
+    ----------
+    values : array_like of str
+        Values to convert.
+    invalid_value : Float, optional
+        Value used for entries which can't be converted to FP.
+    Returns
+    -------
+    ndarray of float64 with converted values.
+    """
+    values = np.asarray(values, dtype=str)
+    result = np.full(values.shape, invalid_value, dtype=np.float64)
+    if not values.size:
+        return result
+    values = np.char.replace(values, ",", ".")
+    # plain numbers are converted in bulk
+    simple = ((np.char.strip(values, "0123456789.-") == "")
+              & (np.char.str_len(values) > 0))
+    try:
+        result[simple] = values[simple].astype(np.float64)
+    except ValueError:
+        simple[:] = False
+
+    # the rest is converted per unique value
+    rest = np.flatnonzero(~simple)
+    if rest.size:
+        uniq, inverse = np.unique(values[rest], return_inverse=True)
+        converted = np.array([float_validator(val, invalid_value) for val in uniq],
+                             dtype=np.float64)
+        result[rest] = converted[inverse]
+    return result
+
+
+def date_array_validator(values, invalid_value=np.datetime64('nat')):
+    """Convert whole array of date values at once.
+
+    Vectorized counterpart of date_validator, which produces exactly the same
+    results.
+
+    Parameters
+    ----------
+    values : array_like of str
+        Values to convert.
+    invalid_value : datetime64, optional
+        Value to use as a fill for invalid entries.
+    Returns
+    -------
+    ndarray of datetime64[D] with converted values.
+    """
+    values = np.asarray(values, dtype=str)
+    try:
+        return values.astype("datetime64[D]")
+    except ValueError:
+        # dataset contains only few distinct dates, so convert unique values only
+        uniq, inverse = np.unique(values, return_inverse=True)
+        converted = np.array([date_validator(val, invalid_value) for val in uniq],
+                             dtype="datetime64[D]")
+        return converted[inverse]
+
+
+def split_csv_columns(text, columns, delimiter=";", quotechar='"', usecols=None):
+    """Split whole CSV text into columns of raw string values at once.
+
+    Positions of delimiters and line ends outside of quotes are found over code
+    points of the whole text, values are then gathered column by column directly
+    into numpy string arrays. Only regular files are handled, where each row has
+    the same number of fields and each field is either quoted as a whole or
+    doesn't contain quotechar at all.
+
+    Parameters
+    ----------
+    text : String
+        Content of CSV file.
+    columns : Int
+        Expected number of fields in each row.
+    delimiter : String, optional
+        Character separating individual fields.
+    quotechar : String, optional
+        Character used to quote fields.
+    usecols : Iterable, optional
+        Indexes of columns to extract, other columns are returned as None.
+        When not specified, all columns are extracted.
+    Returns
+    -------
+    List of ndarrays with raw values for each column or None when text isn't
+    regular and has to be parsed by csv module instead.
+    """
+    # universal newlines, same as when reading through TextIOWrapper
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if not text.endswith("\n"):
+        text += "\n"
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+    is_quote = codes == ord(quotechar)
+    quotes_before = np.cumsum(is_quote, dtype=np.int32)
+    outside = (quotes_before & 1) == 0
+    is_eol = (codes == ord("\n")) & outside
+    ends = np.flatnonzero(((codes == ord(delimiter)) & outside) | is_eol)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    # every row has to have exactly expected number of fields
+    rows = np.count_nonzero(is_eol)
+    if ends.size != rows * columns or not is_eol[ends[columns - 1::columns]].all():
+        return None
+
+    # fields are either quoted as a whole or contain no quotes at all
+    quotes = quotes_before[np.maximum(ends - 1, 0)] - np.where(
+        starts > 0, quotes_before[starts - 1], 0)
+    quotes[ends == starts] = 0
+    quoted = quotes == 2
+    if not np.all((quotes == 0) | (quoted & is_quote[starts]
+                                   & is_quote[np.maximum(ends - 1, 0)]
+                                   & (ends - starts >= 2))):
+        return None
+    starts += quoted
+    ends -= quoted
+
+    usecols = range(columns) if usecols is None else set(usecols)
+    result = []
+    for column in range(columns):
+        if column not in usecols:
+            result.append(None)
+            continue
+        col_starts = starts[column::columns]
+        lengths = ends[column::columns] - col_starts
+        width = max(int(lengths.max(initial=0)), 1)
+        offsets = np.arange(width)
+        gathered = codes[np.minimum(col_starts[:, None] + offsets, codes.size - 1)]
+        gathered[offsets >= lengths[:, None]] = 0
+        result.append(np.ascontiguousarray(gathered).view(f"<U{width}").reshape(rows))
+    return result
+
+
+class IntField:
+    """Validator of integer fields usable both per value and per whole column.
+
+    Attributes
+    ----------
+    ranges Allowed ranges of values, see int_validator.
+    fill Dictionary with {stripped raw value : value} of special values which
+        are mapped directly without validation (e.g. empty fields).
+    invalid_value Value used for invalid entries.
+    """
+
+    def __init__(self, ranges=None, fill=None, invalid_value=-1):
+        """Initializer which sets validation rules of the field.
+
+        Parameters
+        ----------
+        ranges : Iterable, optional
+            Iterable containing tuples specifying allowed ranges.
+        fill : Dictionary, optional
+            Special raw values mapped directly to given value.
+        invalid_value : Int, optional
+            Value used for entries which can't be converted or are out of range.
+        """
+        self.ranges = ranges
+        self.fill = fill or {}
+        self.invalid_value = invalid_value
+
+    def __call__(self, val):
+        """Validate and convert single value, same as int_validator."""
+        stripped = val.strip()
+        if stripped in self.fill:
+            return self.fill[stripped]
+        return int_validator(val, self.ranges, self.invalid_value)
+
+    def array(self, values):
+        """Validate and convert whole column, same as int_array_validator."""
+        values = np.char.strip(np.asarray(values, dtype=str))
+        result = int_array_validator(values, self.ranges, self.invalid_value)
+        for raw, value in self.fill.items():
+            result[values == raw] = value
+        return result
+
+
+# vectorized counterparts of plain validators used in DataDownloader.headers
+array_validators = {
+    int_validator: int_array_validator,
+    float_validator: float_array_validator,
+    date_validator: date_array_validator,
+}
+
+
+def convert_column(values, dtype, validator=None):
+    """Convert whole column of raw CSV values to numpy array at once.
+
+    Parameters
+    ----------
+    values : array_like of str
+        Raw values of the column.
+    dtype : numpy dtype
+        Resulting data type of the column.
+    validator : callable, optional
+        Validator of the column as used in DataDownloader.headers.
+    Returns
+    -------
+    ndarray with converted column.
+    """
+    if validator is None:
+        return np.asarray(values, dtype=dtype)
+    if isinstance(validator, IntField):
+        return validator.array(values).astype(dtype)
+    if validator in array_validators:
+        return array_validators[validator](values).astype(dtype)
+    # unknown validator, convert it value by value
+    return np.array([validator(val) for val in values], dtype=dtype)
+
+
+class ColumnDict(dict):
+    """Dictionary with dataset columns {header : ndarray}, which can hold
+    dictionary-encoded columns.
+
+    Values of dictionary-encoded columns are small unsigned integer codes, which
+    index the array of categories of given column.
+
+    Attributes
+    ----------
+    categories Dictionary with {header : ndarray of categories} of all
+        dictionary-encoded columns.
+    """
+
+    def __init__(self, columns=(), categories=None):
+        """Initializer which sets columns and categories of encoded columns.
+
+        Parameters
+        ----------
+        columns : Dictionary or Iterable, optional
+            Columns in any form accepted by dict.
+        categories : Dictionary, optional
+            Dictionary with {header : ndarray of categories}.
+        """
+        super().__init__(columns)
+        self.categories = dict(categories or {})
+
+    def decode(self, column):
+        """Return values of column, with dictionary-encoded values decoded.
+
+        Parameters
+        ----------
+        column : String
+            Name of the column.
+        Returns
+        -------
+        ndarray with values of the column.
+        """
+        if column in self.categories:
+            return self.categories[column][self[column]]
+        return self[column]
+
+    def copy(self):
+        """Return shallow copy, which keeps categories of encoded columns."""
+        return ColumnDict(self, self.categories)
+
+
+def code_dtype(size):
+    """Get the smallest unsigned integer data type for codes of given categories.
+
+    Parameters
+    ----------
+    size : Int
+        Number of categories.
+    Returns
+    -------
+    numpy data type.
+    """
+    return np.min_scalar_type(max(size - 1, 0))
+
+
+def encode_strings(values):
+    """Dictionary-encode array of values.
+
+    Parameters
+    ----------
+    values : ndarray
+        Values to encode.
+    Returns
+    -------
+    Tuple (codes, categories), where categories are sorted unique values and codes
+    index them.
+    """
+    categories, codes = np.unique(values, return_inverse=True)
+    return codes.astype(code_dtype(categories.size)), categories
+
+
+def merge_categories(parts):
+    """Merge dictionary-encoded columns with different categories.
+
+    Parameters
+    ----------
+    parts : List
+        List of tuples (codes, categories) to merge.
+    Returns
+    -------
+    Tuple (codes, categories) of merged column.
+    """
+    first = parts[0][1]
+    if all(np.array_equal(categories, first) for _, categories in parts):
+        return np.concatenate([codes for codes, _ in parts]), first
+    merged = np.unique(np.concatenate([categories for _, categories in parts]))
+    dtype = code_dtype(merged.size)
+    codes = [np.searchsorted(merged, categories).astype(dtype)[codes]
+             for codes, categories in parts]
+    return np.concatenate(codes), merged
+
+
+def concat_columns(parts, columns=None):
+    """Concatenate parts of dataset, merging categories of encoded columns.
+
+    Parameters
+    ----------
+    parts : List
+        Non-empty list of dictionaries {header : ndarray} or ColumnDicts with the
+        same encoded columns.
+    columns : Iterable, optional
+        Names of columns to concatenate. When None, all columns of first part are
+        concatenated.
+    Returns
+    -------
+    ColumnDict with concatenated columns, columns of single part are not copied.
+    """
+    categories = getattr(parts[0], "categories", {})
+    result = ColumnDict()
+    for column in parts[0] if columns is None else columns:
+        if len(parts) == 1:
+            result[column] = parts[0][column]
+            if column in categories:
+                result.categories[column] = categories[column]
+        elif column in categories:
+            result[column], result.categories[column] = merge_categories(
+                [(part[column], part.categories[column]) for part in parts])
+        else:
+            result[column] = np.concatenate([part[column] for part in parts])
+    return result
+
+
+def to_dataframe(data):
+    """Wrap dataset in pandas DataFrame without copying its columns.
+
+    Parameters
+    ----------
+    data : ColumnDict
+        Dataset with encoded columns, which become categorical columns built from
+        their codes. Column "date" is derived from p2a, when it's included.
+    Returns
+    -------
+    pandas.DataFrame with the dataset.
+    """
+    # pandas is needed only here, the rest of the module works without it
+    import pandas as pd
+
+    frame = {}
+    for column, values in data.items():
+        if column in data.categories:
+            frame[column] = pd.Categorical.from_codes(values, data.categories[column])
+        else:
+            frame[column] = values
+    df = pd.DataFrame(frame, copy=False)
+    if "p2a" in df:
+        df["date"] = df["p2a"]
+    return df
+
+
+def narrow_int(values):
+    """Convert integer values to the smallest signed data type holding them all.
+
+    Parameters
+    ----------
+    values : ndarray
+        Integer values to convert.
+    Returns
+    -------
+    ndarray with converted values.
+    """
+    low, high = (values.min(), values.max()) if values.size else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return values.astype(dtype)
+    return values.astype(np.int64)
+
+
+@contextlib.contextmanager
+def atomic_open(filename, mode="wb"):
+    """Open temporary file which replaces given file once it's completely written.
+
+    Concurrent writers and interrupted runs therefore can't leave partially
+    written file behind.
+
+    Parameters
+    ----------
+    filename : String
+        Path to the resulting file.
+    mode : String, optional
+        Mode in which the temporary file is opened.
+    Returns
+    -------
+    Context manager yielding file object of the temporary file.
+    """
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+
+
+def _remove_files(*filenames):
+    """Remove given files, when they exist."""
+    for filename in filenames:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(filename)
+
+
+def conditional_headers(version):
+    """Prepare headers of conditional request for file of given version.
+
+    Parameters
+    ----------
+    version : Dictionary
+        Version of the file as returned by response_version.
+    Returns
+    -------
+    Dictionary with If-None-Match and If-Modified-Since headers, when known.
+    """
+    headers = {}
+    if version.get("etag"):
+        headers["If-None-Match"] = version["etag"]
+    if version.get("last_modified"):
+        headers["If-Modified-Since"] = version["last_modified"]
+    return headers
+
+
+def response_version(response):
+    """Get version of downloaded file from its response headers.
+
+    Parameters
+    ----------
+    response : requests.Response
+        Response of the request.
+    Returns
+    -------
+    Dictionary with ETag and Last-Modified of the file, when known.
+    """
+    version = {}
+    if response.headers.get("ETag"):
+        version["etag"] = response.headers["ETag"]
+    if response.headers.get("Last-Modified"):
+        version["last_modified"] = response.headers["Last-Modified"]
+    return version
+
+
+def count_cube(dates, values):
+    """Count records by day and value using np.bincount.
+
+    Parameters
+    ----------
+    dates : ndarray of datetime64[D]
+        Dates of records, NaT for records without valid date.
+    values : ndarray of int
+        Values of records.
+    Returns
+    -------
+    Dictionary with "days" sorted ndarray of days with records (NaT last),
+    "offset" the first value and "counts" ndarray of int64 [day, value].
+    """
+    days, index = np.unique(dates, return_inverse=True)
+    values = np.asarray(values, dtype=np.int64)
+    offset = int(values.min()) if values.size else 0
+    n_values = int(values.max()) - offset + 1 if values.size else 0
+    counts = np.bincount(index.ravel() * n_values + (values - offset),
+                         minlength=len(days) * n_values)
+    return {"days": days, "offset": offset,
+            "counts": counts.reshape(len(days), n_values)}
+
+
+def align_cube(cube, days, offset, n_values):
+    """Place cube produced by count_cube into larger range of days and values.
+
+    Parameters
+    ----------
+    cube : Dictionary
+        Cube to align, its days and values have to be within the new range.
+    days : ndarray of datetime64[D]
+        Sorted days of the new range.
+    offset : Int
+        First value of the new range.
+    n_values : Int
+        Number of values of the new range.
+    Returns
+    -------
+    ndarray of int64 with counts [day, value].
+    """
+    counts = np.zeros((len(days), n_values), dtype=np.int64)
+    value = cube["offset"] - offset
+    rows = np.searchsorted(days, cube["days"])
+    counts[rows, value:value + cube["counts"].shape[1]] = cube["counts"]
+    return counts
+
+
+def merge_cubes(*cubes):
+    """Add cubes produced by count_cube, extending their ranges as needed.
+
+    Parameters
+    ----------
+    cubes : Dictionaries
+        Cubes to add.
+    Returns
+    -------
+    Dictionary with merged cube.
+    """
+    counted = [cube for cube in cubes if cube["counts"].size] or cubes[:1]
+    days = np.unique(np.concatenate([cube["days"] for cube in counted]))
+    offset = min(cube["offset"] for cube in counted)
+    n_values = max(cube["offset"] - offset + cube["counts"].shape[1]
+                   for cube in counted)
+    counts = sum(align_cube(cube, days, offset, n_values) for cube in counted)
+    return {"days": days, "offset": offset, "counts": counts}
+
+
+@functools.lru_cache(maxsize=None)
+def _transformer(source_crs, crs):
+    from pyproj import Transformer
+    return Transformer.from_crs(source_crs, crs, always_xy=True)
+
+
+def project_coordinates(x, y, crs="EPSG:3857", source_crs="EPSG:5514"):
+    """Transform coordinates between coordinate reference systems at once.
+
+    Parameters
+    ----------
+    x, y : ndarray
+        Coordinates, e.g. columns d and e in S-JTSK (EPSG:5514).
+    crs : String, optional
+        Target coordinate reference system.
+    source_crs : String, optional
+        Coordinate reference system of x and y.
+    Returns
+    -------
+    Tuple (x, y) of float64 ndarrays, NaN for missing coordinates.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    missing = np.isnan(x) | np.isnan(y)
+    result_x, result_y = _transformer(source_crs, crs).transform(x, y)
+    result_x = np.asarray(result_x, dtype=np.float64)
+    result_y = np.asarray(result_y, dtype=np.float64)
+    result_x[missing] = np.nan
+    result_y[missing] = np.nan
+    return result_x, result_y
+
+
+class CountCube:
+    """Numbers of accidents by region, day and value of single column.
+
+    Attributes
+    ----------
+    column Name of the counted column.
+    regions List of shortnames of regions.
+    dates Sorted ndarray of days with accidents, NaT (last) counts records without
+        date.
+    values ndarray of values of the column.
+    counts ndarray of int64 with numbers of accidents [region, day, value].
+    """
+
+    def __init__(self, column, regions, dates, values, counts):
+        self.column = column
+        self.regions = list(regions)
+        self.dates = dates
+        self.values = values
+        self.counts = counts
+
+    @classmethod
+    def stack(cls, column, regions, cubes):
+        """Combine cubes of regions produced by count_cube.
+
+        Parameters
+        ----------
+        column : String
+            Name of the counted column.
+        regions : List
+            Shortnames of regions.
+        cubes : List
+            Cube of each region, see count_cube.
+        Returns
+        -------
+        New CountCube.
+        """
+        merged = merge_cubes(*cubes)
+        n_values = merged["counts"].shape[1]
+        counts = np.stack([align_cube(cube, merged["days"], merged["offset"], n_values)
+                           for cube in cubes])
+        values = merged["offset"] + np.arange(n_values)
+        return cls(column, regions, merged["days"], values, counts)
+
+    @classmethod
+    def from_columns(cls, data, column):
+        """Count already loaded records, counterpart of DataDownloader.get_cube.
+
+        Parameters
+        ----------
+        data : Dictionary or pd.DataFrame
+            Dataset with "region", "p2a" and counted column, e.g. from get_dict.
+        column : String
+            Name of categorical integer column to count.
+        Returns
+        -------
+        New CountCube with sorted regions.
+        Raises
+        ------
+        ValueError when values of the column span more than
+        DataDownloader.cube_max_values values.
+        """
+        regions = data.decode("region") if hasattr(data, "decode") else data["region"]
+        names, inverse = np.unique(np.asarray(regions), return_inverse=True)
+        inverse = inverse.ravel()
+        dates = np.asarray(data["p2a"]).astype("datetime64[D]")
+        values = np.asarray(data[column]).astype(np.int64)
+        n_values = int(values.max()) - int(values.min()) + 1 if values.size else 0
+        if n_values > DataDownloader.cube_max_values:
+            raise ValueError(f"Column '{column}' spans {n_values} values, count cubes "
+                             f"are limited to {DataDownloader.cube_max_values} values")
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.searchsorted(inverse[order], np.arange(len(names) + 1))
+        cubes = [count_cube(dates[order[start:end]], values[order[start:end]])
+                 for start, end in zip(bounds[:-1], bounds[1:])]
+        return cls.stack(column, [str(name) for name in names], cubes)
+
+    def select(self, regions=None, start=None, end=None, values=None):
+        """Select part of the cube.
+
+        Parameters
+        ----------
+        regions : Iterable, optional
+            Shortnames of regions to select, in given order.
+        start : String or numpy.datetime64, optional
+            First day to select, records without date are left out when set.
+        end : String or numpy.datetime64, optional
+            Day after the last day to select, records without date are left out
+            when set.
+        values : Iterable, optional
+            Values to select, in given order. Values out of range of the cube
+            have zero counts.
+        Returns
+        -------
+        New CountCube.
+        """
+        counts = self.counts
+        dates = self.dates
+        region_names = self.regions
+        if regions is not None:
+            region_names = list(regions)
+            counts = counts[[self.regions.index(region) for region in region_names]]
+        if start is not None or end is not None:
+            keep = ~np.isnat(dates)
+            if start is not None:
+                keep &= dates >= np.datetime64(start, "D")
+            if end is not None:
+                keep &= dates < np.datetime64(end, "D")
+            dates, counts = dates[keep], counts[:, keep]
+        selected = self.values
+        if values is not None:
+            selected = np.asarray(list(values), dtype=np.int64)
+            index = selected - (self.values[0] if self.values.size else 0)
+            inside = (index >= 0) & (index < self.values.size)
+            padded = np.concatenate([counts, np.zeros(counts.shape[:2] + (1,),
+                                                      dtype=counts.dtype)], axis=2)
+            counts = padded[:, :, np.where(inside, index, -1)]
+        return CountCube(self.column, region_names, dates, selected, counts)
+
+    def total(self):
+        """Return ndarray with numbers of accidents [region, value]."""
+        return self.counts.sum(axis=1)
+
+    def group_dates(self, unit):
+        """Sum counts of days by date unit, records without date are left out.
+
+        Parameters
+        ----------
+        unit : String
+            "Y" (year), "M" (month), "D" (day) or "weekday" (0 is Monday).
+        Returns
+        -------
+        Tuple (keys, counts), where keys is ndarray of years, months or days as
+        datetime64 (integer weekdays for "weekday") and counts ndarray of int64
+        [region, key, value].
+        """
+        dated = ~np.isnat(self.dates)
+        dates, counts = self.dates[dated], self.counts[:, dated]
+        if unit == "weekday":
+            keys = np.arange(7)
+            # 1970-01-01 was Thursday
+            inverse = (dates.astype(np.int64) + 3) % 7
+        else:
+            keys, inverse = np.unique(dates.astype(f"datetime64[{unit}]"),
+                                      return_inverse=True)
+        result = np.zeros((counts.shape[0], len(keys), counts.shape[2]),
+                          dtype=np.int64)
+        np.add.at(result, (slice(None), inverse), counts)
+        return keys, result
+
+
+def grid_index(x, y, cell_size):
+    """Sort points by cells of uniform grid.
+
+    Parameters
+    ----------
+    x, y : ndarray
+        Coordinates of points, points with NaN coordinates are left out.
+    cell_size : Float
+        Size of grid cell in units of coordinates.
+    Returns
+    -------
+    Dictionary with "keys" (sorted int64 keys of cells, see cell_keys) and
+    "order" (indices of points in the same order).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(x) & ~np.isnan(y))
+    keys = cell_keys(np.floor(x[valid] / cell_size), np.floor(y[valid] / cell_size))
+    order = np.argsort(keys, kind="stable")
+    return {"keys": keys[order], "order": valid[order].astype(np.int64)}
+
+
+def cell_keys(column, row):
+    """Combine grid cell coordinates into int64 keys ordered by column and row."""
+    return np.asarray(column, dtype=np.int64) * (1 << 32) + np.asarray(row, dtype=np.int64)
+
+
+class SpatialIndex:
+    """Uniform grid index over coordinates of accidents.
+
+    Points are sorted by their grid cells, so points of a column of cells are
+    found by binary search and only points of cells touching the query are
+    compared with it. Each region has its own part of the index.
+
+    Attributes
+    ----------
+    cell_size Size of grid cell in units of coordinates.
+    parts List of dictionaries with "offset" (index of the first record of the
+        region in get_dict), "keys" and "order" (see grid_index) and "x" and "y"
+        (coordinates of records of the region).
+    """
+
+    def __init__(self, cell_size, parts):
+        self.cell_size = cell_size
+        self.parts = parts
+        keys = np.concatenate([part["keys"] for part in parts] + [np.zeros(0, np.int64)])
+        columns = (keys + (1 << 31)) // (1 << 32)
+        rows = keys - columns * (1 << 32)
+        # bounds of indexed cells, nothing is found farther
+        self._bounds = ((columns.min(), rows.min(), columns.max() + 1, rows.max() + 1)
+                        if keys.size else None)
+
+    def __len__(self):
+        return sum(len(part["keys"]) for part in self.parts)
+
+    def _candidates(self, part, xmin, ymin, xmax, ymax):
+        """Return indices of records of part in cells touching bounding box."""
+        columns = np.arange(np.floor(xmin / self.cell_size),
+                            np.floor(xmax / self.cell_size) + 1)
+        row_min = np.floor(ymin / self.cell_size)
+        row_max = np.floor(ymax / self.cell_size)
+        starts = np.searchsorted(part["keys"], cell_keys(columns, row_min), "left")
+        ends = np.searchsorted(part["keys"], cell_keys(columns, row_max), "right")
+        lengths = ends - starts
+        # concatenated ranges starts[i]:ends[i]
+        positions = (np.arange(lengths.sum())
+                     - np.repeat(np.cumsum(lengths) - lengths - starts, lengths))
+        return part["order"][positions]
+
+    def bbox(self, xmin, ymin, xmax, ymax):
+        """Find records inside bounding box (including its border).
+
+        Returns
+        -------
+        Sorted ndarray of indices of records in get_dict of the indexed regions.
+        """
+        result = []
+        for part in self.parts:
+            rows = self._candidates(part, xmin, ymin, xmax, ymax)
+            x, y = part["x"][rows], part["y"][rows]
+            inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+            result.append(np.sort(rows[inside]) + part["offset"])
+        return np.concatenate(result) if result else np.zeros(0, dtype=np.int64)
+
+    def radius(self, x, y, radius):
+        """Find records within distance from point.
+
+        Returns
+        -------
+        Tuple (indices of records in get_dict of the indexed regions, distances),
+        ordered from the nearest record.
+        """
+        rows = []
+        distances = []
+        for part in self.parts:
+            candidates = self._candidates(part, x - radius, y - radius,
+                                          x + radius, y + radius)
+            distance = np.hypot(part["x"][candidates] - x, part["y"][candidates] - y)
+            inside = distance <= radius
+            rows.append(candidates[inside] + part["offset"])
+            distances.append(distance[inside])
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        distances = np.concatenate(distances) if distances else np.zeros(0)
+        order = np.lexsort((rows, distances))
+        return rows[order], distances[order]
+
+    def nearest(self, x, y, k=1):
+        """Find k nearest records to point.
+
+        Search radius starts at cell size and doubles until k records are found
+        within it, so only cells around the point are searched.
+
+        Returns
+        -------
+        Tuple (indices of records in get_dict of the indexed regions, distances),
+        ordered from the nearest record, fewer than k when index is smaller.
+        """
+        if self._bounds is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        xmin, ymin, xmax, ymax = np.array(self._bounds) * self.cell_size
+        # distance to the farthest corner of indexed cells
+        farthest = np.hypot(max(x - xmin, xmax - x), max(y - ymin, ymax - y))
+        radius = self.cell_size
+        while True:
+            rows, distances = self.radius(x, y, radius)
+            if len(rows) >= k or radius >= farthest:
+                return rows[:k], distances[:k]
+            radius *= 2
+
+
+def data_size(data):
+    """Estimate memory taken by arrays of dataset.
+
+    Memory-mapped arrays are backed by files in page cache and are not counted.
+
+    Parameters
+    ----------
+    data : Dictionary
+        Dictionary with {header : ndarray}, categories of ColumnDict are counted too.
+    Returns
+    -------
+    Number of bytes.
+    """
+    arrays = list(data.values()) + list(getattr(data, "categories", {}).values())
+    return sum(values.nbytes for values in arrays
+               if not isinstance(values, np.memmap))
+
+
+class LRUCache:
+    """Thread-safe in-memory cache with byte budget and least recently used
+    eviction.
+
+    Attributes
+    ----------
+    budget Maximal total size of cached values in bytes.
+    size Current total size of cached values in bytes.
+    hits Number of lookups which found the value.
+    misses Number of lookups which didn't find the value.
+    evictions Number of values evicted to keep the cache within the budget.
+    """
+
+    def __init__(self, budget=1 << 30, sizeof=data_size):
+        """Initializer which sets budget of the cache.
+
+        Parameters
+        ----------
+        budget : Int, optional
+            Maximal total size of cached values in bytes, 1 GiB by default.
+        sizeof : Callable, optional
+            Function returning size of cached value in bytes.
+        """
+        self.budget = budget
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        """Check presence of key, without counting it as lookup."""
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        """Look up value and mark it as most recently used.
+
+        Parameters
+        ----------
+        key : Hashable
+            Key of the value.
+        default : Any, optional
+            Value returned when key isn't cached.
+        Returns
+        -------
+        Cached value or default.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        """Cache value, evicting least recently used values when over budget.
+
+        Values larger than the whole budget are not cached.
+
+        Parameters
+        ----------
+        key : Hashable
+            Key of the value.
+        value : Any
+            Value to cache.
+        """
+        size = self.sizeof(value)
+        with self._lock:
+            self._pop(key)
+            if size > self.budget:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        """Remove value from the cache.
+
+        Parameters
+        ----------
+        key : Hashable
+            Key of the value.
+        default : Any, optional
+            Value returned when key isn't cached.
+        Returns
+        -------
+        Removed value or default.
+        """
+        with self._lock:
+            return self._pop(key, default)
+
+    def discard(self, predicate):
+        """Remove all values whose keys satisfy predicate.
+
+        Parameters
+        ----------
+        predicate : Callable
+            Function called with key, returning True for keys to remove.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._pop(key)
+
+    def resize(self, budget):
+        """Change budget of the cache, evicting values over the new budget.
+
+        Parameters
+        ----------
+        budget : Int
+            Maximal total size of cached values in bytes.
+        """
+        with self._lock:
+            self.budget = budget
+            self._evict()
+
+    def clear(self):
+        """Remove all values and reset counters."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Return dictionary with counters and current size of the cache."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "entries": len(self._entries),
+                    "size": self.size, "budget": self.budget}
+
+    def _pop(self, key, default=None):
+        if key not in self._entries:
+            return default
+        value, size = self._entries.pop(key)
+        self.size -= size
+        return value
+
+    def _evict(self):
+        while self.size > self.budget:
+            _, (_, size) = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+
+# memory cache shared by DataDownloader instances of the process by default
+shared_cache = LRUCache()
+
+
 class DataDownloader:
     """Handle download and processing of accident statistics dataset provided by PČR.
 
@@ -101,71 +1206,95 @@ class DataDownloader:
     headers List of headers for individual fields in CSV data files.
         Each header is stored as tuple. Where first value is string representing name
         of that header. Second value is numpy data type later used for given fields.
-        And third value is lambda expression for conversion and validation of that given
-        field, if any.
+        And third value is validator used for conversion and validation of that given
+        field, if any. Validators can be called per value (reference parsing engine),
+        vectorized variants are looked up by convert_column.
     regions Dictionary with {region name : CSV_data_file name}
+    parse_engines Names of engines supported by parse_region_data.
+    cache_meta_filename Name of metadata file in each region cache directory.
+    cache_version Version of cache format, caches in other formats are rebuilt.
+    cache_index_filename Name of file with sorted raw p1 values of cached records
+        in each region cache directory.
+    partitioned_dirname Name of directory in folder with dataset partitioned by
+        region and year, see export_partitioned.
+    partition_null Name of partition with records without valid date.
+    cube_filename Template of name of file with count cube of column in each
+        region cache directory.
+    projected_filename Template of name of file with projected coordinates
+        (axis, name of coordinate reference system) in each region cache directory.
+    projected_meta_filename Name of file with {coordinate reference system :
+        number of projected records} in each region cache directory.
+    spatial_index_filename Template of name of file with grid index of coordinates
+        (cell size) in each region cache directory.
+    cube_columns Names of columns whose count cubes are built when region cache
+        is stored, cubes of other categorical integer columns are built on first use.
+    cube_max_values Maximal number of distinct values (maximum - minimum + 1) of
+        column with count cube, cubes are dense in values.
 
     Methods
     -------
     __init__ Initializer which sets needed instance attributes on instance creation.
     download_data Method to download latest dataset from url specified in initializer.
+    download_archive Method to download single archive.
     parse_region_data Method to parse data for specified region.
+    parse_regions_data Method to parse data for several regions at once.
     get_dict Method to obtain dataset for specified regions.
+    get_dataframe Method to obtain dataset as pandas DataFrame.
+    iter_chunks Method to iterate over dataset in chunks of fixed size.
+    export_partitioned Method to store dataset partitioned by region and year.
+    load_partitioned Method to load partitions of dataset matching predicates.
+    get_cube Method to obtain numbers of accidents by region, day and column.
     """
 
     headers = [
         ("p1", "i8", int_validator),
-        ("p36", "i1", lambda v: int_validator(v, [(0, 8)])),
-        ("p37", "i8", lambda v: 0 if v.strip() == ""
-            else int_validator(v, [(0, 99), (101, 999), (1000, 999999)])),
+        ("p36", "i1", IntField([(0, 8)])),
+        ("p37", "i8", IntField([(0, 99), (101, 999), (1000, 999999)], fill={"": 0})),
         ("p2a", 'datetime64[D]', date_validator),
-        ("weekday(p2a)", "i1", lambda v: int_validator(v, [(0, 6)])),
+        ("weekday(p2a)", "i1", IntField([(0, 6)])),
         # Change format of p2b depending on a future usecase of this field. For now
         # storing it as i2 should preserve all needed data including unknown m/h (60/25)
         ("p2b", "i2", int_validator),
-        ("p6", "i1", lambda v: int_validator(v, [(0, 9)])),
-        ("p7", "i1", lambda v: int_validator(v, [(0, 4)])),
-        ("p8", "i1", lambda v: int_validator(v, [(0, 9)])),
-        ("p9", "i1", lambda v: int_validator(v, [(1, 2)])),
-        ("p10", "i1", lambda v: int_validator(v, [(0, 7)])),
-        ("p11", "i1", lambda v: int_validator(v, [(0, 9)])),
-        ("p12", "i2", lambda v: int_validator(v, [(100, 100), (301, 311), (401, 414),
-                                                  (501, 516), (601, 615)])),
+        ("p6", "i1", IntField([(0, 9)])),
+        ("p7", "i1", IntField([(0, 4)])),
+        ("p8", "i1", IntField([(0, 9)])),
+        ("p9", "i1", IntField([(1, 2)])),
+        ("p10", "i1", IntField([(0, 7)])),
+        ("p11", "i1", IntField([(0, 9)])),
+        ("p12", "i2", IntField([(100, 100), (301, 311), (401, 414), (501, 516),
+                                (601, 615)])),
         ("p13a", "i8", int_validator),
         ("p13b", "i8", int_validator),
         ("p13c", "i8", int_validator),
         ("p14", "i8", int_validator),
-        ("p15", "i1", lambda v: int_validator(v, [(1, 6)])),
-        ("p16", "i1", lambda v: int_validator(v, [(0, 9)])),
-        ("p17", "i1", lambda v: int_validator(v, [(1, 12)])),
-        ("p18", "i1", lambda v: int_validator(v, [(0, 7)])),
-        ("p19", "i1", lambda v: int_validator(v, [(1, 7)])),
-        ("p20", "i1", lambda v: int_validator(v, [(0, 6)])),
-        ("p21", "i1", lambda v: int_validator(v, [(0, 6)])),
-        ("p22", "i1", lambda v: int_validator(v, [(0, 9)])),
-        ("p23", "i1", lambda v: int_validator(v, [(0, 3)])),
-        ("p24", "i1", lambda v: 0 if v.strip() == "" else int_validator(v, [(0, 5)])),
-        ("p27", "i1", lambda v: int_validator(v, [(0, 10)])),
-        ("p28", "i1", lambda v: int_validator(v, [(1, 7)])),
+        ("p15", "i1", IntField([(1, 6)])),
+        ("p16", "i1", IntField([(0, 9)])),
+        ("p17", "i1", IntField([(1, 12)])),
+        ("p18", "i1", IntField([(0, 7)])),
+        ("p19", "i1", IntField([(1, 7)])),
+        ("p20", "i1", IntField([(0, 6)])),
+        ("p21", "i1", IntField([(0, 6)])),
+        ("p22", "i1", IntField([(0, 9)])),
+        ("p23", "i1", IntField([(0, 3)])),
+        ("p24", "i1", IntField([(0, 5)], fill={"": 0})),
+        ("p27", "i1", IntField([(0, 10)])),
+        ("p28", "i1", IntField([(1, 7)])),
         ("p34", "i8", int_validator),
-        ("p35", "i1", lambda v: int_validator(v, [(0, 0), (10, 19), (22, 29)])),
-        ("p39", "i1", lambda v: int_validator(v, [(1, 9)])),
-        ("p44", "i1", lambda v: int_validator(v, [(0, 18)])),
-        ("p45a", "i1",
-         lambda v: -2 if v.strip() == "" else int_validator(v, [(0, 99)])),
-        ("p47", "i8", lambda v: -2 if v.strip() == "XX" else int_validator(v)),
-        ("p48a", "i1",
-         lambda v: -2 if v.strip() == "" else int_validator(v, [(0, 18)])),
-        ("p49", "i1", lambda v: -2 if v.strip() == "" else int_validator(v, [(0, 1)])),
-        ("p50a", "i1", lambda v: -2 if v.strip() == "" else int_validator(v, [(0, 4)])),
-        ("p50b", "i1", lambda v: -2 if v.strip() == "" else int_validator(v, [(0, 4)])),
-        ("p51", "i1", lambda v: -2 if v.strip() == "" else int_validator(v, [(1, 3)])),
-        ("p52", "i1",
-         lambda v: -2 if v.strip() == "" else int_validator(v, [(1, 6), (10, 99)])),
+        ("p35", "i1", IntField([(0, 0), (10, 19), (22, 29)])),
+        ("p39", "i1", IntField([(1, 9)])),
+        ("p44", "i1", IntField([(0, 18)])),
+        ("p45a", "i1", IntField([(0, 99)], fill={"": -2})),
+        ("p47", "i8", IntField(fill={"XX": -2})),
+        ("p48a", "i1", IntField([(0, 18)], fill={"": -2})),
+        ("p49", "i1", IntField([(0, 1)], fill={"": -2})),
+        ("p50a", "i1", IntField([(0, 4)], fill={"": -2})),
+        ("p50b", "i1", IntField([(0, 4)], fill={"": -2})),
+        ("p51", "i1", IntField([(1, 3)], fill={"": -2})),
+        ("p52", "i1", IntField([(1, 6), (10, 99)], fill={"": -2})),
         ("p53", "i8", int_validator),
-        ("p55a", "i1", lambda v: int_validator(v, [(0, 9)])),
-        ("p57", "i1", lambda v: int_validator(v, [(0, 9)])),
-        ("p58", "i1", lambda v: int_validator(v, [(0, 5)])),
+        ("p55a", "i1", IntField([(0, 9)])),
+        ("p57", "i1", IntField([(0, 9)])),
+        ("p58", "i1", IntField([(0, 5)])),
         ("a", "d", float_validator),
         ("b", "d", float_validator),
         ("d", "d", float_validator),
@@ -177,14 +1306,14 @@ class DataDownloader:
         ("j", "U", None),
         ("k", "U", None),
         ("l", "U", None),
-        ("n", "i8", lambda v: -2 if v.strip() == "" else int_validator(v)),
+        ("n", "i8", IntField(fill={"": -2})),
         ("o", "U", None),
         ("p", "U", None),
         ("q", "U", None),
-        ("r", "i8", lambda v: -2 if v.strip() == "" else int_validator(v)),
-        ("s", "i8", lambda v: -2 if v.strip() == "" else int_validator(v)),
+        ("r", "i8", IntField(fill={"": -2})),
+        ("s", "i8", IntField(fill={"": -2})),
         ("t", "U", None),
-        ("p5a", "i1", lambda v: int_validator(v, [(0, 1)])),
+        ("p5a", "i1", IntField([(0, 1)])),
     ]
 
     regions = {
@@ -204,144 +1333,1770 @@ class DataDownloader:
         "KVK": "19",
     }
 
-    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/", folder="data",
-                 cache_filename="data_{}.pkl.gz"):
-        """Initializer which sets needed instance attributes on instance creation.
+    parse_engines = ("vectorized", "reference")
+
+    cache_meta_filename = "meta.json"
+    cache_version = 2
+    cache_index_filename = "p1_index.npy"
+    partitioned_dirname = "partitioned"
+    cube_filename = "cube_{}.npz"
+    cube_columns = ["p10", "p11", "p18", "p21", "p24", "p36"]
+    cube_max_values = 256
+    projected_filename = "{}_{}.npy"
+    projected_meta_filename = "projected.json"
+    spatial_index_filename = "grid_{}.npz"
+    partition_null = "__HIVE_DEFAULT_PARTITION__"
+
+    _header_index = {header[0]: i for i, header in enumerate(headers)}
+
+    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/", folder="data",
+                 cache_filename="data_{}", manifest_filename="manifest.json",
+                 download_workers=4, retries=3, backoff=1.0, timeout=60,
+                 mem_cache=None):
+        """Initializer which sets needed instance attributes on instance creation.
+
+        Parameters
+        ----------
+        url : String, optional
+            URL specifying address where dataset can be downloaded.
+        folder : String, optional
+            Path to folder where temporary data will be stored. Is created when
+            it doesn't exist.
+        cache_filename : String, optional
+            String template specifying name of cache directories stored in folder.
+            Each directory holds one .npy file per column and metadata file. Caches
+            in former data_{}.pkl.gz format are migrated automatically.
+        manifest_filename : String, optional
+            Name of file in folder tracking versions of downloaded files and
+            caches built from them.
+        download_workers : Int, optional
+            Maximal number of archives downloaded concurrently.
+        retries : Int, optional
+            Number of retries of failed archive download.
+        backoff : Float, optional
+            Delay in seconds before first retry, doubled with every next retry.
+        timeout : Float, optional
+            Timeout in seconds of individual requests.
+        mem_cache : LRUCache, optional
+            Memory cache for parsed regions and results of get_dict. When None,
+            shared_cache of the process is used, so instances share loaded data.
+        """
+        self.url = url
+        self.folder = os.path.realpath(os.path.relpath(folder))
+        self.cache_filename = os.path.join(self.folder, cache_filename)
+        self.legacy_cache_filename = os.path.join(self.folder, "data_{}.pkl.gz")
+        self.manifest_filename = os.path.join(self.folder, manifest_filename)
+        self.mem_cache = shared_cache if mem_cache is None else mem_cache
+        # regions whose caches were checked for updates by this instance
+        self._checked = set()
+        self.download_workers = download_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(download_workers, 1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __getstate__(self):
+        """Drop memory cache when instance is sent to worker processes."""
+        state = self.__dict__.copy()
+        state["mem_cache"] = None
+        return state
+
+    def __setstate__(self, state):
+        """Use shared memory cache of the worker process."""
+        self.__dict__.update(state)
+        self.mem_cache = shared_cache
+
+    def download_data(self, revalidate=False):
+        """Method to download latest dataset version.
+
+        Versions (ETag, Last-Modified and size) of the index page and of individual
+        archives are tracked in the manifest and conditional requests are used, so
+        unchanged data are not transferred again. When the index page is unchanged,
+        the check costs a single request. Archives are downloaded concurrently by
+        download_archive.
+
+        Parameters
+        ----------
+        revalidate : Bool, optional
+            When set to True, each archive is checked for updates even when the
+            index page is unchanged.
+
+        Returns
+        -------
+        List of names of archives which were downloaded or updated.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        manifest = self._load_manifest()
+        archives = manifest["archives"]
+        headers = {}
+        if not revalidate and all(os.path.isfile(os.path.join(self.folder, name))
+                                  for name in archives):
+            headers = conditional_headers(manifest["index"])
+        r = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        if r.status_code == 304:
+            return []
+        r.raise_for_status()
+        index = response_version(r)
+
+        page = BeautifulSoup(r.content, features="html.parser")
+        [x.parent.decompose() for x in page.find_all(string="neexistuje")]
+        last_buttons = page.select("td:last-of-type button")
+        links = [self.url + re.search("'([^']*)'", button.get('onclick'))[1]
+                 for button in last_buttons]
+        jobs = {}
+        for link in links:
+            name = link.split('/')[-1]
+            file_path = os.path.join(self.folder, name)
+            headers = {}
+            if name in archives and os.path.isfile(file_path):
+                headers = conditional_headers(archives[name])
+            elif zipfile.is_zipfile(file_path):
+                # files downloaded before the manifest existed are checked by mtime
+                headers = conditional_headers({
+                    "last_modified": formatdate(os.path.getmtime(file_path), usegmt=True)})
+            jobs[name] = (link, file_path, headers)
+
+        updated = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(self.download_workers, 1)) as executor:
+            futures = {name: executor.submit(self.download_archive, *job)
+                       for name, job in jobs.items()}
+            for name, future in futures.items():
+                try:
+                    version = future.result()
+                except (OSError, zipfile.BadZipFile) as e:
+                    errors.append(e)
+                    continue
+                if version is not None:
+                    archives[name] = version
+                    updated.append(name)
+        # index is trusted only when all its archives are downloaded, otherwise the
+        # next run would get 304 and never retry the failed ones
+        manifest["index"] = {} if errors else index
+        # keep track of successfully downloaded archives even when some failed
+        self._store_manifest(manifest)
+        if errors:
+            raise errors[0]
+        return updated
+
+    def download_archive(self, link, file_path, headers=None):
+        """Method to download single archive, retrying when download fails.
+
+        Archive is streamed to a partial file next to the destination and moved in
+        place only when it's complete and passes zip integrity check. Interrupted
+        downloads are resumed from partial file using HTTP Range requests.
+
+        Parameters
+        ----------
+        link : String
+            URL of the archive.
+        file_path : String
+            Destination path of the archive.
+        headers : Dictionary, optional
+            Additional headers of the request, e.g. conditional headers.
+        Returns
+        -------
+        Version of downloaded archive or None when archive was not modified.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self._fetch_archive(link, file_path, headers or {})
+            except (OSError, zipfile.BadZipFile):
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _fetch_archive(self, link, file_path, headers):
+        """Single attempt to download archive, see download_archive."""
+        part_filename = file_path + ".part"
+        version_filename = part_filename + ".json"
+        headers = dict(headers)
+        offset = 0
+        part_version = {}
+        if os.path.isfile(part_filename) and os.path.isfile(version_filename):
+            with open(version_filename, "r") as f:
+                part_version = json.load(f)
+            offset = os.path.getsize(part_filename)
+            validator = part_version.get("etag") or part_version.get("last_modified")
+            if offset and validator:
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = validator
+
+        with self.session.get(link, headers=headers, stream=True,
+                              timeout=self.timeout) as r:
+            if r.status_code == 304:
+                _remove_files(part_filename, version_filename)
+                return None
+            if r.status_code == 416:
+                # partial file doesn't match the archive anymore, start over
+                _remove_files(part_filename, version_filename)
+            r.raise_for_status()
+            if r.status_code == 206:
+                version = response_version(r) or part_version
+                size = int(r.headers["Content-Range"].rsplit("/", 1)[1])
+            else:
+                offset = 0
+                version = response_version(r)
+                size = int(r.headers.get("Content-Length", -1))
+                with atomic_open(version_filename, "w") as f:
+                    json.dump(version, f)
+            with open(part_filename, "ab" if offset else "wb") as f:
+                for chunk in r.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+
+        if 0 <= size != os.path.getsize(part_filename):
+            raise IOError(f"Download of {link} is incomplete")
+        try:
+            with zipfile.ZipFile(part_filename, "r") as zf:
+                corrupted = zf.testzip()
+        except zipfile.BadZipFile:
+            corrupted = part_filename
+        if corrupted is not None:
+            _remove_files(part_filename, version_filename)
+            raise zipfile.BadZipFile(f"Downloaded archive {link} is corrupted "
+                                     f"({corrupted})")
+        os.replace(part_filename, file_path)
+        _remove_files(version_filename)
+        return dict(version, size=os.path.getsize(file_path))
+
+    def _load_manifest(self):
+        """Load manifest with versions of downloaded files and caches.
+
+        Returns
+        -------
+        Dictionary with keys "index" (version of index page) and "archives"
+        ({archive name : version}).
+        """
+        manifest = {"index": {}, "archives": {}}
+        try:
+            with open(self.manifest_filename, "r") as f:
+                manifest.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        return manifest
+
+    def _store_manifest(self, manifest):
+        """Store manifest with versions of downloaded files and caches.
+
+        Parameters
+        ----------
+        manifest : Dictionary
+            Manifest in format returned by _load_manifest.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        with atomic_open(self.manifest_filename, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+    def _archive_hashes(self):
+        """Get content hashes of all downloaded archives.
+
+        Hashes are stored in the manifest together with size and modification time
+        of each archive, so they are computed only for new or changed archives.
+
+        Returns
+        -------
+        Dictionary with {archive name : SHA-256 hash} in order of _archives.
+        """
+        manifest = self._load_manifest()
+        hashes = {}
+        changed = False
+        for archive in self._archives():
+            name = os.path.basename(archive)
+            stat = os.stat(archive)
+            version = manifest["archives"].setdefault(name, {})
+            if (version.get("size") != stat.st_size
+                    or version.get("mtime") != stat.st_mtime_ns
+                    or "sha256" not in version):
+                digest = hashlib.sha256()
+                with open(archive, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(block)
+                version.update(size=stat.st_size, mtime=stat.st_mtime_ns,
+                               sha256=digest.hexdigest())
+                changed = True
+            hashes[name] = version["sha256"]
+        if changed:
+            self._store_manifest(manifest)
+        return hashes
+
+    def data_version(self):
+        """Get version of the dataset derived from content of downloaded archives.
+
+        Returns
+        -------
+        String with SHA-256 hash, which changes with any downloaded archive and
+        with version of cache format.
+        """
+        digest = hashlib.sha256(f"{self.cache_version}".encode())
+        for name, archive_hash in sorted(self._archive_hashes().items()):
+            digest.update(f"{name}:{archive_hash}".encode())
+        return digest.hexdigest()
+
+    def cache_fingerprint(self, region):
+        """Get fingerprint of file cache of region, which changes when the cache is
+        rebuilt or extended.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of cached region.
+        Returns
+        -------
+        Dictionary with "version" of cache format and "archives" {archive name :
+        SHA-256 hash} the cache was built from, records of archives appended to
+        the cache follow the previous records, see _append_cache.
+        """
+        meta = self._load_cache_meta(region) or {}
+        return {"version": meta.get("version"), "archives": meta.get("archives", {})}
+
+    def _cache_plan(self, region, hashes, updated=()):
+        """Decide how to bring file cache of region up-to-date.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of region to check.
+        hashes : Dictionary
+            Hashes of downloaded archives as returned by _archive_hashes.
+        updated : Iterable, optional
+            Names of archives updated by the last download, caches which don't
+            record archives they were built from are considered outdated when
+            any archive was updated.
+        Returns
+        -------
+        None when cache is up-to-date, list of names of archives which have to be
+        appended to the cache or True when region has to be parsed from scratch.
+        """
+        meta = self._load_cache_meta(region)
+        if meta is None or meta.get("version") != self.cache_version:
+            return True
+        if "archives" not in meta:
+            return True if updated else None
+        cached = meta["archives"]
+        if any(hashes.get(name) != digest for name, digest in cached.items()):
+            # some archive was changed or removed, cache can't be just extended
+            return True
+        new = [name for name in hashes if name not in cached]
+        return new or None
+
+    def parse_region_data(self, region, engine="vectorized", columns=None,
+                          decode=True):
+        """Method to parse data for specified region.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of region that should be parsed.
+        engine : String, optional
+            Parsing engine to use. "vectorized" (default) reads each CSV file at once
+            and converts whole columns, "reference" converts data value by value.
+            Both engines produce the same results, reference engine is kept to allow
+            comparison of their results and speed.
+        columns : Iterable, optional
+            Names of columns (headers or "region") to include in the result, other
+            fields are not converted at all. When None, all columns are included.
+        decode : Bool, optional
+            When set to True (default), columns have data types given by headers
+            and string columns hold strings. Otherwise string columns and "region"
+            are dictionary-encoded and integer columns are narrowed to the smallest
+            data type holding their values.
+
+        Returns
+        -------
+        Dictionary with headers as key and ndarray as value {header : ndarray},
+        ColumnDict with encoded columns when decode is False.
+        """
+        return self.parse_regions_data([region], engine, columns=columns,
+                                       decode=decode)[region]
+
+    def parse_regions_data(self, regions=None, engine="vectorized", download=True,
+                           columns=None, decode=True):
+        """Method to parse data for several regions in single pass over the archives.
+
+        Each archive is opened only once and CSV files of all requested regions
+        are read from it.
+
+        Parameters
+        ----------
+        regions : Iterable, optional
+            Iterable holding shortnames of regions that should be parsed.
+            When empty or None, all regions are parsed.
+        engine : String, optional
+            Parsing engine to use, see parse_region_data.
+        download : Bool, optional
+            When set to True (default), missing data are downloaded first.
+        columns : Iterable, optional
+            Names of columns to include in the result, see parse_region_data.
+        decode : Bool, optional
+            Whether to decode the columns, see parse_region_data.
+
+        Returns
+        -------
+        Dictionary with {region name : region data}, where region data are in the
+        same format as returned by parse_region_data.
+        """
+        if engine not in self.parse_engines:
+            raise ValueError(f"Unknown parsing engine '{engine}', "
+                             f"use one of {self.parse_engines}")
+        columns = self._select_columns(columns)
+        regions = list(dict.fromkeys(regions)) if regions else list(self.regions)
+
+        if download:
+            # Check if we have all available data and download what's missing...
+            self.download_data()
+        parsed = self._parse_regions(regions, self._archives(), columns, engine)
+        convert = self._decode if decode else self._encode
+        return {region: convert(region_data)
+                for region, (region_data, _) in parsed.items()}
+
+    def _encode(self, region_data):
+        """Dictionary-encode string columns and narrow integer columns.
+
+        Parameters
+        ----------
+        region_data : Dictionary
+            Columns in format returned by parse_region_data, columns which are
+            already encoded (ColumnDict) are kept as they are.
+        Returns
+        -------
+        ColumnDict with encoded columns.
+        """
+        categories = getattr(region_data, "categories", {})
+        result = ColumnDict(categories=categories)
+        for column, values in region_data.items():
+            if column in categories:
+                result[column] = values
+            elif column == "region":
+                # regions share fixed categories, so their codes are stable
+                names = list(self.regions)
+                found, codes = np.unique(values, return_inverse=True)
+                lookup = np.array([names.index(name) for name in found], dtype=int)
+                result.categories[column] = np.array(names)
+                result[column] = lookup[codes].astype(code_dtype(len(names)))
+            elif values.dtype.kind == "U":
+                result[column], result.categories[column] = encode_strings(values)
+            elif values.dtype.kind == "i":
+                result[column] = narrow_int(values)
+            else:
+                result[column] = values
+        return result
+
+    def _decode(self, region_data):
+        """Decode columns to data types given by headers, inverse of _encode.
+
+        Parameters
+        ----------
+        region_data : Dictionary
+            Columns, possibly encoded (ColumnDict).
+        Returns
+        -------
+        Dictionary with headers as key and ndarray as value {header : ndarray}
+        """
+        categories = getattr(region_data, "categories", {})
+        result = {}
+        for column, values in region_data.items():
+            if column in categories:
+                result[column] = categories[column][values]
+            elif column in self._header_index and values.dtype.kind == "i":
+                dtype = self.headers[self._header_index[column]][1]
+                result[column] = values.astype(dtype, copy=False)
+            else:
+                result[column] = values
+        return result
+
+    def _parse_regions(self, regions, archives, columns=None, engine="vectorized",
+                       known_ids=None):
+        """Parse regions from given archives in single pass over them.
+
+        Parameters
+        ----------
+        regions : List
+            Shortnames of regions to parse.
+        archives : List
+            Paths to archives to parse.
+        columns : Iterable, optional
+            Names of columns to include in the result.
+        engine : String, optional
+            Parsing engine to use, see parse_region_data.
+        known_ids : Dictionary, optional
+            Dictionary with {region name : sorted ndarray of raw p1 values} of
+            records which are already known and should be skipped.
+        Returns
+        -------
+        Dictionary with {region name : (region data, sorted ndarray of raw p1
+        values of parsed records)}.
+        """
+        if engine == "reference":
+            read, convert = self._read_csv_rows, self._convert_rows
+        else:
+            read, convert = self._read_csv_columns, self._convert_columns
+        known_ids = known_ids or {}
+        chunks = {region: [] for region in regions}
+        for archive in archives:
+            with zipfile.ZipFile(archive, "r") as zf:
+                for region in regions:
+                    with zf.open(self.regions[region] + ".csv", "r") as f:
+                        chunks[region].append(read(f, columns))
+        return {region: convert(chunks.pop(region), region, columns,
+                                known_ids.get(region))
+                for region in regions}
+
+    def _select_columns(self, columns=None):
+        """Validate names of requested columns.
 
         Parameters
         ----------
-        url : String, optional
-            URL specifying address where dataset can be downloaded.
-        folder : String, optional
-            Path to folder where temporary data will be stored. Is created when
-            it doesn't exist.
-        cache_filename : String, optional
-            String template specifying name of cache files stored in folder.
-            Only *.pkl.gz formats are supported.
+        columns : Iterable, optional
+            Names of requested columns. When None, all columns are selected.
+        Returns
+        -------
+        List of requested column names, in the order they were requested.
         """
-        self.url = url
-        self.folder = os.path.realpath(os.path.relpath(folder))
-        self.cache_filename = os.path.join(self.folder, cache_filename)
-        self.mem_cache = {}
+        all_columns = [header[0] for header in self.headers] + ["region"]
+        if columns is None:
+            return all_columns
+        columns = list(dict.fromkeys(columns))
+        unknown = set(columns) - set(all_columns)
+        if unknown:
+            raise ValueError(f"Unknown columns {sorted(unknown)}")
+        return columns
 
-    def download_data(self):
-        """Method to download latest dataset version."""
-        os.makedirs(self.folder, exist_ok=True)
-        r = requests.get(self.url)
-        page = BeautifulSoup(r.content, features="html.parser")
-        [x.parent.decompose() for x in page.find_all(string="neexistuje")]
-        last_buttons = page.select("td:last-of-type button")
-        links = [self.url + re.search("'([^']*)'", button.get('onclick'))[1]
-                 for button in last_buttons]
-        for link in links:
-            file_path = os.path.join(self.folder, link.split('/')[-1])
-            if not os.path.isfile(file_path):
-                with requests.get(link) as r:
-                    with open(file_path, "wb") as f:
-                        f.write(r.content)
+    def _archives(self):
+        """Return sorted list of paths to all downloaded archives."""
+        return sorted(glob.glob(os.path.join(self.folder, "*.zip")))
 
-    def parse_region_data(self, region):
-        """Method to parse data for specified region.
+    def _read_csv_columns(self, f, columns=None):
+        """Read whole CSV file at once and split it into columns of raw values.
+
+        Parameters
+        ----------
+        f : file object
+            Binary file object with CSV data.
+        columns : Iterable, optional
+            Names of columns to extract, other columns are None. Column p1 is
+            always extracted, as it's used to find duplicate records.
+        Returns
+        -------
+        List of ndarrays with raw string values, one for each of headers.
+        """
+        columns = self._select_columns(columns)
+        usecols = [i for i, header in enumerate(self.headers)
+                   if i == 0 or header[0] in columns]
+        text = f.read().decode("cp1250")
+        raw = split_csv_columns(text, len(self.headers), usecols=usecols)
+        if raw is not None:
+            return raw
+
+        # irregular file, let the csv module handle it
+        reader = csv.reader(io.StringIO(text, newline=None), delimiter=";",
+                            quotechar='"')
+        rows = [row for row in reader if row]
+        raw = list(zip(*rows)) if rows else [() for _ in self.headers]
+        return [np.array(column, dtype=str) if i in usecols else None
+                for i, (_, column) in enumerate(zip(self.headers, raw))]
+
+    def _convert_columns(self, chunks, region, columns=None, known_ids=None):
+        """Convert raw columns read from individual CSV files to region data.
 
         Parameters
         ----------
+        chunks : Iterable
+            Iterable of raw columns as returned by _read_csv_columns.
         region : String
-            Shortname of region that should be parsed.
+            Shortname of region the data belongs to.
+        columns : Iterable, optional
+            Names of columns to convert. When None, all columns are converted.
+        known_ids : ndarray, optional
+            Sorted raw p1 values of records which should be skipped.
+        Returns
+        -------
+        Tuple (region data, sorted ndarray of raw p1 values of converted records),
+        where region data is ColumnDict with encoded columns, see _encode.
+        """
+        columns = self._select_columns(columns)
+        chunks = list(chunks)
+        if chunks:
+            raw = [None if column[0] is None else np.concatenate(column)
+                   for column in zip(*chunks)]
+        else:
+            raw = [np.array([], dtype=str) for _ in self.headers]
 
+        # handle records with duplicate IDs, first occurrence is kept
+        ids, first = np.unique(raw[0], return_index=True)
+        if known_ids is not None and known_ids.size:
+            new = ~np.isin(ids, known_ids, assume_unique=True)
+            ids, first = ids[new], first[new]
+        keep = np.sort(first)
+
+        result = ColumnDict()
+        for column in columns:
+            if column == "region":
+                # add region "column"
+                result.categories["region"] = np.array(list(self.regions))
+                code = list(self.regions).index(region)
+                result["region"] = np.full(keep.size, code,
+                                           dtype=code_dtype(len(self.regions)))
+            else:
+                index = self._header_index[column]
+                _, dtype, validator = self.headers[index]
+                result[column] = convert_column(raw[index][keep], dtype, validator)
+        return self._encode(result), ids
+
+    def _read_csv_rows(self, f, columns=None):
+        """Read CSV file row by row, reference counterpart of _read_csv_columns.
+
+        Parameters
+        ----------
+        f : file object
+            Binary file object with CSV data.
+        columns : Iterable, optional
+            Unused, whole rows are always read.
         Returns
         -------
-        Dictionary with headers as key and ndarray as value {header : ndarray}
+        List of rows, each row is list of raw string values.
+        """
+        reader = csv.reader(io.TextIOWrapper(f, encoding="cp1250"),
+                            delimiter=";", quotechar='"')
+        return list(reader)
+
+    def _convert_rows(self, chunks, region, columns=None, known_ids=None):
+        """Convert rows value by value, reference counterpart of _convert_columns.
+
+        Parameters
+        ----------
+        chunks : Iterable
+            Iterable of rows as returned by _read_csv_rows.
+        region : String
+            Shortname of region the data belongs to.
+        columns : Iterable, optional
+            Names of columns to include in the result. When None, all columns are
+            included.
+        known_ids : ndarray, optional
+            Raw p1 values of records which should be skipped.
+        Returns
+        -------
+        Tuple (region data, sorted ndarray of raw p1 values of converted records)
         """
-        region_id = self.regions[region]
         result = {header[0]: [] for header in self.headers}
-        used_ids = {}
+        used_ids = {} if known_ids is None else dict.fromkeys(known_ids, 0)
 
-        # Check if we have all available data and download what's missing...
-        self.download_data()
         # parse individual columns into lists and check data validity where possible
-        for archive in glob.glob(os.path.join(self.folder, "*.zip")):
-            with zipfile.ZipFile(archive, "r") as zf:
-                with zf.open(region_id + ".csv", "r") as f:
-                    reader = csv.reader(io.TextIOWrapper(f, encoding="cp1250"),
-                                        delimiter=";", quotechar='"')
-                    for row in reader:
-                        for header, record in zip(self.headers, row):
-                            # handle records with duplicate IDs
-                            if header[0] == "p1":
-                                if record in used_ids.keys():
-                                    break
-                                else:
-                                    used_ids[record] = 1
-                            if header[2]:
-                                result[header[0]].append(header[2](record))
-                            else:
-                                result[header[0]].append(record)
+        for rows in chunks:
+            for row in rows:
+                for header, record in zip(self.headers, row):
+                    # handle records with duplicate IDs
+                    if header[0] == "p1":
+                        if record in used_ids.keys():
+                            break
+                        else:
+                            used_ids[record] = 1
+                    if header[2]:
+                        result[header[0]].append(header[2](record))
+                    else:
+                        result[header[0]].append(record)
 
         # create numpy array from lists representing data columns
         for header in self.headers:
             result[header[0]] = np.array(result[header[0]], dtype=header[1])
         # and add region "column"
         result["region"] = np.repeat(region, result[self.headers[0][0]].size)
+        ids = np.sort(np.array([key for key, value in used_ids.items() if value],
+                               dtype=str))
+        return ({column: result[column] for column in self._select_columns(columns)},
+                ids)
+
+    def _load_cache_meta(self, region):
+        """Load metadata of file cache of region.
+
+        Caches in former gzip+pickle format are migrated first.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of region.
+        Returns
+        -------
+        Dictionary with metadata of the cache or None when region isn't cached.
+        """
+        try:
+            with open(os.path.join(self.cache_filename.format(region),
+                                   self.cache_meta_filename), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+
+        # migrate cache from former gzip+pickle format
+        legacy_filename = self.legacy_cache_filename.format(region)
+        try:
+            with gzip.open(legacy_filename, "rb") as f:
+                region_data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        # storing the cache also removes the legacy file
+        self._store_cache(region, self._encode(region_data))
+        return self._load_cache_meta(region)
+
+    def _load_cache(self, region, columns=None):
+        """Load parsed data of region from file cache.
+
+        Columns are memory-mapped, so they are read lazily and pages are shared
+        between processes using the same cache.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of region to load.
+        columns : Iterable, optional
+            Names of columns to load. When None, all cached columns are loaded.
+        Returns
+        -------
+        ColumnDict with encoded columns, see _encode, with read-only memory-mapped
+        arrays.
+        Raises
+        ------
+        FileNotFoundError when region isn't cached yet.
+        """
+        meta = self._load_cache_meta(region)
+        if meta is None:
+            raise FileNotFoundError(f"Region {region} is not cached")
+
+        cache_dir = self.cache_filename.format(region)
+        rows = meta["rows"]
+        # empty files can't be memory-mapped
+        mmap_mode = "r" if rows else None
+        columns = meta["columns"] if columns is None else columns
+        result = ColumnDict()
+        for column in columns:
+            values = np.load(os.path.join(cache_dir, column + ".npy"),
+                             mmap_mode=mmap_mode)
+            # column may be longer after interrupted append, metadata are decisive
+            result[column] = values if len(values) == rows else values[:rows]
+            if column in meta.get("categories", ()):
+                result.categories[column] = np.load(
+                    os.path.join(cache_dir, column + ".categories.npy"))
         return result
 
-    def get_dict(self, regions=None):
+    def _store_cache(self, region, region_data, archives=None, ids=None):
+        """Store parsed data of region in file cache.
+
+        Cache is written to temporary directory, which replaces the previous cache
+        once it's complete.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of stored region.
+        region_data : ColumnDict
+            Region data with encoded columns, see _encode.
+        archives : Dictionary, optional
+            Dictionary with {archive name : hash} of archives the data were parsed
+            from, as returned by _archive_hashes.
+        ids : ndarray, optional
+            Sorted raw p1 values of stored records. Cache can be extended by new
+            archives only when both archives and ids are known.
+        """
+        cache_dir = self.cache_filename.format(region)
+        tmp_dir = tempfile.mkdtemp(dir=self.folder, suffix=".tmp")
+        try:
+            for column, values in region_data.items():
+                np.save(os.path.join(tmp_dir, column + ".npy"), values)
+            for column, categories in region_data.categories.items():
+                np.save(os.path.join(tmp_dir, column + ".categories.npy"),
+                        categories)
+            # metadata are written last, they mark the cache as complete
+            meta = {"version": self.cache_version,
+                    "rows": len(next(iter(region_data.values()), [])),
+                    "columns": {column: values.dtype.str
+                                for column, values in region_data.items()},
+                    "categories": list(region_data.categories)}
+            if archives is not None and ids is not None:
+                np.save(os.path.join(tmp_dir, self.cache_index_filename), ids)
+                meta.update(archives=archives, index_size=len(ids))
+            if "p2a" in region_data:
+                for column in self.cube_columns:
+                    if column in region_data:
+                        self._store_cube(tmp_dir, column, meta["rows"], count_cube(
+                            region_data["p2a"], region_data[column]))
+            with open(os.path.join(tmp_dir, self.cache_meta_filename), "w") as f:
+                json.dump(meta, f, indent=1)
+            self._remove_cache(region)
+            os.replace(tmp_dir, cache_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def _append_cache(self, region, region_data, archives, ids):
+        """Append records parsed from new archives to file cache of region.
+
+        Columns are extended in place and metadata, which define the valid length
+        of the columns, are replaced last, so interrupted append leaves the
+        previous cache content intact. New categories of encoded columns are added
+        after the stored ones, so codes of stored records don't change.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of region.
+        region_data : ColumnDict
+            New records of the region with encoded columns, see _encode.
+        archives : Dictionary
+            Dictionary with {archive name : hash} of all archives the cache is
+            built from after the append.
+        ids : ndarray
+            Sorted raw p1 values of appended records.
+        """
+        cache_dir = self.cache_filename.format(region)
+        meta = self._load_cache_meta(region)
+        index_filename = os.path.join(cache_dir, self.cache_index_filename)
+        rows = meta["rows"]
+        for column in meta["columns"]:
+            filename = os.path.join(cache_dir, column + ".npy")
+            values = region_data[column]
+            if column in meta["categories"]:
+                categories_filename = os.path.join(cache_dir,
+                                                   column + ".categories.npy")
+                stored = np.load(categories_filename)
+                categories = region_data.categories[column]
+                merged = np.concatenate(
+                    [stored, categories[~np.isin(categories, stored)]])
+                order = np.argsort(merged)
+                lookup = order[np.searchsorted(merged, categories, sorter=order)]
+                values = lookup.astype(code_dtype(merged.size))[values]
+                if merged.size > stored.size:
+                    with atomic_open(categories_filename) as f:
+                        np.save(f, merged)
+            if not append_npy(filename, values, rows):
+                # e.g. longer strings than in stored column, rewrite the column
+                values = np.concatenate([self._load_cache(region, [column])[column],
+                                         values])
+                with atomic_open(filename) as f:
+                    np.save(f, values)
+            meta["columns"][column] = np.load(filename, mmap_mode="r").dtype.str
+
+        index = np.load(index_filename)[:meta["index_size"]]
+        index = np.insert(index, np.searchsorted(index, ids), ids)
+        with atomic_open(index_filename) as f:
+            np.save(f, index)
+        meta.update(rows=rows + len(region_data[self.headers[0][0]]),
+                    archives=archives, index_size=len(index))
+        with atomic_open(os.path.join(cache_dir, self.cache_meta_filename), "w") as f:
+            json.dump(meta, f, indent=1)
+
+        # cubes are updated last, cubes not matching the cache are rebuilt on use
+        prefix, suffix = self.cube_filename.split("{}")
+        for filename in glob.glob(os.path.join(cache_dir, self.cube_filename.format("*"))):
+            column = os.path.basename(filename)[len(prefix):-len(suffix)]
+            cube = self._load_cube_file(filename)
+            if cube is not None and cube["rows"] == rows:
+                values = region_data[column]
+                first, last = cube["offset"], cube["offset"] + cube["counts"].shape[1] - 1
+                if values.size:
+                    first, last = min(first, int(values.min())), max(last, int(values.max()))
+                if last - first >= self.cube_max_values:
+                    # outdated cube is rejected when it's used, see _load_cube
+                    continue
+                cube = merge_cubes(cube, count_cube(region_data["p2a"], values))
+                self._store_cube(cache_dir, column, meta["rows"], cube)
+
+    def _update_caches(self, plans, hashes):
+        """Append new archives to file caches of regions.
+
+        Parameters
+        ----------
+        plans : Dictionary
+            Dictionary with {region name : names of archives to append}.
+        hashes : Dictionary
+            Hashes of all downloaded archives as returned by _archive_hashes.
+        """
+        # regions missing the same archives are parsed together
+        groups = {}
+        for region, names in plans.items():
+            groups.setdefault(tuple(names), []).append(region)
+        for names, regions in groups.items():
+            known_ids = {}
+            for region in regions:
+                meta = self._load_cache_meta(region)
+                known_ids[region] = np.load(os.path.join(
+                    self.cache_filename.format(region),
+                    self.cache_index_filename))[:meta["index_size"]]
+            archives = [os.path.join(self.folder, name) for name in names]
+            parsed = self._parse_regions(regions, archives, known_ids=known_ids)
+            for region, (region_data, ids) in parsed.items():
+                self._append_cache(region, region_data, hashes, ids)
+
+    def _remove_cache(self, region):
+        """Remove file cache of region in any format, when it exists.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of region.
+        """
+        cache_dir = self.cache_filename.format(region)
+        if os.path.isdir(cache_dir):
+            # move it away first, so readers never see partially removed cache
+            trash_dir = tempfile.mkdtemp(dir=self.folder, suffix=".tmp")
+            os.replace(cache_dir, os.path.join(trash_dir, "cache"))
+            shutil.rmtree(trash_dir, ignore_errors=True)
+        _remove_files(self.legacy_cache_filename.format(region))
+
+    def get_dict(self, regions=None, columns=None, workers=None, refresh=False,
+                 decode=True):
         """Method to obtain dataset for specified regions.
 
-        Parsed data of individual regions is cached and parse_region_data is
-        used only when desired region is not found in the cache.
+        Parsed data of individual regions is cached in files and in memory cache,
+        which holds also results of recent calls, and regions which are not found
+        in the cache are parsed together by parse_regions_data, so the archives are
+        read and checked for updates only once. When new archives are available,
+        only they are parsed and appended to the caches, records already present
+        in the cache take precedence over duplicate records in the new archives.
+        Caches built from archives which were changed since are parsed again.
         Parameters
         ----------
         regions : Iterable, optional
             Iterable holding shortnames of regions to include in prepared dataset.
             When empty or None, all regions are included.
+        columns : Iterable, optional
+            Names of columns (headers or "region") to include in prepared dataset,
+            only these columns are loaded from cache. When None, all columns are
+            included.
+        workers : Int, optional
+            Number of worker processes used to parse and cache regions which are not
+            cached yet. When None (default) or 1, regions are parsed in the current
+            process.
+        refresh : Bool, optional
+            When set to True, dataset is checked for updates even when all regions
+            are cached, each archive is revalidated even when the index page is
+            unchanged, see download_data.
+        decode : Bool, optional
+            When set to True (default), columns are decoded to data types given by
+            headers. Otherwise ColumnDict with encoded columns is returned, see
+            parse_region_data, which is considerably smaller.
         Returns
         -------
              Dictionary with headers as key and ndarray as value {header : ndarray}
-             Similarly to parse_region_data, but
+             Similarly to parse_region_data, but arrays are read-only, as they are
+             shared with memory cache, and arrays of single cached region may be
+             memory-mapped when decode is False.
+        """
+        regions = list(regions) if regions else list(self.regions)
+        columns = self._select_columns(columns)
+        unique = list(dict.fromkeys(regions))
+        self._prepare(unique, workers, refresh)
+
+        # results for recently requested region sets are cached as well
+        result_key = ("dict", tuple(self._region_key(region)[1] for region in regions),
+                      tuple(columns), decode)
+        cols = self.mem_cache.get(result_key)
+        if cols is not None:
+            # callers get their own dictionary, the read-only arrays stay shared
+            return cols.copy()
+
+        loaded = {}
+        for region in unique:
+            loaded[region] = self.mem_cache.get(self._region_key(region))
+            if loaded[region] is None:
+                loaded[region] = self._load_cache(region)
+                self.mem_cache.put(self._region_key(region), loaded[region])
+
+        # single region is returned as is, without copying its cached columns
+        cols = concat_columns([loaded[region] for region in regions], columns)
+        cols = self._decode(cols) if decode else cols
+        for values in cols.values():
+            # arrays are shared by the cached result and all its consumers
+            values.flags.writeable = False
+        self.mem_cache.put(result_key, cols)
+        return cols.copy()
+
+    def _prepare(self, regions, workers=None, refresh=False):
+        """Bring file and memory caches of regions up-to-date, see get_dict.
+
+        Parameters
+        ----------
+        regions : List
+            Shortnames of regions without duplicates.
+        workers : Int, optional
+            Number of worker processes, see get_dict.
+        refresh : Bool, optional
+            Whether to check for updates regions already checked, see get_dict.
+        """
+        plans = {}
+        stale = [region for region in regions
+                 if refresh or region not in self._checked
+                 or self._region_key(region) not in self.mem_cache]
+        if stale:
+            hashes = self._archive_hashes()
+            plans = {region: self._cache_plan(region, hashes) for region in stale}
+        if refresh or any(plan is not None for plan in plans.values()):
+            # Check if we have all available data and download what's missing...
+            updated = self.download_data(revalidate=refresh)
+            if updated:
+                hashes = self._archive_hashes()
+                plans = {region: self._cache_plan(region, hashes, updated)
+                         for region in regions}
+        plans = {region: plan for region, plan in plans.items() if plan is not None}
+        for region in plans:
+            self._invalidate(region)
+        self._checked.update(stale)
+
+        appended = {region: plan for region, plan in plans.items() if plan is not True}
+        if appended:
+            self._update_caches(appended, hashes)
+
+        missing = [region for region, plan in plans.items() if plan is True]
+        if missing:
+            # Not found in cache, parse it
+            if workers is not None and workers > 1 and len(missing) > 1:
+                parsed = self._parse_parallel(missing, workers, hashes)
+            else:
+                parsed = _parse_and_store(self, missing, hashes)
+            # store in mem cache
+            for region, region_data in parsed.items():
+                self.mem_cache.put(self._region_key(region), region_data)
+
+    def _region_key(self, region):
+        """Return key of region data in memory cache, unique across instances."""
+        return "region", self.cache_filename.format(region)
+
+    def _invalidate(self, region):
+        """Remove region and all cached results including it from memory cache.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of region.
+        """
+        _, path = self._region_key(region)
+        self.mem_cache.pop(("region", path))
+        self.mem_cache.discard(lambda key: key[0] == "dict" and path in key[1])
+
+    def get_dataframe(self, regions=None, columns=None, workers=None):
+        """Method to obtain dataset for specified regions as pandas DataFrame.
+
+        Columns of get_dict are wrapped without copying. Dictionary-encoded columns
+        ("region" and string fields) become categorical columns built from their
+        codes, integer columns keep their narrowed data types. Column "date" with
+        date of accident is derived from p2a, when it's included.
+
+        Parameters
+        ----------
+        regions : Iterable, optional
+            Shortnames of regions, see get_dict.
+        columns : Iterable, optional
+            Names of columns to include, see get_dict.
+        workers : Int, optional
+            Number of worker processes, see get_dict.
+        Returns
+        -------
+        pandas.DataFrame with the dataset.
+        """
+        return to_dataframe(self.get_dict(regions, columns, workers=workers,
+                                          decode=False))
+
+    def export_dataframe(self, filename="accidents.pkl.gz", regions=None,
+                         columns=None, workers=None, compresslevel=1):
+        """Store dataset prepared by get_dataframe as pickle file.
+
+        Pickled DataFrame already has compact data types, categorical columns and
+        "date" column, so scripts loading it don't need to convert anything.
+
+        Parameters
+        ----------
+        filename : String, optional
+            Path to resulting file, it's compressed by gzip when its name ends
+            with .gz, which is compatible with pandas.read_pickle.
+        regions : Iterable, optional
+            Shortnames of regions, see get_dict.
+        columns : Iterable, optional
+            Names of columns to include, see get_dict.
+        workers : Int, optional
+            Number of worker processes, see get_dict.
+        compresslevel : Int, optional
+            Level of gzip compression, fastest level by default, as higher levels
+            take much longer and don't make loading faster.
+        """
+        df = self.get_dataframe(regions, columns, workers)
+        compression = None
+        if filename.endswith(".gz"):
+            compression = {"method": "gzip", "compresslevel": compresslevel,
+                           "mtime": 0}
+        with atomic_open(os.path.abspath(filename)) as f:
+            df.to_pickle(f, compression=compression, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def export_partitioned(self, path=None, regions=None, columns=None, workers=None):
+        """Store dataset as columnar store partitioned by region and year.
+
+        Records of each region and year are stored in Hive-style directory
+        region=<region>/year=<year> as one .npy file per column, records without
+        valid date go to year=__HIVE_DEFAULT_PARTITION__. Partitioning columns are
+        given by the path and aren't stored. Each region directory has metadata
+        file and categories of its encoded columns and replaces the previous one
+        only once it's complete.
+
+        Parameters
+        ----------
+        path : String, optional
+            Path to root directory of the store, folder/partitioned by default.
+        regions : Iterable, optional
+            Shortnames of regions to store, other regions in the store are kept.
+            When empty or None, all regions are stored.
+        columns : Iterable, optional
+            Names of columns to store, see get_dict. Column p2a is always stored,
+            as it's needed to select records by date.
+        workers : Int, optional
+            Number of worker processes, see get_dict.
         """
-        regions = regions if regions else self.regions.keys()
-        cols = {header[0]: [] for header in self.headers + [("region",)]}
+        path = path or os.path.join(self.folder, self.partitioned_dirname)
+        regions = list(dict.fromkeys(regions)) if regions else list(self.regions)
+        columns = [column for column in self._select_columns(columns)
+                   if column != "region"]
+        if "p2a" not in columns:
+            columns.append("p2a")
+        os.makedirs(path, exist_ok=True)
+        # parse all missing regions at once, then store them one by one
+        self.get_dict(regions, ["p2a"], workers=workers, decode=False)
         for region in regions:
-            # obtain data
+            data = self.get_dict([region], columns, decode=False)
+            years = data["p2a"].astype("datetime64[Y]")
+            valid = ~np.isnat(years)
+            partitions = {str(year): np.flatnonzero(years == year)
+                          for year in np.unique(years[valid])}
+            if not valid.all():
+                partitions[self.partition_null] = np.flatnonzero(~valid)
+
+            region_dir = os.path.join(path, f"region={region}")
+            tmp_dir = tempfile.mkdtemp(dir=path, suffix=".tmp")
             try:
-                # check mem cache
-                region_data = self.mem_cache[region]
-            except KeyError:
-                cache_filename = self.cache_filename.format(region)
-                # check file cache
-                try:
-                    with gzip.open(cache_filename, "rb") as f:
-                        region_data = pickle.load(f)
-                except FileNotFoundError:
-                    # Not found in cache, parse it
-                    region_data = self.parse_region_data(region)
-                    # store in file cache
-                    # I chose compresslevel=8 because from my testing on given dataset
-                    # of interest default (level 9) compared to level 8 only compressed
-                    # by additional ~0.63 % but took twice as long to compute. I also
-                    # tested lower levels, but after level 8 loss on compression was
-                    # substantial from my point of view (>2 %) and outweighed the
-                    # longer computation time. PS Decompression time deltas were
-                    # almost same, so I'm not even mentioning them here...
-                    with gzip.open(cache_filename, "wb", compresslevel=8) as f:
-                        pickle.dump(region_data, f)
-                    #  store in mem cache
-                    self.mem_cache[region] = region_data
-
-            for coll_key in cols.keys():
-                cols[coll_key].append(region_data[coll_key])
-        for coll_key in cols.keys():
-            cols[coll_key] = np.concatenate(cols[coll_key])
-        return cols
+                for year, index in partitions.items():
+                    year_dir = os.path.join(tmp_dir, f"year={year}")
+                    os.mkdir(year_dir)
+                    for column in columns:
+                        np.save(os.path.join(year_dir, column + ".npy"),
+                                data[column][index])
+                os.mkdir(os.path.join(tmp_dir, "_categories"))
+                for column, categories in data.categories.items():
+                    np.save(os.path.join(tmp_dir, "_categories", column + ".npy"),
+                            categories)
+                meta = {"columns": {column: data[column].dtype.str
+                                    for column in columns},
+                        "categories": list(data.categories),
+                        "rows": {year: len(index)
+                                 for year, index in partitions.items()}}
+                with open(os.path.join(tmp_dir, self.cache_meta_filename), "w") as f:
+                    json.dump(meta, f, indent=1)
+                if os.path.isdir(region_dir):
+                    trash_dir = tempfile.mkdtemp(dir=path, suffix=".tmp")
+                    os.replace(region_dir, os.path.join(trash_dir, "region"))
+                    shutil.rmtree(trash_dir, ignore_errors=True)
+                os.replace(tmp_dir, region_dir)
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
 
+    def load_partitioned(self, path=None, regions=None, start=None, end=None,
+                         columns=None, decode=True):
+        """Load dataset stored by export_partitioned, reading only partitions and
+        columns matching the predicates.
+
+        Parameters
+        ----------
+        path : String, optional
+            Path to root directory of the store, folder/partitioned by default.
+        regions : Iterable, optional
+            Shortnames of regions to load. When empty or None, all regions in the
+            store are loaded.
+        start : String or numpy.datetime64, optional
+            First date of accidents to load, e.g. "2016-01-01".
+        end : String or numpy.datetime64, optional
+            Date after the last date of accidents to load, e.g. "2021-01-01".
+        columns : Iterable, optional
+            Names of columns to load, see get_dict.
+        decode : Bool, optional
+            Whether to decode the columns, see parse_region_data.
+        Returns
+        -------
+        Dataset in format returned by get_dict, records of years in boundary
+        partitions are filtered by date.
+        Raises
+        ------
+        FileNotFoundError when some of the regions isn't stored.
+        """
+        path = path or os.path.join(self.folder, self.partitioned_dirname)
+        columns = self._select_columns(columns)
+        if regions:
+            regions = list(dict.fromkeys(regions))
+        else:
+            regions = [name.split("=", 1)[1] for name in sorted(os.listdir(path))
+                       if name.startswith("region=")]
+        start = None if start is None else np.datetime64(start, "D")
+        end = None if end is None else np.datetime64(end, "D")
+        dated = start is not None or end is not None
+        first = None if start is None else start.astype("datetime64[Y]")
+        last = None if end is None else (end - 1).astype("datetime64[Y]")
+        names = list(self.regions)
+
+        parts = []
+        for region in regions:
+            region_dir = os.path.join(path, f"region={region}")
+            with open(os.path.join(region_dir, self.cache_meta_filename), "r") as f:
+                meta = json.load(f)
+            categories = {column: np.load(os.path.join(region_dir, "_categories",
+                                                       column + ".npy"))
+                          for column in meta["categories"] if column in columns}
+            for year, rows in sorted(meta["rows"].items()):
+                if dated and year == self.partition_null:
+                    continue
+                if first is not None and np.datetime64(year, "Y") < first:
+                    continue
+                if last is not None and np.datetime64(year, "Y") > last:
+                    continue
+                year_dir = os.path.join(region_dir, f"year={year}")
+                # empty files can't be memory-mapped
+                mmap_mode = "r" if rows else None
+                part = ColumnDict(categories=categories)
+                for column in columns:
+                    if column != "region":
+                        part[column] = np.load(os.path.join(year_dir, column + ".npy"),
+                                               mmap_mode=mmap_mode)
+                # only partitions on the boundary of date range have to be filtered
+                keep = None
+                if (first is not None and np.datetime64(year, "Y") == first
+                        or last is not None and np.datetime64(year, "Y") == last):
+                    dates = np.load(os.path.join(year_dir, "p2a.npy"),
+                                    mmap_mode=mmap_mode)
+                    keep = np.ones(rows, dtype=bool)
+                    if start is not None:
+                        keep &= dates >= start
+                    if end is not None:
+                        keep &= dates < end
+                    part = ColumnDict({column: values[keep]
+                                       for column, values in part.items()},
+                                      categories)
+                if "region" in columns:
+                    size = rows if keep is None else int(keep.sum())
+                    part["region"] = np.full(size, names.index(region),
+                                             dtype=code_dtype(len(names)))
+                    part.categories["region"] = np.array(names)
+                parts.append(part)
+
+        if parts:
+            data = concat_columns(parts, columns)
+        else:
+            data = self._encode({column: np.array([], dtype=self._column_dtype(column))
+                                 for column in columns})
+        return self._decode(data) if decode else data
+
+    def _column_dtype(self, column):
+        """Return data type of column given by headers."""
+        if column == "region":
+            return "U3"
+        return self.headers[self._header_index[column]][1]
+
+    def get_cube(self, column, regions=None, workers=None, refresh=False):
+        """Method to obtain numbers of accidents by region, day and value of column.
+
+        Count cubes are stored next to region caches, they are built when the
+        cache is stored (cube_columns) or first used and updated when new records
+        are appended to the cache. Only kilobytes of counts are read then. Cubes
+        are dense in values, so only categorical columns with at most
+        cube_max_values distinct values are supported.
+
+        Parameters
+        ----------
+        column : String
+            Name of categorical integer column to count, e.g. p24.
+        regions : Iterable, optional
+            Shortnames of regions, see get_dict.
+        workers : Int, optional
+            Number of worker processes, see get_dict.
+        refresh : Bool, optional
+            Whether to check for updates, see get_dict.
+        Returns
+        -------
+        CountCube with counts of the regions.
+        Raises
+        ------
+        ValueError when column isn't integer column or its values span more than
+        cube_max_values values.
+        """
+        self._select_columns([column])
+        if column == "region" or self.headers[self._header_index[column]][1][0] != "i":
+            raise ValueError(f"Column '{column}' is not integer column")
+        regions = list(dict.fromkeys(regions)) if regions else list(self.regions)
+        self._prepare(regions, workers, refresh)
+
+        cubes = [self._load_cube(region, column) for region in regions]
+        counted = [cube for cube in cubes if cube["counts"].size]
+        n_values = (max(cube["offset"] + cube["counts"].shape[1] for cube in counted)
+                    - min(cube["offset"] for cube in counted)) if counted else 0
+        if n_values > self.cube_max_values:
+            raise ValueError(f"Column '{column}' spans {n_values} values, count cubes "
+                             f"are limited to {self.cube_max_values} values")
+        return CountCube.stack(column, regions, cubes)
+
+    def get_projected(self, regions=None, crs="EPSG:3857", workers=None, refresh=False):
+        """Method to obtain coordinates of accidents in other coordinate system.
+
+        Coordinates d and e (S-JTSK) are projected once and stored next to region
+        caches, records appended to the cache later are projected incrementally.
+
+        Parameters
+        ----------
+        regions : Iterable, optional
+            Shortnames of regions, see get_dict.
+        crs : String, optional
+            Target coordinate reference system, e.g. EPSG:3857 used by map tiles.
+        workers : Int, optional
+            Number of worker processes, see get_dict.
+        refresh : Bool, optional
+            Whether to check for updates, see get_dict.
+        Returns
+        -------
+        ColumnDict with columns x and y (NaN for records without coordinates) in
+        the same order as records of get_dict with the same regions.
+        """
+        regions = list(dict.fromkeys(regions)) if regions else list(self.regions)
+        self._prepare(regions, workers, refresh)
+        return concat_columns([self._load_projected(region, crs) for region in regions])
+
+    def _load_projected(self, region, crs):
+        """Load projected coordinates of cached region, projecting new records.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of cached region.
+        crs : String
+            Target coordinate reference system.
+        Returns
+        -------
+        ColumnDict with columns x and y.
+        """
+        cache_dir = self.cache_filename.format(region)
+        rows = self._load_cache_meta(region)["rows"]
+        meta_filename = os.path.join(cache_dir, self.projected_meta_filename)
+        try:
+            with open(meta_filename, "r") as f:
+                projected = json.load(f)
+        except FileNotFoundError:
+            projected = {}
+        name = re.sub(r"[^\w]", "", crs)
+        filenames = {axis: os.path.join(cache_dir, self.projected_filename.format(axis, name))
+                     for axis in ["x", "y"]}
+        done = projected.get(crs, 0)
+        if done > rows or not all(map(os.path.exists, filenames.values())):
+            done = 0
+        if done < rows:
+            data = self._load_cache(region, ["d", "e"])
+            new = dict(zip(["x", "y"], project_coordinates(
+                data["d"][done:], data["e"][done:], crs)))
+            for axis, filename in filenames.items():
+                values = new[axis]
+                if done and append_npy(filename, values, done):
+                    continue
+                if done:
+                    values = np.concatenate([np.load(filename)[:done], values])
+                with atomic_open(filename) as f:
+                    np.save(f, values)
+            # coordinates are valid only when their count is stored
+            projected[crs] = rows
+            with atomic_open(meta_filename, "w") as f:
+                json.dump(projected, f, indent=1)
+        mmap_mode = "r" if rows else None
+        return ColumnDict({axis: np.load(filename, mmap_mode=mmap_mode)[:rows]
+                           for axis, filename in filenames.items()})
+
+    def get_spatial_index(self, regions=None, cell_size=500, workers=None, refresh=False):
+        """Method to obtain spatial index over coordinates d and e (S-JTSK) of accidents.
+
+        Grid index of each region is stored next to the region cache and rebuilt
+        when records of the region change.
+
+        Parameters
+        ----------
+        regions : Iterable, optional
+            Shortnames of regions, see get_dict.
+        cell_size : Float, optional
+            Size of grid cell in meters, about the size of typical query works best.
+        workers : Int, optional
+            Number of worker processes, see get_dict.
+        refresh : Bool, optional
+            Whether to check for updates, see get_dict.
+        Returns
+        -------
+        SpatialIndex, whose queries return indices of records of get_dict with
+        the same regions.
+        """
+        regions = list(dict.fromkeys(regions)) if regions else list(self.regions)
+        self._prepare(regions, workers, refresh)
+        parts = []
+        offset = 0
+        for region in regions:
+            cache_dir = self.cache_filename.format(region)
+            rows = self._load_cache_meta(region)["rows"]
+            data = self._load_cache(region, ["d", "e"])
+            filename = os.path.join(cache_dir, self.spatial_index_filename.format(cell_size))
+            try:
+                with np.load(filename) as f:
+                    index = {"keys": f["keys"], "order": f["order"], "rows": int(f["rows"])}
+            except FileNotFoundError:
+                index = None
+            if index is None or index["rows"] != rows:
+                index = grid_index(data["d"], data["e"], cell_size)
+                with atomic_open(filename) as f:
+                    np.savez(f, keys=index["keys"], order=index["order"], rows=rows)
+            parts.append({"offset": offset, "keys": index["keys"], "order": index["order"],
+                          "x": data["d"], "y": data["e"]})
+            offset += rows
+        return SpatialIndex(cell_size, parts)
+
+    def _load_cube(self, region, column):
+        """Load count cube of column of cached region, building it when needed.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of cached region.
+        column : String
+            Name of counted column.
+        Returns
+        -------
+        Dictionary with cube, see count_cube.
+        Raises
+        ------
+        ValueError when values of the column span more than cube_max_values values.
+        """
+        cache_dir = self.cache_filename.format(region)
+        meta = self._load_cache_meta(region)
+        cube = self._load_cube_file(os.path.join(cache_dir,
+                                                 self.cube_filename.format(column)))
+        if cube is None or cube["rows"] != meta["rows"]:
+            data = self._load_cache(region, ["p2a", column])
+            values = data[column]
+            n_values = int(values.max()) - int(values.min()) + 1 if values.size else 0
+            if n_values > self.cube_max_values:
+                raise ValueError(f"Column '{column}' spans {n_values} values, count cubes "
+                                 f"are limited to {self.cube_max_values} values")
+            cube = count_cube(data["p2a"], values)
+            self._store_cube(cache_dir, column, meta["rows"], cube)
+        return cube
+
+    def _load_cube_file(self, filename):
+        """Load cube stored by _store_cube or return None when it doesn't exist."""
+        try:
+            with np.load(filename) as f:
+                return {"days": f["days"], "offset": int(f["offset"]),
+                        "counts": f["counts"], "rows": int(f["rows"])}
+        except FileNotFoundError:
+            return None
+
+    def _store_cube(self, cache_dir, column, rows, cube):
+        """Store count cube of column in region cache directory.
+
+        Parameters
+        ----------
+        cache_dir : String
+            Path to region cache directory.
+        column : String
+            Name of counted column.
+        rows : Int
+            Number of cached records counted by the cube.
+        cube : Dictionary
+            Cube as returned by count_cube.
+        """
+        counts = cube["counts"]
+        # counts are small, store them in the smallest type holding them
+        dtype = np.min_scalar_type(counts.max() if counts.size else 0)
+        with atomic_open(os.path.join(cache_dir, self.cube_filename.format(column))) as f:
+            np.savez(f, days=cube["days"], offset=cube["offset"],
+                     counts=counts.astype(dtype), rows=rows)
+
+    def iter_chunks(self, regions=None, columns=None, chunk_rows=1 << 16,
+                    decode=True, refresh=False):
+        """Generator of dataset for specified regions in chunks of fixed size.
+
+        Up-to-date region caches are read in slices of memory-mapped columns, other
+        regions are streamed from the archives, chunk_rows lines at a time, without
+        building their caches. Memory taken by the chunks is thus bounded by
+        chunk_rows, only raw p1 values of already streamed records of region are
+        kept to skip duplicate records.
+
+        Parameters
+        ----------
+        regions : Iterable, optional
+            Shortnames of regions, see get_dict.
+        columns : Iterable, optional
+            Names of columns to include in the chunks, see get_dict.
+        chunk_rows : Int, optional
+            Number of records in each chunk, the last chunk may be shorter.
+        decode : Bool, optional
+            Whether to decode the columns, see parse_region_data. Encoded chunks have
+            their own categories.
+        refresh : Bool, optional
+            Whether to check for updates, see get_dict.
+        Yields
+        ------
+        Chunks of dataset in format returned by get_dict, records of regions follow
+        in the order of regions.
+        """
+        if chunk_rows < 1:
+            raise ValueError("chunk_rows must be positive")
+        regions = list(regions) if regions else list(self.regions)
+        columns = self._select_columns(columns)
+        hashes = self._archive_hashes()
+        plans = {region: self._cache_plan(region, hashes) for region in regions}
+        if refresh or any(plan is not None for plan in plans.values()):
+            # Check if we have all available data and download what's missing...
+            updated = self.download_data(revalidate=refresh)
+            if updated:
+                hashes = self._archive_hashes()
+                plans = {region: self._cache_plan(region, hashes, updated)
+                         for region in regions}
+
+        pending = []
+        size = 0
+        for region in regions:
+            if plans[region] is None:
+                region_data = self._load_cache(region, columns)
+                rows = len(next(iter(region_data.values()), []))
+                parts = (ColumnDict({column: values[start:start + chunk_rows]
+                                     for column, values in region_data.items()},
+                                    region_data.categories)
+                         for start in range(0, rows, chunk_rows))
+            else:
+                parts = self._iter_archive_chunks(region, self._archives(), columns,
+                                                  chunk_rows)
+            for part in parts:
+                pending.append(part)
+                size += len(part[columns[0]])
+                while size >= chunk_rows:
+                    chunk = concat_columns(pending, columns)
+                    rest = ColumnDict({column: values[chunk_rows:]
+                                       for column, values in chunk.items()},
+                                      chunk.categories)
+                    chunk = ColumnDict({column: values[:chunk_rows]
+                                        for column, values in chunk.items()},
+                                       chunk.categories)
+                    pending, size = [rest], size - chunk_rows
+                    yield self._decode(chunk) if decode else chunk
+        if size:
+            chunk = concat_columns(pending, columns)
+            yield self._decode(chunk) if decode else chunk
+
+    def _iter_archive_chunks(self, region, archives, columns, chunk_rows):
+        """Stream region from archives in parts of at most chunk_rows records.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of region.
+        archives : List
+            Paths to archives to read.
+        columns : List
+            Names of columns to convert.
+        chunk_rows : Int
+            Number of lines read at once.
+        Yields
+        ------
+        ColumnDicts with encoded columns, see _encode.
+        """
+        known_ids = np.array([], dtype=str)
+        for archive in archives:
+            with zipfile.ZipFile(archive, "r") as zf:
+                with zf.open(self.regions[region] + ".csv", "r") as f:
+                    while True:
+                        lines = list(itertools.islice(f, chunk_rows))
+                        if not lines:
+                            break
+                        block = b"".join(lines)
+                        # quoted values may contain line breaks, finish the record
+                        while block.count(b'"') % 2:
+                            line = f.readline()
+                            if not line:
+                                break
+                            block += line
+                        raw = self._read_csv_columns(io.BytesIO(block), columns)
+                        part, ids = self._convert_columns([raw], region, columns,
+                                                          known_ids)
+                        known_ids = np.union1d(known_ids, ids)
+                        yield part
+
+    def _parse_parallel(self, regions, workers, hashes):
+        """Parse and cache regions in pool of worker processes.
+
+        Parameters
+        ----------
+        regions : List
+            Shortnames of regions to parse.
+        workers : Int
+            Number of worker processes.
+        hashes : Dictionary
+            Hashes of downloaded archives as returned by _archive_hashes.
+        Returns
+        -------
+        Dictionary with {region name : region data}.
+        """
+        workers = min(workers, len(regions))
+        # each worker parses its group of regions in single pass over the archives
+        groups = [regions[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_parse_and_store, self, group, hashes, False)
+                       for group in groups]
+            for future in futures:
+                future.result()
+        # workers don't send the data back, cached columns are mapped instead
+        return {region: self._load_cache(region) for region in regions}
+
+
+def append_npy(filename, values, rows):
+    """Append values to 1-D array stored in .npy file in place.
+
+    Data are written after first rows items of the stored array and the header
+    with the new shape is rewritten afterwards. numpy reserves space in the header
+    for this, so the header keeps its size.
+
+    Parameters
+    ----------
+    filename : String
+        Path to .npy file.
+    values : ndarray
+        Values to append.
+    rows : Int
+        Number of valid items of the stored array, anything after them is
+        overwritten.
+    Returns
+    -------
+    True when values were appended, False when they can't be appended in place
+    (values can't be safely cast to stored data type or header would change its
+    size).
+    """
+    with open(filename, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            read_header = np.lib.format.read_array_header_1_0
+            write_header = np.lib.format.write_array_header_1_0
+        elif version == (2, 0):
+            read_header = np.lib.format.read_array_header_2_0
+            write_header = np.lib.format.write_array_header_2_0
+        else:
+            return False
+        shape, fortran_order, dtype = read_header(f)
+        header_size = f.tell()
+        if len(shape) != 1 or not np.can_cast(values.dtype, dtype, "safe"):
+            return False
+
+        header = io.BytesIO()
+        write_header(header, {"descr": np.lib.format.dtype_to_descr(dtype),
+                              "fortran_order": fortran_order,
+                              "shape": (rows + len(values),)})
+        if header.tell() != header_size:
+            return False
+
+        f.truncate(header_size + rows * dtype.itemsize)
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+
+def _parse_and_store(downloader, regions, hashes, return_data=True):
+    """Parse given regions and store them in file cache of the downloader.
+
+    Defined on module level, so it can be executed by worker processes.
+
+    Parameters
+    ----------
+    downloader : DataDownloader
+        Downloader used to parse and store the data.
+    regions : List
+        Shortnames of regions to parse.
+    hashes : Dictionary
+        Hashes of downloaded archives as returned by _archive_hashes.
+    return_data : Bool, optional
+        When set to False, parsed data are only stored and not returned.
+    Returns
+    -------
+    Dictionary with {region name : region data} or None.
+    """
+    archives = [os.path.join(downloader.folder, name) for name in hashes]
+    parsed = downloader._parse_regions(regions, archives)
+    for region, (region_data, ids) in parsed.items():
+        downloader._store_cache(region, region_data, hashes, ids)
+    if return_data:
+        return {region: region_data for region, (region_data, _) in parsed.items()}
+    return None
+
+
+def main(argv=None):
+    """Main function
+
+    Parameters
+    ----------
+    argv Argument vector passed to the ArgumentParser.
+    Following arguments are defined and can be passed from command line:
+        --workers : Number of processes used to parse regions.
+        --refresh : Check all downloaded archives for updates.
+        --export : Store whole dataset as pickled DataFrame in given file.
+        --export_partitioned : Store whole dataset partitioned by region and year.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes used to parse regions which are not cached yet."
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Check each downloaded archive for updates, even when the index page "
+             "of the dataset didn't change."
+    )
+    parser.add_argument(
+        "--export",
+        default=None,
+        metavar="FILENAME",
+        help="Store whole dataset as pickled DataFrame in given file, "
+             "e.g. accidents.pkl.gz, which is used by other scripts."
+    )
+    parser.add_argument(
+        "--export_partitioned",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="PATH",
+        help="Store whole dataset partitioned by region and year in given directory "
+             "(data/partitioned by default)."
+    )
+    args = parser.parse_args(argv)
+    if args.refresh:
+        # caches of regions built from updated archives are rebuilt on use
+        DataDownloader().download_data(revalidate=True)
+    if args.export is not None or args.export_partitioned is not None:
+        downloader = DataDownloader()
+        if args.export is not None:
+            downloader.export_dataframe(args.export, workers=args.workers)
+        if args.export_partitioned is not None:
+            downloader.export_partitioned(args.export_partitioned or None,
+                                          workers=args.workers)
+        return
 
-if __name__ == "__main__":
     # Example with PHA, JHM and OLK regions
     example_regions = ["PHA", "JHM", "OLK"]
-    example_data = DataDownloader().get_dict(example_regions)
+    example_data = DataDownloader().get_dict(example_regions, workers=args.workers)
     print("Sloupce:")
     for hdr, col in example_data.items():
         print(" " * 4 + f"{hdr}, počet položek: {len(col)}")
     print(f"Kraje:")
     for reg in np.unique(example_data["region"]):
         print(" " * 4 + f"{reg}")
+
+
+if __name__ == "__main__":
+    main()
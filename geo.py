@@ -5,70 +5,195 @@
 __author__ = "David Sedlák"
 __email__ = "xsedla1d@stud.fit.vutbr.cz"
 
+import argparse
+import functools
 import os
 import pandas as pd
 import geopandas
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
 import contextily
-import sklearn.cluster
 import numpy as np
 
+import tiles
+from hotspots import Hotspots, fit_hotspots
+from download import DataDownloader, project_coordinates
 
-def make_geo(df: pd.DataFrame) -> geopandas.GeoDataFrame:
-    """Convert dataframe to geopandas dataframe
+
+def basemap_provider():
+    """Get provider of tiles of basemaps of all maps."""
+    return contextily.providers.Stamen.TonerLite
+
+
+@functools.lru_cache(maxsize=None)
+def get_basemap() -> tiles.TileSource:
+    """Get source of basemaps of all maps, tiles are cached in data/tiles.mbtiles.
+
+    Source is created on first use, so importing this module doesn't depend on
+    the tile provider.
+    """
+    return tiles.TileSource(basemap_provider())
+
+
+def make_geo(df: pd.DataFrame, regions=None, years=None) -> pd.DataFrame:
+    """Select accidents with coordinates and project them to EPSG:3857
+
+    Records are filtered first, so only selected coordinates are projected, and
+    they are projected at once by pyproj. Projected coordinates are stored in
+    columns x and y, geometry is created by to_geodataframe only when needed.
 
     Parameters
     ----------
     df : pd.DataFrame
-        Dataframe to convert.
+        Dataframe to convert. When it already has columns x and y (see load_geo),
+        they are used instead of projecting d and e.
+    regions : List, optional
+        Shortnames of selected regions, all by default.
+    years : List, optional
+        Selected years, all by default.
     Returns
     -------
-    Converted dataframe
+    Selected records with columns x and y
     """
+    # snapshots exported by DataDownloader.export_dataframe already have it
+    if "date" not in df:
+        df["date"] = df["p2a"].astype("datetime64")
+    selected = np.ones(len(df), dtype=bool)
+    if regions is not None:
+        selected &= df["region"].isin(regions).to_numpy()
+    if years is not None:
+        selected &= df["date"].dt.year.isin(years).to_numpy()
     # drop records without cords
-    df.dropna(subset=["d", "e"], inplace=True)
-    df["date"] = df["p2a"].astype("datetime64")
-    gdf = geopandas.GeoDataFrame(df,
-                                 geometry=geopandas.points_from_xy(df["d"], df["e"]),
-                                 crs="EPSG:5514")
-    gdf.to_crs("epsg:3857", inplace=True)
-    return gdf
+    selected &= df["d"].notna().to_numpy() & df["e"].notna().to_numpy()
+    df = df[selected].copy()
+    if "x" not in df or "y" not in df:
+        df["x"], df["y"] = project_coordinates(df["d"].to_numpy(), df["e"].to_numpy(),
+                                               "EPSG:3857")
+    return df
 
 
-def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
-             show_figure: bool = False):
+def load_geo(regions=None, years=None, downloader=None) -> pd.DataFrame:
+    """Load accidents with coordinates projected to EPSG:3857
+
+    Projected coordinates are cached by DataDownloader next to region caches, so
+    they are computed only once.
+
+    Parameters
+    ----------
+    regions : List, optional
+        Shortnames of loaded regions, all by default.
+    years : List, optional
+        Selected years, all by default.
+    downloader : DataDownloader, optional
+        Source of the data.
+    Returns
+    -------
+    Dataframe in format produced by make_geo
+    """
+    downloader = DataDownloader() if downloader is None else downloader
+    df = downloader.get_dataframe(regions, ["region", "p2a", "p36", "d", "e"])
+    projected = downloader.get_projected(regions, "EPSG:3857")
+    df["x"] = projected["x"]
+    df["y"] = projected["y"]
+    return make_geo(df, years=years)
+
+
+def to_geodataframe(df: pd.DataFrame) -> geopandas.GeoDataFrame:
+    """Create point geometry of records in format produced by make_geo
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Records with projected coordinates.
+    Returns
+    -------
+    Geopandas dataframe in EPSG:3857
+    """
+    return geopandas.GeoDataFrame(df, geometry=geopandas.points_from_xy(df["x"], df["y"]),
+                                  crs="EPSG:3857")
+
+
+def density_raster(x, y, extent, resolution=400):
+    """Count points in cells of regular raster.
+
+    Parameters
+    ----------
+    x, y : ndarray
+        Coordinates of points.
+    extent : Tuple
+        Bounds of the raster (xmin, xmax, ymin, ymax).
+    resolution : Int, optional
+        Number of cells along the longer side of the raster, cells are square.
+    Returns
+    -------
+    ndarray with counts [row, column], the first row is the bottom one.
+    """
+    xmin, xmax, ymin, ymax = extent
+    size = max(xmax - xmin, ymax - ymin, 1e-9) / resolution
+    shape = (max(int(np.ceil((ymax - ymin) / size)), 1),
+             max(int(np.ceil((xmax - xmin) / size)), 1))
+    counts, _, _ = np.histogram2d(y, x, bins=shape,
+                                  range=[(ymin, ymin + shape[0] * size),
+                                         (xmin, xmin + shape[1] * size)])
+    return counts
+
+
+def _plot_points(ax, df, color, cmap, mode, extent, resolution):
+    """Draw accidents as markers or as density raster, see plot_geo."""
+    if mode == "points":
+        to_geodataframe(df).plot(ax=ax, markersize=1, color=color)
+        return
+    counts = density_raster(df["x"].to_numpy(), df["y"].to_numpy(), extent, resolution)
+    xmin, xmax, ymin, ymax = extent
+    size = max(xmax - xmin, ymax - ymin, 1e-9) / resolution
+    # cells without accidents stay transparent
+    ax.imshow(np.ma.masked_equal(counts, 0), origin="lower", cmap=cmap,
+              norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)), interpolation="nearest",
+              extent=(xmin, xmin + counts.shape[1] * size, ymin, ymin + counts.shape[0] * size))
+    ax.set_xlim(xmin, xmax)
+    ax.set_ylim(ymin, ymax)
+
+
+def plot_geo(gdf: pd.DataFrame, fig_location: str = None,
+             show_figure: bool = False, mode: str = "points", resolution: int = 400):
     """Create graphs based on location of the accidents for years 2018 - 2020
 
     Parameters
     ----------
-    gdf : geopandas.GeoDataFrame
-        Geopandas dataframe with dataset.
+    gdf : pd.DataFrame
+        Dataframe with dataset produced by make_geo.
     fig_location : String
         Path where to save the resulting figure.
     show_figure : Bool
         When set to True, figure is shown on the screen.
+    mode : String, optional
+        "points" draws every accident as marker, "density" draws numbers of
+        accidents binned to raster with log color scale, so time of drawing
+        doesn't depend on number of accidents.
+    resolution : Int, optional
+        Number of raster cells along the longer side of the map in density mode.
     """
     region = "JHM"
     # filter the region of interest
     gdf = gdf[gdf["region"] == "JHM"]
+    # all maps show the same area
+    extent = (gdf["x"].min(), gdf["x"].max(), gdf["y"].min(), gdf["y"].max())
     fig, axes = plt.subplots(3, 2, figsize=(8, 12), sharex="all", sharey="all")
     fig.tight_layout(pad=2)
 
     for i, year in enumerate([2018, 2019, 2020]):
         year_data = gdf[gdf["date"].dt.year == year]
         # highway
-        year_data[year_data["p36"] == 0].plot(ax=axes[i][0], markersize=1, color="green")
-        contextily.add_basemap(axes[i][0], crs=year_data.crs.to_string(),
-                               source=contextily.providers.Stamen.TonerLite,
-                               zoom=10, attribution_size=6)
+        _plot_points(axes[i][0], year_data[year_data["p36"] == 0], "green", "Greens",
+                     mode, extent, resolution)
+        get_basemap().add_basemap(axes[i][0], zoom=10, attribution_size=6)
         axes[i][0].axis('off')
         axes[i][0].set_title(f"{region} kraj: dálnice ({year})")
 
         # first class roads
-        year_data[year_data["p36"] == 1].plot(ax=axes[i][1], markersize=1, color="red")
-        contextily.add_basemap(axes[i][1], crs=year_data.crs.to_string(),
-                               source=contextily.providers.Stamen.TonerLite,
-                               zoom=10, attribution_size=6)
+        _plot_points(axes[i][1], year_data[year_data["p36"] == 1], "red", "Reds",
+                     mode, extent, resolution)
+        get_basemap().add_basemap(axes[i][1], zoom=10, attribution_size=6)
         axes[i][1].axis('off')
         axes[i][1].set_title(f"{region} kraj: silnice první třídy ({year})")
 
@@ -82,44 +207,94 @@ def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
         plt.show()
 
 
-def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
-                 show_figure: bool = False):
+def stored_hotspots(region: str = "JHM", road: int = 1,
+                    n_clusters: int = 30) -> Hotspots:
+    """Get clusters of accidents in region on roads of given class stored by hotspots.py
+
+    Stored clusters are updated with newly appended accidents, they are fitted only
+    when nothing is stored yet or the cache of the region was rebuilt, see
+    hotspots.fit_hotspots.
+
+    Parameters
+    ----------
+    region : String
+        Shortname of the region.
+    road : Int
+        Road class (p36).
+    n_clusters : Int
+        Number of clusters.
+    Returns
+    -------
+    Hotspots or None when there are no such accidents.
+    """
+    return fit_hotspots([region], [road], n_clusters, workers=1).get((region, road))
+
+
+def cluster_table(hotspots: Hotspots, top: int = 10) -> pd.DataFrame:
+    """Create table of the largest clusters from their stored summaries
+
+    Parameters
+    ----------
+    hotspots : Hotspots
+        Clusters of accidents.
+    top : Int
+        Number of clusters in the table.
+    Returns
+    -------
+    Dataframe with id, number of accidents and center (EPSG:3857) of the clusters
+    ordered from the largest one.
+    """
+    summary = pd.DataFrame(hotspots.summary()).head(top)
+    return summary.rename(columns={"cluster": "Úsek", "count": "Počet nehod"})
+
+
+def plot_cluster(gdf: pd.DataFrame, fig_location: str = None,
+                 show_figure: bool = False, hotspots: Hotspots = None):
     """Create graph with location of all accidents in the region aggregated to clusters
 
     Parameters
     ----------
-    gdf : geopandas.GeoDataFrame
-        Geopandas dataframe with dataset.
+    gdf : pd.DataFrame
+        Dataframe with dataset produced by make_geo, it is clustered only when
+        hotspots are neither given nor stored.
     fig_location : String
         Path where to save the resulting figure.
     show_figure : Bool
         When set to True, figure is shown on the screen.
+    hotspots : Hotspots, optional
+        Precomputed clusters of accidents on first class roads in JHM, e.g. from
+        hotspots.fit_hotspots, clusters stored by hotspots.py are used by
+        default, see stored_hotspots.
     """
     # define and filter the region of interest
     region = "JHM"
-    gdf = gdf[gdf["region"] == "JHM"].copy()
-    # we want only accidents from first class roads
-    gdf = gdf[gdf["p36"] == 1].copy()
-
-    # create clusters
-    coords = np.dstack([gdf.geometry.x, gdf.geometry.y]).reshape(-1, 2)
-    # I tried different number of (15, 20, 30, 40, 50, 60) clusters, 30 seemed as working the best way,
-    # so I just eyeballed this parameter. I also tried few different algorithms presented in slides,
-    # that use Distances between points as clustering metric, but they had either poor results, or
-    # none at all, because I wasn't able to set the parameters properly. So I just used MiniBatchKMeans,
-    # which gave me satisfying results.
-    db = sklearn.cluster.MiniBatchKMeans(n_clusters=30).fit(coords)
-    gdf["cluster"] = db.labels_
-    gdf["Počet nehod"] = 1
-    gdf = gdf.dissolve(by="cluster", aggfunc={"Počet nehod": "sum"})
+    if hotspots is None:
+        try:
+            hotspots = stored_hotspots(region, 1)
+        except OSError:
+            # dataset of DataDownloader isn't available, accidents of gdf are clustered
+            hotspots = None
+    if hotspots is None:
+        # we want only accidents from first class roads
+        selected = ((gdf["region"] == region) & (gdf["p36"] == 1)).to_numpy()
+        # create clusters
+        # I tried different number of (15, 20, 30, 40, 50, 60) clusters, 30 seemed as working the best way,
+        # so I just eyeballed this parameter. I also tried few different algorithms presented in slides,
+        # that use Distances between points as clustering metric, but they had either poor results, or
+        # none at all, because I wasn't able to set the parameters properly. So I just used MiniBatchKMeans,
+        # which gave me satisfying results.
+        hotspots = Hotspots.fit(region, 1, np.flatnonzero(selected),
+                                gdf["x"].to_numpy()[selected], gdf["y"].to_numpy()[selected],
+                                len(gdf), n_clusters=30)
 
     fig, ax = plt.subplots(1, 1, figsize=(8, 12))
     fig.tight_layout()
     ax.axis('off')
-    gdf.plot(ax=ax, column="Počet nehod", cmap='viridis', legend='True', markersize=1,
-             legend_kwds={'label': "Počet nehod v úseku", 'location': "bottom", "ax": ax, "pad": 0})
-    contextily.add_basemap(ax, crs=gdf.crs.to_string(), source=contextily.providers.Stamen.TonerLite, zoom=10,
-                           attribution_size=6)
+    # each accident is colored by size of its cluster, no geometry is needed
+    points = ax.scatter(hotspots.x, hotspots.y, c=hotspots.point_counts(), cmap='viridis', s=1)
+    ax.set_aspect("equal")
+    fig.colorbar(points, ax=ax, label="Počet nehod v úseku", location="bottom", pad=0)
+    get_basemap().add_basemap(ax, zoom=10, attribution_size=6)
     ax.set_title(f"Nehody v {region} kraji na silnicích první třídy")
 
     if fig_location is not None:
@@ -132,7 +307,58 @@ def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
         plt.show()
 
 
+def main(argv=None):
+    """Main function
+
+    Parameters
+    ----------
+    argv Argument vector passed to the ArgumentParser.
+    Following arguments are defined and can be passed from command line:
+        --offline : Use only cached tiles of basemaps.
+        --density : Draw maps of accidents as density rasters.
+        --force : Draw maps even when they are up to date.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Use only tiles of basemaps cached in data/tiles.mbtiles, "
+             "they can be downloaded by tiles.py."
+    )
+    parser.add_argument(
+        "--density",
+        action="store_true",
+        help="Draw maps of accidents as density rasters instead of points."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Draw maps even when neither data nor plotting code changed."
+    )
+    args = parser.parse_args(argv)
+    get_basemap().offline = args.offline
+
+    from render import FigureJob, stale_figures
+    mode = "density" if args.density else "points"
+    geo_job = FigureJob("geo", "geo", "plot_geo", "outputs/geo1.png", mode=mode)
+    cluster_job = FigureJob("cluster", "geo", "plot_cluster", "outputs/geo2.png")
+    cache, stale = stale_figures([geo_job, cluster_job], force=args.force)
+
+    # stored clusters are only updated with new accidents, so their ids are stable
+    hotspots = stored_hotspots("JHM", 1)
+    if stale:
+        # only the region of the maps is loaded, its projected coordinates are cached
+        geodf = load_geo(["JHM"])
+        if geo_job in stale:
+            plot_geo(geodf, geo_job.fig_location, True, mode=mode)
+            cache.store(geo_job, stale[geo_job])
+        if cluster_job in stale:
+            plot_cluster(geodf, cluster_job.fig_location, True, hotspots=hotspots)
+            cache.store(cluster_job, stale[cluster_job])
+        cache.save()
+    if hotspots is not None:
+        print(cluster_table(hotspots).to_string(index=False))
+
+
 if __name__ == "__main__":
-    geodf = make_geo(pd.read_pickle("accidents.pkl.gz"))
-    plot_geo(geodf, "outputs/geo1.png", True)
-    plot_cluster(geodf, "outputs/geo2.png", True)
+    main()
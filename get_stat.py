@@ -11,46 +11,195 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from matplotlib.colors import LogNorm
-from download import DataDownloader
+from download import CountCube, DataDownloader
 
 
-def plot_stat(data_source, fig_location=None, show_figure=False):
+# labels of values of attributes, in the order of rows of the plots
+attribute_labels = {
+    "p24": {
+        1: "Přerušovaná žlutá",
+        2: "Semafor mimo provoz",
+        3: "Dopravní značky",
+        4: "Přenosné dopravní značky",
+        5: "Nevyznačena",
+        0: "Žádná úprava",
+    },
+    "p21": {
+        1: "Dvoupruhová",
+        2: "Třípruhová",
+        3: "Čtyřpruhová s dělicím pásem",
+        4: "Čtyřpruhová s dělicí čarou",
+        5: "Vícepruhová",
+        6: "Rychlostní komunikace",
+        0: "Jiná komunikace",
+    },
+    "p18": {
+        1: "Neztížené",
+        2: "Mlha",
+        3: "Na počátku deště",
+        4: "Déšť",
+        5: "Sněžení",
+        6: "Náledí",
+        7: "Vítr",
+        0: "Jiné",
+    },
+    "p10": {
+        1: "Řidičem motorového vozidla",
+        2: "Řidičem nemotorového vozidla",
+        3: "Chodcem",
+        4: "Zvěří",
+        5: "Jiným účastníkem",
+        6: "Závadou komunikace",
+        7: "Technickou závadou vozidla",
+        0: "Jiné",
+    },
+}
+
+
+def count_stats(data_source, attributes=("p24",)):
+    """Count accidents in regions by values of attributes.
+
+    All attributes are counted in single pass over the data. Each chunk is
+    counted at once by np.bincount of combined region and value key, so records
+    can be in any order.
+
+    Parameters
+    ----------
+    data_source : Dictionary with data in format produced by DataDownloader.get_dict
+        or iterable of such dictionaries, e.g. chunks produced by
+        DataDownloader.iter_chunks, which are counted one by one. Only "region" and
+        attributes columns are used. CountCube produced by DataDownloader.get_cube
+        can be passed instead, which is already counted by its column.
+    attributes : Iterable, optional
+        Names of attributes with labels in attribute_labels.
+    Returns
+    -------
+    Dictionary with {attribute : (list of regions, ndarray of counts [value,
+    region])}, values are in the order of attribute_labels and regions sorted.
+    """
+    attributes = list(attributes)
+    lookups = {}
+    for attribute in attributes:
+        values = np.array(list(attribute_labels[attribute]))
+        # row of each value, offset by the smallest value, -1 for unknown values
+        lookup = np.full(values.max() - values.min() + 1, -1)
+        lookup[values - values.min()] = np.arange(len(values))
+        lookups[attribute] = (values.min(), lookup)
+
+    region_counts = {attribute: {} for attribute in attributes}
+    if isinstance(data_source, CountCube):
+        cube = data_source.select(values=attribute_labels[data_source.column])
+        # regions without records are left out, like in chunks
+        present = data_source.total().sum(axis=1) > 0
+        region_counts[data_source.column] = {
+            region: counts for region, counts, keep
+            in zip(cube.regions, cube.total(), present) if keep}
+        chunks = []
+    else:
+        chunks = [data_source] if isinstance(data_source, dict) else data_source
+    for chunk in chunks:
+        categories = getattr(chunk, "categories", {})
+        if "region" in categories:
+            names, codes = categories["region"], chunk["region"]
+        else:
+            names, codes = np.unique(chunk["region"], return_inverse=True)
+            codes = codes.ravel()
+        present = np.bincount(codes, minlength=len(names)) > 0
+        for attribute in attributes:
+            low, lookup = lookups[attribute]
+            index = chunk[attribute].astype(np.intp) - low
+            rows = lookup[np.clip(index, 0, len(lookup) - 1)]
+            # handle invalid values (mapped to -1) and values without label
+            rows[(index < 0) | (index >= len(lookup))] = -1
+            valid = rows >= 0
+            n_rows = len(lookup[lookup >= 0])
+            counts = np.bincount(codes[valid] * n_rows + rows[valid],
+                                 minlength=len(names) * n_rows)
+            counts = counts.reshape(len(names), n_rows)
+            for name, region_count in zip(names[present], counts[present]):
+                total = region_counts[attribute].setdefault(name, np.zeros(n_rows))
+                total += region_count
+
+    result = {}
+    for attribute, counts in region_counts.items():
+        regs = sorted(counts)
+        abs_matrix = np.zeros((len(attribute_labels[attribute]), len(regs)))
+        for i, reg in enumerate(regs):
+            abs_matrix[:, i] = counts[reg]
+        result[attribute] = (regs, abs_matrix)
+    return result
+
+
+def plot_stat(data_source, fig_location=None, show_figure=False, attribute="p24"):
     """Plot statistics of absolute and relative accidents and causes across regions.
 
     Parameters
     ----------
     data_source : Dictionary with data in format produced by DataDownloader.get_dict
+        or iterable of such dictionaries or CountCube, see count_stats.
+        Only "region" and attribute columns are used.
     fig_location : String, optional
         Path to store resulting plot, including filename and format extension.
         If not specified, figure is not saved.
     show_figure : Bool, optional
         When set to True, resulting figure is also shown on the screen. If not
         specified default value is False, and hence figure is not shown on the screen.
+    attribute : String, optional
+        Name of plotted attribute with labels in attribute_labels, p24 by default.
+    """
+    regs, abs_matrix = count_stats(data_source, [attribute])[attribute]
+    _plot_matrix(regs, abs_matrix, attribute, fig_location, show_figure)
+
+
+def plot_stats(data_source, attributes, fig_location=None, show_figure=False):
+    """Plot statistics of several attributes counted in single pass over the data.
+
+    Parameters
+    ----------
+    data_source : Dictionary with data in format produced by DataDownloader.get_dict
+        or iterable of such dictionaries, see count_stats. Dictionary with
+        {attribute : CountCube} can be passed instead.
+    attributes : Iterable
+        Names of plotted attributes with labels in attribute_labels.
+    fig_location : String, optional
+        Template of path to store resulting plots, "{}" is replaced by name of
+        attribute. If not specified, figures are not saved.
+    show_figure : Bool, optional
+        When set to True, resulting figures are also shown on the screen.
+    """
+    attributes = list(attributes)
+    if isinstance(data_source, dict) and all(
+            isinstance(data_source.get(attribute), CountCube) for attribute in attributes):
+        stats = {attribute: count_stats(data_source[attribute], [attribute])[attribute]
+                 for attribute in attributes}
+    else:
+        stats = count_stats(data_source, attributes)
+    for attribute in attributes:
+        regs, abs_matrix = stats[attribute]
+        location = None if fig_location is None else fig_location.format(attribute)
+        fig = _plot_matrix(regs, abs_matrix, attribute, location, show_figure)
+        if not show_figure:
+            plt.close(fig)
+
+
+def _plot_matrix(regs, abs_matrix, attribute, fig_location=None, show_figure=False):
+    """Plot absolute and relative counts of accidents, see plot_stat.
+
+    Returns
+    -------
+    Created figure.
     """
-    # prepare data
-    regs, reg_ind, reg_counts = np.unique(data_source["region"], return_index=True,
-                                          return_counts=True)
-    abs_matrix = np.zeros((6, len(regs)))
-    for i in range(len(regs)):
-        region_slice = data_source["p24"][reg_ind[i]: reg_ind[i] + reg_counts[i]]
-        accidents_values, accidents_counts = np.unique(region_slice, return_counts=True)
-        # handle possible invalid values (they would be mapped to -1)
-        if accidents_values[0] == -1:
-            accidents_values = accidents_values[1:]
-            accidents_counts = accidents_counts[1:]
-        abs_matrix[accidents_values, i] = accidents_counts
-    abs_matrix = np.roll(abs_matrix, -1, axis=0)
     sums = np.sum(abs_matrix, axis=1)
-    rel_matrix = (abs_matrix.T / sums).T * 100
+    with np.errstate(invalid="ignore"):
+        rel_matrix = (abs_matrix.T / sums).T * 100
 
     # plot results
-    ylabels = ["Přerušovaná žlutá", "Semafor mimo provoz", "Dopravní značky",
-               "Přenosné dopravní značky", "Nevyznačena", "Žádná úprava"]
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(8.8, 5.8))
+    ylabels = list(attribute_labels[attribute].values())
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(8.8, 5.8 + 0.3 * max(len(ylabels) - 6, 0)))
     fig.tight_layout(pad=3)
     masked = np.ma.masked_where(abs_matrix == 0, abs_matrix)
     im_abs = ax1.imshow(masked, cmap="viridis",
-                        norm=LogNorm(vmax=10 ** np.ceil(np.log10(abs_matrix.max()))))
+                        norm=LogNorm(vmax=10 ** np.ceil(np.log10(max(abs_matrix.max(), 1)))))
     ax1.set_title("Absolutně")
     cbar1 = plt.colorbar(im_abs, ax=ax1, shrink=1.15)
     ax1.set_xticks(range(len(regs)))
@@ -76,6 +225,7 @@ def plot_stat(data_source, fig_location=None, show_figure=False):
         dirname = os.path.dirname(path)
         os.makedirs(dirname, exist_ok=True)
         fig.savefig(path)
+    return fig
 
 
 def main(argv=None):
@@ -87,6 +237,11 @@ def main(argv=None):
     Following arguments are defined and can be passed from command line:
         --fig_location : Defines location of resulting plots..
         --show_figure : Show the plot when it's created.
+        --workers : Number of processes used to parse regions.
+        --chunk_rows : Count statistics in chunks of given number of records.
+        --raw : Count statistics from records instead of precomputed counts.
+        --attributes : Plot statistics of given attributes, each to its own file.
+        --force : Plot statistics even when saved plots are up to date.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -99,11 +254,77 @@ def main(argv=None):
         action="store_true",
         help="Show the plot when it's created."
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes used to parse regions which are not cached yet."
+    )
+    parser.add_argument(
+        "--chunk_rows",
+        type=int,
+        default=None,
+        help="Count statistics in chunks of given number of records instead of "
+             "loading whole dataset at once."
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="Count statistics from records instead of precomputed counts."
+    )
+    parser.add_argument(
+        "--attributes",
+        nargs="+",
+        default=["p24"],
+        choices=list(attribute_labels),
+        help="Plot statistics of given attributes. When more attributes are given, "
+             "name of attribute is appended to name of each plot."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Plot statistics even when neither data nor plotting code changed."
+    )
     args = parser.parse_args(argv)
     if args.fig_location is None and not args.show_figure:
         return
 
-    plot_stat(DataDownloader().get_dict(), args.fig_location, args.show_figure)
+    fig_location = args.fig_location
+    if fig_location is not None:
+        fig_location = fig_location.replace("{", "{{").replace("}", "}}")
+        if len(args.attributes) > 1:
+            root, ext = os.path.splitext(fig_location)
+            fig_location = root + "_{}" + ext
+
+    attributes = args.attributes
+    cache = None
+    if fig_location is not None and not args.show_figure:
+        # saved plots which are up to date are kept
+        from render import FigureJob, stale_figures
+        jobs = {FigureJob(f"stat_{attribute}", "get_stat", "plot_stat",
+                          fig_location.format(attribute), attribute=attribute): attribute
+                for attribute in attributes}
+        cache, stale = stale_figures(list(jobs), force=args.force)
+        attributes = [jobs[job] for job in stale]
+        if not attributes:
+            return
+
+    # all attributes are loaded and counted at once
+    columns = ["region"] + attributes
+    if not args.raw and not args.chunk_rows:
+        downloader = DataDownloader()
+        data = {attribute: downloader.get_cube(attribute, workers=args.workers)
+                for attribute in attributes}
+    elif args.chunk_rows:
+        data = DataDownloader().iter_chunks(columns=columns, chunk_rows=args.chunk_rows)
+    else:
+        data = DataDownloader().get_dict(columns=columns, workers=args.workers)
+
+    plot_stats(data, attributes, fig_location, args.show_figure)
+    if cache is not None:
+        for job, key in stale.items():
+            cache.store(job, key)
+        cache.save()
 
 
 if __name__ == "__main__":
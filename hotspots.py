@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""hotspots.py: Find clusters of accidents from dataset provided by PČR by region and road class"""
+
+__author__ = "David Sedlák"
+__email__ = "xsedla1d@stud.fit.vutbr.cz"
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from download import DataDownloader, atomic_open
+
+# names of road classes (p36)
+road_classes = {
+    0: "dálnice",
+    1: "silnice 1. třídy",
+    2: "silnice 2. třídy",
+    3: "silnice 3. třídy",
+    4: "uzel",
+    5: "komunikace sledovaná",
+    6: "komunikace místní",
+    7: "komunikace účelová",
+    8: "komunikace účelová ostatní",
+}
+
+
+def cluster_hulls(x, y, labels, n_clusters, directions=32):
+    """Compute polygons enclosing points of each cluster at once.
+
+    Vertices of the polygon of a cluster are its extreme points in given number
+    of directions, so they lie on its convex hull and the polygon converges to the
+    hull with growing number of directions.
+
+    Parameters
+    ----------
+    x, y : ndarray
+        Coordinates of points.
+    labels : ndarray
+        Cluster of each point, from 0 to n_clusters - 1.
+    n_clusters : Int
+        Number of clusters.
+    directions : Int, optional
+        Number of directions.
+    Returns
+    -------
+    Tuple (offsets, hull x, hull y), vertices of cluster i are
+    hull x[offsets[i]:offsets[i + 1]] in counterclockwise order.
+    """
+    angles = np.linspace(0, 2 * np.pi, directions, endpoint=False)
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=n_clusters)
+    present = np.flatnonzero(counts)
+    if not present.size:
+        return np.zeros(n_clusters + 1, dtype=np.int64), x[:0], y[:0]
+    starts = (np.cumsum(counts) - counts)[present]
+    # projections of points grouped by cluster [point, direction]
+    projections = (np.outer(x[order], np.cos(angles))
+                   + np.outer(y[order], np.sin(angles)))
+    maxima = np.maximum.reduceat(projections, starts, axis=0)
+    is_max = projections == np.repeat(maxima, counts[present], axis=0)
+    positions = np.where(is_max, np.arange(len(order))[:, np.newaxis], len(order))
+    # [cluster, direction] index of the first extreme point
+    extremes = order[np.minimum.reduceat(positions, starts, axis=0)]
+
+    offsets = np.zeros(n_clusters + 1, dtype=np.int64)
+    vertices = []
+    for label, points in zip(present, extremes):
+        # the same point is often extreme in neighbouring directions
+        keep = np.append(points[1:] != points[:-1], points[-1] != points[0])
+        points = points[keep] if keep.any() else points[:1]
+        vertices.append(points)
+        offsets[label + 1] = len(points)
+    offsets = np.cumsum(offsets)
+    vertices = np.concatenate(vertices) if vertices else np.zeros(0, dtype=np.intp)
+    return offsets, x[vertices], y[vertices]
+
+
+class Hotspots:
+    """Clusters of accidents of single region and road class.
+
+    Attributes
+    ----------
+    region Shortname of the region.
+    road Road class (p36).
+    rows ndarray with indices of clustered records in the clustered data, in get_dict
+        of the region for clusters from fit_hotspots.
+    x, y ndarrays with coordinates of clustered records in EPSG:3857.
+    labels ndarray with cluster of each record.
+    counts ndarray with number of records in each cluster.
+    centers ndarray with centroids of clusters [cluster, axis].
+    hull_offsets, hull_x, hull_y Polygons around clusters, see cluster_hulls.
+    data_rows Number of records of the region when the clusters were computed.
+    drift Size weighted mean shift of centers in meters caused by the last update,
+        see partial_fit.
+    updates Number of updates since the clusters were fitted.
+    cache Fingerprint of the region cache the clusters were computed from, see
+        DataDownloader.cache_fingerprint, or None when unknown.
+
+    Clusters keep their index through updates, so the index is stable identifier
+    of the cluster.
+    """
+
+    def __init__(self, region, road, rows, x, y, labels, n_clusters, data_rows,
+                 summary=None, drift=0.0, updates=0, cache=None):
+        """Initializer which computes summaries of the clusters.
+
+        Parameters
+        ----------
+        region : String
+            Shortname of the region.
+        road : Int
+            Road class.
+        rows : ndarray
+            Indices of clustered records.
+        x, y : ndarray
+            Coordinates of clustered records.
+        labels : ndarray
+            Cluster of each record, from 0 to n_clusters - 1.
+        n_clusters : Int
+            Number of clusters.
+        data_rows : Int
+            Number of records of the region.
+        summary : Dictionary, optional
+            Already computed counts, centers, hull_offsets, hull_x and hull_y.
+        drift : Float, optional
+            Drift caused by the last update.
+        updates : Int, optional
+            Number of updates since the clusters were fitted.
+        cache : Dictionary, optional
+            Fingerprint of the region cache.
+        """
+        self.region = region
+        self.road = int(road)
+        self.rows = rows
+        self.x = x
+        self.y = y
+        self.labels = labels
+        self.data_rows = int(data_rows)
+        self.drift = float(drift)
+        self.updates = int(updates)
+        self.cache = cache
+        if summary is not None:
+            self.__dict__.update(summary)
+            return
+        self.counts = np.bincount(labels, minlength=n_clusters)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.centers = np.column_stack([
+                np.bincount(labels, x, minlength=n_clusters) / self.counts,
+                np.bincount(labels, y, minlength=n_clusters) / self.counts])
+        self.hull_offsets, self.hull_x, self.hull_y = cluster_hulls(x, y, labels, n_clusters)
+
+    @classmethod
+    def fit(cls, region, road, rows, x, y, data_rows, n_clusters=30, random_state=0,
+            cache=None):
+        """Cluster records by MiniBatchKMeans.
+
+        Parameters
+        ----------
+        region, road, rows, x, y, data_rows, cache
+            See Hotspots.
+        n_clusters : Int, optional
+            Number of clusters, limited by number of records.
+        random_state : Int, optional
+            Seed of the clustering, so repeated fits give the same clusters.
+        Returns
+        -------
+        Hotspots with the clusters.
+        """
+        import sklearn.cluster
+
+        n_clusters = max(min(n_clusters, len(x)), 1)
+        if len(x) <= n_clusters:
+            labels = np.arange(len(x))
+        else:
+            model = sklearn.cluster.MiniBatchKMeans(n_clusters=n_clusters,
+                                                    random_state=random_state, n_init=3)
+            labels = model.fit_predict(np.column_stack([x, y]))
+        return cls(region, road, rows, x, y, labels.astype(np.intp), n_clusters, data_rows,
+                   cache=cache)
+
+    def partial_fit(self, rows, x, y, data_rows, cache=None):
+        """Add new records to the clusters without fitting them again.
+
+        New records are assigned to the nearest center and centers move to the
+        mean of all their records, like in mini-batch k-means with per-center
+        learning rate. Labels of previous records are kept, so the work depends
+        only on the number of new records.
+
+        Parameters
+        ----------
+        rows : ndarray
+            Indices of new records.
+        x, y : ndarray
+            Coordinates of new records.
+        data_rows : Int
+            Number of records of the region including the new ones.
+        cache : Dictionary, optional
+            Fingerprint of the region cache including the new records.
+        Returns
+        -------
+        New Hotspots with updated clusters and drift.
+        """
+        n_clusters = self.n_clusters
+        # empty clusters have no center and get no records
+        distances = ((x[:, np.newaxis] - self.centers[:, 0]) ** 2
+                     + (y[:, np.newaxis] - self.centers[:, 1]) ** 2)
+        distances[:, self.counts == 0] = np.inf
+        labels = (np.argmin(distances, axis=1) if len(x)
+                  else np.zeros(0, dtype=np.intp))
+
+        counts = self.counts + np.bincount(labels, minlength=n_clusters)
+        sums = np.nan_to_num(self.centers) * self.counts[:, np.newaxis] + np.column_stack([
+            np.bincount(labels, x, minlength=n_clusters),
+            np.bincount(labels, y, minlength=n_clusters)])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            centers = sums / counts[:, np.newaxis]
+        shifts = np.nan_to_num(np.hypot(*(centers - self.centers).T))
+        drift = (shifts * counts).sum() / max(counts.sum(), 1)
+
+        # polygon of all records is the polygon of previous vertices and new records
+        previous = np.repeat(np.arange(n_clusters), np.diff(self.hull_offsets))
+        hulls = cluster_hulls(np.concatenate([self.hull_x, x]),
+                              np.concatenate([self.hull_y, y]),
+                              np.concatenate([previous, labels]), n_clusters)
+        summary = dict(zip(["counts", "centers", "hull_offsets", "hull_x", "hull_y"],
+                           (counts, centers) + hulls))
+        return Hotspots(self.region, self.road, np.concatenate([self.rows, rows]),
+                        np.concatenate([self.x, x]), np.concatenate([self.y, y]),
+                        np.concatenate([self.labels, labels]), n_clusters, data_rows,
+                        summary, drift, self.updates + 1, cache)
+
+    @property
+    def n_clusters(self):
+        return len(self.counts)
+
+    def point_counts(self):
+        """Return size of cluster of each record."""
+        return self.counts[self.labels]
+
+    def hull(self, label):
+        """Return ndarray with vertices [vertex, axis] of polygon around cluster."""
+        start, end = self.hull_offsets[label], self.hull_offsets[label + 1]
+        return np.column_stack([self.hull_x[start:end], self.hull_y[start:end]])
+
+    def summary(self):
+        """Return dictionary with {column : ndarray} describing clusters ordered
+        from the largest one."""
+        order = np.argsort(-self.counts, kind="stable")
+        return {"cluster": order, "count": self.counts[order],
+                "x": self.centers[order, 0], "y": self.centers[order, 1]}
+
+    def save(self, filename):
+        """Store clusters in .npz file, see load."""
+        with atomic_open(filename) as f:
+            np.savez(f, region=self.region, road=self.road, rows=self.rows,
+                     x=self.x, y=self.y, labels=self.labels.astype(np.int32),
+                     n_clusters=self.n_clusters, data_rows=self.data_rows,
+                     counts=self.counts, centers=self.centers,
+                     hull_offsets=self.hull_offsets, hull_x=self.hull_x,
+                     hull_y=self.hull_y, drift=self.drift, updates=self.updates,
+                     cache=json.dumps(self.cache, sort_keys=True))
+
+    @classmethod
+    def load(cls, filename):
+        """Load clusters stored by save or return None when file doesn't exist."""
+        try:
+            with np.load(filename) as f:
+                summary = {name: f[name] for name in
+                           ["counts", "centers", "hull_offsets", "hull_x", "hull_y"]}
+                # clusters stored without fingerprint can't be checked
+                cache = json.loads(str(f["cache"])) if "cache" in f.files else None
+                return cls(str(f["region"]), int(f["road"]), f["rows"], f["x"], f["y"],
+                           f["labels"].astype(np.intp), int(f["n_clusters"]),
+                           int(f["data_rows"]), summary, float(f["drift"]),
+                           int(f["updates"]), cache)
+        except FileNotFoundError:
+            return None
+
+
+def _is_append(stored, current):
+    """Check that region cache with fingerprint current only has records appended
+    to the cache with fingerprint stored, see DataDownloader.cache_fingerprint."""
+    if stored == current:
+        return True
+    if stored is None or not stored["archives"] or stored["version"] != current["version"]:
+        return False
+    # appended archives leave records of the previous ones untouched
+    return all(current["archives"].get(name) == digest
+               for name, digest in stored["archives"].items())
+
+
+def _fit_group(args):
+    """Fit clusters of single group in worker process, see fit_hotspots."""
+    region, road, rows, x, y, data_rows, n_clusters, cache, filename = args
+    hotspots = Hotspots.fit(region, road, rows, x, y, data_rows, n_clusters, cache=cache)
+    hotspots.save(filename)
+    return hotspots
+
+
+def fit_hotspots(regions=None, roads=None, n_clusters=30, workers=None, refit=False,
+                 downloader=None, folder=None, max_drift=None):
+    """Find clusters of accidents for each region and road class.
+
+    Groups are clustered in parallel worker processes and stored together with
+    fingerprint of the region cache. Records appended to the region later are
+    added to stored clusters by Hotspots.partial_fit, so only new records are
+    processed. Clusters of region caches which were rebuilt instead of extended
+    are clustered again.
+
+    Parameters
+    ----------
+    regions : List, optional
+        Shortnames of regions, all by default.
+    roads : List, optional
+        Road classes (p36), all by default.
+    n_clusters : Int, optional
+        Number of clusters of each group.
+    workers : Int, optional
+        Number of worker processes, number of CPUs by default.
+    refit : Bool, optional
+        When set to True, stored clusters are not used.
+    downloader : DataDownloader, optional
+        Source of the data.
+    folder : String, optional
+        Directory with stored clusters, hotspots in folder of the downloader
+        by default.
+    max_drift : Float, optional
+        Groups whose update moves centers by more meters (see Hotspots.drift)
+        are clustered again from scratch.
+    Returns
+    -------
+    Dictionary with {(region, road) : Hotspots}, groups without records are
+    left out.
+    """
+    downloader = DataDownloader() if downloader is None else downloader
+    regions = list(dict.fromkeys(regions)) if regions else list(downloader.regions)
+    roads = list(road_classes) if roads is None else list(roads)
+    folder = os.path.join(downloader.folder, "hotspots") if folder is None else folder
+    os.makedirs(folder, exist_ok=True)
+
+    results = {}
+    tasks = []
+    for region in regions:
+        data = downloader.get_dict([region], ["p36"], decode=False)
+        projected = downloader.get_projected([region], "EPSG:3857")
+        n_rows = len(data["p36"])
+        cache = downloader.cache_fingerprint(region)
+        for road in roads:
+            filename = os.path.join(folder, f"{region}_{road}_{n_clusters}.npz")
+            hotspots = None if refit else Hotspots.load(filename)
+            if hotspots is not None and (hotspots.data_rows > n_rows
+                                         or not _is_append(hotspots.cache, cache)):
+                # cache of the region was rebuilt, stored records may have changed
+                hotspots = None
+            start = 0 if hotspots is None else hotspots.data_rows
+            x, y = projected["x"][start:], projected["y"][start:]
+            rows = start + np.flatnonzero(~np.isnan(x) & ~np.isnan(y)
+                                          & (data["p36"][start:] == road))
+            if hotspots is None:
+                if rows.size:
+                    tasks.append((region, road, rows, projected["x"][rows],
+                                  projected["y"][rows], n_rows, n_clusters, cache, filename))
+                continue
+            if start < n_rows:
+                updated = hotspots.partial_fit(rows, projected["x"][rows],
+                                               projected["y"][rows], n_rows, cache)
+                if max_drift is not None and updated.drift > max_drift:
+                    # clusters moved too much, all records are clustered again
+                    tasks.append((region, road, updated.rows, updated.x, updated.y,
+                                  n_rows, n_clusters, cache, filename))
+                    continue
+                hotspots = updated
+                hotspots.save(filename)
+            results[region, road] = hotspots
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        fitted = list(map(_fit_group, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            fitted = list(executor.map(_fit_group, tasks))
+    for hotspots in fitted:
+        results[hotspots.region, hotspots.road] = hotspots
+    return {(region, road): results[region, road] for region in regions for road in roads
+            if (region, road) in results}
+
+
+def main(argv=None):
+    """Main function
+
+    Parameters
+    ----------
+    argv Argument vector passed to the ArgumentParser.
+    Following arguments are defined and can be passed from command line:
+        --regions : Shortnames of clustered regions.
+        --roads : Clustered road classes.
+        --clusters : Number of clusters of each region and road class.
+        --workers : Number of worker processes.
+        --refit : Ignore stored clusters.
+        --max_drift : Drift in meters, above which groups are clustered again.
+        --top : Number of the largest clusters printed for each group.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regions", nargs="+", default=None,
+                        help="Shortnames of clustered regions (all by default).")
+    parser.add_argument("--roads", nargs="+", type=int, default=None,
+                        choices=list(road_classes),
+                        help="Clustered road classes p36 (all by default).")
+    parser.add_argument("--clusters", type=int, default=30,
+                        help="Number of clusters of each region and road class.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (number of CPUs by default).")
+    parser.add_argument("--refit", action="store_true",
+                        help="Cluster accidents again even when stored clusters are "
+                             "up to date.")
+    parser.add_argument("--max_drift", type=float, default=None,
+                        help="Cluster groups again from scratch, when new accidents "
+                             "move their clusters by more meters on average.")
+    parser.add_argument("--top", type=int, default=3,
+                        help="Number of the largest clusters printed for each group.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = fit_hotspots(args.regions, args.roads, args.clusters, args.workers,
+                           args.refit, max_drift=args.max_drift)
+    for (region, road), hotspots in results.items():
+        summary = hotspots.summary()
+        print(f"{region}, {road_classes[road]}: {len(hotspots.labels)} nehod, "
+              f"aktualizací {hotspots.updates}, posun {hotspots.drift:.0f} m")
+        for i in range(min(args.top, hotspots.n_clusters)):
+            print(f"    shluk {summary['cluster'][i]}: {summary['count'][i]} nehod, střed "
+                  f"({summary['x'][i]:.0f}, {summary['y'][i]:.0f})")
+    print(f"Celkem: {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
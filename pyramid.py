@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""pyramid.py: Export density of accidents provided by PČR as XYZ tile pyramid"""
+
+__author__ = "David Sedlák"
+__email__ = "xsedla1d@stud.fit.vutbr.cz"
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from download import DataDownloader, atomic_open
+from tiles import _ORIGIN
+
+# pixels along side of a tile
+TILE_SIZE = 256
+
+
+def pixel_counts(x, y, zoom):
+    """Count points in pixels of XYZ tiles at given zoom level.
+
+    Parameters
+    ----------
+    x, y : ndarray
+        Coordinates in EPSG:3857, points with NaN coordinates are left out.
+    zoom : Int
+        Zoom level.
+    Returns
+    -------
+    Tuple (column, row, counts) of ndarrays, global pixel coordinates (row 0
+    at the top) of pixels with at least one point and their counts, sorted by
+    column and row.
+    """
+    valid = ~np.isnan(x) & ~np.isnan(y)
+    size = 2 * _ORIGIN / (TILE_SIZE << zoom)
+    limit = (TILE_SIZE << zoom) - 1
+    column = np.clip(np.floor((x[valid] + _ORIGIN) / size), 0, limit).astype(np.int64)
+    row = np.clip(np.floor((_ORIGIN - y[valid]) / size), 0, limit).astype(np.int64)
+    return _merge_pixels(column, row, np.ones(len(column), dtype=np.int64))
+
+
+def _merge_pixels(column, row, counts):
+    """Sum counts of equal pixels, see pixel_counts."""
+    keys, inverse = np.unique(column * (1 << 32) + row, return_inverse=True)
+    counts = np.bincount(inverse.ravel(), counts, minlength=len(keys)).astype(np.int64)
+    return keys >> 32, keys & 0xFFFFFFFF, counts
+
+
+def downsample(column, row, counts):
+    """Aggregate pixel counts to zoom level one lower, see pixel_counts."""
+    return _merge_pixels(column >> 1, row >> 1, counts)
+
+
+def _write_tiles(args):
+    """Write tiles of single zoom level in worker process.
+
+    Parameters
+    ----------
+    args : Tuple
+        (directory, zoom, column, row, counts, max count, format), pixels of tiles
+        written by this call, see pixel_counts.
+    Returns
+    -------
+    Number of written tiles.
+    """
+    directory, zoom, column, row, counts, vmax, fmt = args
+    import matplotlib
+    import matplotlib.image
+
+    cmap = matplotlib.colormaps["inferno"]
+    tile_keys = (column >> 8) * (1 << 32) + (row >> 8)
+    bounds = np.flatnonzero(np.diff(tile_keys)) + 1
+    written = 0
+    for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(tile_keys)]):
+        tile_x, tile_y = int(column[start] >> 8), int(row[start] >> 8)
+        tile = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint32)
+        tile[row[start:end] & 0xFF, column[start:end] & 0xFF] = counts[start:end]
+        dirname = os.path.join(directory, str(zoom), str(tile_x))
+        os.makedirs(dirname, exist_ok=True)
+        filename = os.path.join(dirname, f"{tile_y}.{fmt}")
+        if fmt == "npy":
+            np.save(filename, tile)
+        else:
+            # log color scale shared by all tiles of the layer, empty pixels are transparent
+            rgba = cmap(np.log1p(tile) / np.log1p(max(vmax, 1)))
+            rgba[tile == 0, 3] = 0
+            matplotlib.image.imsave(filename, rgba)
+        written += 1
+    return written
+
+
+def export_layer(directory, x, y, max_zoom=14, min_zoom=0, fmt="png", workers=None,
+                 executor=None):
+    """Export density of points as XYZ tile pyramid.
+
+    Points are counted only at max_zoom, every lower level is aggregated from the
+    level below. Tiles of each level are written in parallel worker processes.
+
+    Parameters
+    ----------
+    directory : String
+        Directory of the pyramid, tiles are written to {z}/{x}/{y}.{fmt}.
+    x, y : ndarray
+        Coordinates of points in EPSG:3857.
+    max_zoom, min_zoom : Int, optional
+        Range of exported zoom levels.
+    fmt : String, optional
+        "png" for colored tiles, "npy" for raw uint32 counts [row, column].
+    workers : Int, optional
+        Number of worker processes, number of CPUs by default.
+    executor : ProcessPoolExecutor, optional
+        Pool with the worker processes, so more layers can share it. Pool is
+        created for this layer by default.
+    Returns
+    -------
+    Number of written tiles.
+    """
+    workers = workers or os.cpu_count() or 1
+    pixels = pixel_counts(x, y, max_zoom)
+    written = 0
+    own_executor = executor is None and workers > 1
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for zoom in range(max_zoom, min_zoom - 1, -1):
+            column, row, counts = _sort_by_tile(*pixels)
+            if counts.size:
+                # tiles are split into contiguous batches, one task per batch
+                tile_keys = (column >> 8) * (1 << 32) + (row >> 8)
+                starts = np.r_[0, np.flatnonzero(np.diff(tile_keys)) + 1]
+                n_batches = min(workers * 4, len(starts))
+                batches = np.linspace(0, len(starts), n_batches, endpoint=False).astype(int)
+                splits = np.r_[starts[batches], len(counts)]
+                vmax = counts.max()
+                tasks = [(directory, zoom, column[a:b], row[a:b], counts[a:b], vmax, fmt)
+                         for a, b in zip(splits[:-1], splits[1:])]
+                results = executor.map(_write_tiles, tasks) if executor else map(
+                    _write_tiles, tasks)
+                written += sum(results)
+            if zoom > min_zoom:
+                pixels = downsample(*pixels)
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return written
+
+
+def _sort_by_tile(column, row, counts):
+    """Sort pixels by tile, so pixels of each tile are contiguous."""
+    order = np.lexsort((row, column, row >> 8, column >> 8))
+    return column[order], row[order], counts[order]
+
+
+def export_pyramid(path="outputs/tiles", regions=None, years=None, roads=None,
+                   max_zoom=14, min_zoom=0, fmt="png", workers=None, force=False,
+                   downloader=None):
+    """Export density of accidents for each year and road class as tile pyramids.
+
+    Pyramid of a year and road class is written to {path}/{year}/{p36}. Layers
+    are rewritten only when their accidents changed, fingerprints of exported
+    layers are kept in {path}/manifest.json. All layers are written by the same
+    pool of worker processes.
+
+    Parameters
+    ----------
+    path : String, optional
+        Output directory.
+    regions : List, optional
+        Shortnames of regions, all by default.
+    years : List, optional
+        Exported years, all years with accidents by default.
+    roads : List, optional
+        Exported road classes (p36), all valid classes by default.
+    max_zoom, min_zoom, fmt, workers
+        See export_layer.
+    force : Bool, optional
+        When set to True, all layers are rewritten.
+    downloader : DataDownloader, optional
+        Source of the data.
+    Returns
+    -------
+    Dictionary with {(year, road) : number of written tiles} of rewritten layers.
+    """
+    downloader = DataDownloader() if downloader is None else downloader
+    data = downloader.get_dict(regions, ["p2a", "p36"], decode=False)
+    projected = downloader.get_projected(regions, "EPSG:3857")
+    record_years = data["p2a"].astype("datetime64[Y]").astype(np.int64) + 1970
+    valid = ~np.isnat(data["p2a"]) & ~np.isnan(projected["x"]) & ~np.isnan(projected["y"])
+    years = np.unique(record_years[valid]) if years is None else years
+    # records with invalid road class are left out of the default layers
+    roads = np.unique(data["p36"][valid & (data["p36"] >= 0)]) if roads is None else roads
+
+    manifest_filename = os.path.join(path, "manifest.json")
+    try:
+        with open(manifest_filename, "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+    parameters = {"max_zoom": max_zoom, "min_zoom": min_zoom, "format": fmt}
+
+    results = {}
+    workers = workers or os.cpu_count() or 1
+    # worker processes are started only when the first layer is written
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for year in years:
+            in_year = valid & (record_years == year)
+            for road in roads:
+                selected = np.flatnonzero(in_year & (data["p36"] == road))
+                x, y = projected["x"][selected], projected["y"][selected]
+                # layer is identified by its accidents and their coordinates
+                digest = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode())
+                digest.update(np.ascontiguousarray(x).tobytes())
+                digest.update(np.ascontiguousarray(y).tobytes())
+                name = f"{int(year)}/{int(road)}"
+                if not force and manifest.get(name) == digest.hexdigest():
+                    continue
+                directory = os.path.join(path, str(int(year)), str(int(road)))
+                shutil.rmtree(directory, ignore_errors=True)
+                results[int(year), int(road)] = export_layer(
+                    directory, x, y, max_zoom, min_zoom, fmt, workers, executor)
+                manifest[name] = digest.hexdigest()
+                # layers exported so far are kept even when export is interrupted
+                os.makedirs(path, exist_ok=True)
+                with atomic_open(manifest_filename, "w") as f:
+                    json.dump(manifest, f, indent=1, sort_keys=True)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return results
+
+
+def main(argv=None):
+    """Main function
+
+    Parameters
+    ----------
+    argv Argument vector passed to the ArgumentParser.
+    Following arguments are defined and can be passed from command line:
+        --path : Output directory.
+        --regions : Shortnames of exported regions.
+        --years : Exported years.
+        --roads : Exported road classes.
+        --max_zoom, --min_zoom : Range of zoom levels.
+        --format : Format of tiles, png or npy.
+        --workers : Number of worker processes.
+        --force : Rewrite layers even when they didn't change.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="outputs/tiles", help="Output directory.")
+    parser.add_argument("--regions", nargs="+", default=None,
+                        help="Shortnames of exported regions (all by default).")
+    parser.add_argument("--years", nargs="+", type=int, default=None,
+                        help="Exported years (all by default).")
+    parser.add_argument("--roads", nargs="+", type=int, default=None,
+                        help="Exported road classes p36 (all by default).")
+    parser.add_argument("--max_zoom", type=int, default=14,
+                        help="Highest zoom level, where accidents are counted.")
+    parser.add_argument("--min_zoom", type=int, default=0, help="Lowest zoom level.")
+    parser.add_argument("--format", choices=["png", "npy"], default="png",
+                        help="Colored PNG tiles or raw counts in .npy files.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (number of CPUs by default).")
+    parser.add_argument("--force", action="store_true",
+                        help="Rewrite layers even when their accidents didn't change.")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = export_pyramid(args.path, args.regions, args.years, args.roads,
+                             args.max_zoom, args.min_zoom, args.format, args.workers,
+                             args.force)
+    for (year, road), written in results.items():
+        print(f"{year}, p36={road}: {written} dlaždic")
+    print(f"Aktualizováno vrstev: {len(results)}, {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""query.py: Filter and group dataset about car accidents provided by PČR without pandas"""
+
+__author__ = "David Sedlák"
+__email__ = "xsedla1d@stud.fit.vutbr.cz"
+
+import argparse
+import time
+import numpy as np
+
+from download import DataDownloader
+
+
+class Query:
+    """Filter and group-by query over dataset in format produced by
+    DataDownloader.get_dict.
+
+    Predicates are evaluated once into single boolean mask, columns are never
+    copied or filtered, only the mask is applied when aggregating. Dictionary-encoded
+    columns (decode=False) are compared and grouped by their codes.
+
+    Attributes
+    ----------
+    data Dictionary with {header : ndarray}, ColumnDict with encoded columns too.
+    mask Boolean ndarray with selected records or None when all are selected.
+    """
+
+    def __init__(self, data, mask=None):
+        """Initializer which sets queried data.
+
+        Parameters
+        ----------
+        data : Dictionary
+            Dataset in format produced by DataDownloader.get_dict.
+        mask : ndarray, optional
+            Boolean mask of selected records.
+        """
+        self.data = data
+        self.mask = mask
+
+    def __len__(self):
+        """Return number of selected records."""
+        if self.mask is None:
+            return len(next(iter(self.data.values()), []))
+        return int(np.count_nonzero(self.mask))
+
+    def where(self, predicate=None, **conditions):
+        """Select records satisfying predicate and all conditions.
+
+        Parameters
+        ----------
+        predicate : Callable or ndarray, optional
+            Function returning boolean mask for given data or the mask itself.
+        conditions : Any
+            Conditions column=value, value can be single value or list of allowed
+            values, e.g. where(p36=1, region=["PHA", "JHM"]).
+        Returns
+        -------
+        New Query with combined mask.
+        """
+        mask = self.mask
+        masks = [] if predicate is None else [
+            predicate(self.data) if callable(predicate) else predicate]
+        masks += [self._condition(column, value)
+                  for column, value in conditions.items()]
+        for other in masks:
+            mask = other if mask is None else mask & other
+        return Query(self.data, mask)
+
+    def group_by(self, *keys):
+        """Group selected records by keys.
+
+        Parameters
+        ----------
+        keys : String or Tuple
+            Names of integer or dictionary-encoded columns, or tuples (name, ndarray)
+            with key values derived from the data, e.g. ("month", months).
+        Returns
+        -------
+        Grouped records.
+        """
+        return Grouped(self, keys)
+
+    def count(self):
+        """Return number of selected records."""
+        return len(self)
+
+    def sum(self, column):
+        """Return sum of column over selected records, NaN values are skipped."""
+        return self.group_by().sum(column).values[()]
+
+    def mean(self, column):
+        """Return mean of column over selected records, NaN values are skipped."""
+        return self.group_by().mean(column).values[()]
+
+    def _condition(self, column, value):
+        values = self.data[column]
+        categories = getattr(self.data, "categories", {})
+        allowed = np.atleast_1d(np.asarray(value))
+        if column in categories:
+            # compare codes, values missing in categories match nothing
+            allowed = np.flatnonzero(np.isin(categories[column], allowed))
+        if allowed.size == 1:
+            return values == allowed[0]
+        return np.isin(values, allowed)
+
+
+class GroupResult:
+    """Dense result of aggregation over groups.
+
+    Attributes
+    ----------
+    names Names of keys.
+    keys List of ndarrays with values of each key, one for each axis of values.
+    values ndarray with aggregated values [key 1, key 2, ...].
+    """
+
+    def __init__(self, names, keys, values):
+        self.names = list(names)
+        self.keys = keys
+        self.values = values
+
+    def items(self):
+        """Iterate over (tuple of key values, value) of all groups."""
+        for index in np.ndindex(self.values.shape):
+            yield tuple(keys[i] for keys, i in zip(self.keys, index)), self.values[index]
+
+
+class Grouped:
+    """Records of Query grouped by integer coded keys.
+
+    All keys are combined into single integer key, which is aggregated by one
+    np.bincount call.
+    """
+
+    def __init__(self, query, keys):
+        """Initializer which prepares the combined key.
+
+        Parameters
+        ----------
+        query : Query
+            Query with selected records.
+        keys : Iterable
+            Keys, see Query.group_by.
+        """
+        self.query = query
+        self.names = []
+        self.labels = []
+        combined = None
+        size = 1
+        for key in keys:
+            name, codes, labels = self._factorize(key)
+            self.names.append(name)
+            self.labels.append(labels)
+            combined = codes if combined is None else combined * len(labels) + codes
+            size *= len(labels)
+        self.key = combined
+        self.size = size
+
+    def count(self):
+        """Return GroupResult with numbers of records in groups."""
+        return self._result(self._bincount())
+
+    def sum(self, column):
+        """Return GroupResult with sums of column in groups, NaN values are skipped."""
+        values = self.query.data[column]
+        valid = ~np.isnan(values) if values.dtype.kind == "f" else None
+        sums = self._bincount(values, valid)
+        if values.dtype.kind in "iub":
+            # bincount sums in float64, which is exact for sums of integers
+            sums = sums.astype(np.int64)
+        return self._result(sums)
+
+    def mean(self, column):
+        """Return GroupResult with means of column in groups, NaN values are skipped.
+
+        Groups without values have NaN mean.
+        """
+        values = self.query.data[column]
+        valid = ~np.isnan(values) if values.dtype.kind == "f" else None
+        counts = self._bincount(valid=valid)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = self._bincount(values, valid) / counts
+        return self._result(means)
+
+    def _bincount(self, weights=None, valid=None):
+        mask = self.query.mask
+        if valid is not None:
+            mask = valid if mask is None else mask & valid
+        key = self.key if self.key is not None else np.zeros(
+            len(self.query.data[next(iter(self.query.data))]), dtype=np.intp)
+        if mask is not None:
+            key = key[mask]
+            weights = None if weights is None else weights[mask]
+        if weights is not None:
+            weights = weights.astype(np.float64, copy=False)
+        return np.bincount(key, weights, minlength=self.size)
+
+    def _result(self, values):
+        shape = tuple(len(labels) for labels in self.labels)
+        return GroupResult(self.names, self.labels, values.reshape(shape))
+
+    def _factorize(self, key):
+        """Convert key to (name, integer codes from 0, labels of the codes)."""
+        if isinstance(key, tuple):
+            name, values = key
+        else:
+            name, values = key, self.query.data[key]
+        categories = getattr(self.query.data, "categories", {})
+        if not isinstance(key, tuple) and name in categories:
+            return name, values.astype(np.intp, copy=False), categories[name]
+        if values.dtype.kind in "iub" and values.size:
+            low, high = int(values.min()), int(values.max())
+            # small ranges of integers are used directly as codes
+            if high - low < 4 * values.size + 1024:
+                return (name, values.astype(np.intp) - low,
+                        np.arange(low, high + 1, dtype=values.dtype))
+        labels, codes = np.unique(values, return_inverse=True)
+        return name, codes.ravel(), labels
+
+
+def benchmark(data, repeat=5):
+    """Compare time of queries with equivalent pandas code from analysis.py.
+
+    Parameters
+    ----------
+    data : Dictionary
+        Dataset in format produced by DataDownloader.get_dict, it has to contain
+        columns region, p2a, p10, p21 and p13a. Queries run on the data as they
+        are, pandas gets decoded columns like analysis.py.
+    repeat : Int, optional
+        Number of repetitions, the best time is reported.
+    Returns
+    -------
+    Dictionary with {name of query : (query time, pandas time)} in seconds.
+    """
+    import pandas as pd
+
+    decode = getattr(data, "decode", data.__getitem__)
+    df = pd.DataFrame({column: decode(column) for column in
+                       ["region", "p2a", "p10", "p21", "p13a"]})
+    df["date"] = df["p2a"]
+
+    def roadtype_pandas():
+        # plot_roadtype
+        frame = df.copy()
+        frame["Počet nehod"] = 1
+        return frame.groupby(["region", "p21"]).agg({"Počet nehod": "sum"})
+
+    def roadtype_query():
+        return Query(data).group_by("region", "p21").count()
+
+    def animals_pandas():
+        # plot_animals
+        frame = df.copy()
+        frame["Počet nehod"] = 1
+        frame = frame[frame["date"] < "2021-01-01"]
+        return frame.groupby(["region", frame["date"].dt.month, "p10"]).agg(
+            {"Počet nehod": "sum"})
+
+    def animals_query():
+        months = data["p2a"].astype("datetime64[M]").astype(np.int64) % 12 + 1
+        return (Query(data).where(lambda d: d["p2a"] < np.datetime64("2021-01-01"))
+                .group_by("region", ("month", months), "p10").count())
+
+    def casualties_pandas():
+        # mean number of killed persons by region
+        frame = df[df["p13a"] >= 0].copy()
+        return frame.groupby("region").agg({"p13a": "mean"})
+
+    def casualties_query():
+        return (Query(data).where(lambda d: d["p13a"] >= 0)
+                .group_by("region").mean("p13a"))
+
+    results = {}
+    for name, query, pandas in [("roadtype", roadtype_query, roadtype_pandas),
+                                ("animals", animals_query, animals_pandas),
+                                ("casualties", casualties_query, casualties_pandas)]:
+        times = []
+        for function in (query, pandas):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function()
+                best = min(best, time.perf_counter() - start)
+            times.append(best)
+        results[name] = tuple(times)
+    return results
+
+
+def main(argv=None):
+    """Main function
+
+    Parameters
+    ----------
+    argv Argument vector passed to the ArgumentParser.
+    Following arguments are defined and can be passed from command line:
+        --repeat : Number of repetitions of each benchmarked query.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of repetitions of each benchmarked query."
+    )
+    args = parser.parse_args(argv)
+
+    data = DataDownloader().get_dict(columns=["region", "p2a", "p10", "p21", "p13a"],
+                                     decode=False)
+    print(f"Počet záznamů: {len(data['region'])}")
+    for name, (query_time, pandas_time) in benchmark(data, args.repeat).items():
+        print(f"{name}: query {query_time * 1000:.1f} ms, pandas {pandas_time * 1000:.1f} ms,"
+              f" {pandas_time / query_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
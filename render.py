@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""render.py: Render all figures from dataset about car accidents provided by PČR at once"""
+
+__author__ = "David Sedlák"
+__email__ = "xsedla1d@stud.fit.vutbr.cz"
+
+import argparse
+import ast
+import functools
+import hashlib
+import importlib
+import inspect
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+
+class FigureJob:
+    """Declaration of single rendered figure.
+
+    Attributes
+    ----------
+    name Name of the figure used in reports.
+    module Name of module with the plotting function.
+    function Name of the plotting function, it is called as
+        function(data, fig_location, show_figure=False, **kwargs).
+    fig_location Path where the figure is saved.
+    kwargs Additional keyword arguments of the plotting function, arguments
+        computed at rendering are given by argument_adapters.
+    """
+
+    def __init__(self, name, module, function, fig_location, **kwargs):
+        """Initializer which sets the plotting function and its arguments.
+
+        Parameters
+        ----------
+        name : String
+            Name of the figure.
+        module : String
+            Name of module with the plotting function, e.g. analysis.
+        function : String
+            Name of the plotting function, e.g. plot_roadtype.
+        fig_location : String
+            Path where the figure is saved.
+        kwargs : Any
+            Additional keyword arguments of the plotting function.
+        """
+        self.name = name
+        self.module = module
+        self.function = function
+        self.fig_location = fig_location
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return f"FigureJob({self.name!r}, {self.module}.{self.function}, {self.fig_location!r})"
+
+
+# all figures of the project, in the same locations as the scripts use
+figures = [
+    FigureJob("geo", "geo", "plot_geo", "outputs/geo1.png"),
+    FigureJob("geo_density", "geo", "plot_geo", "outputs/geo1_density.png", mode="density"),
+    FigureJob("cluster", "geo", "plot_cluster", "outputs/geo2.png"),
+    FigureJob("roadtype", "analysis", "plot_roadtype", "outputs/01_roadtype.png"),
+    FigureJob("animals", "analysis", "plot_animals", "outputs/02_animals.png"),
+    FigureJob("conditions", "analysis", "plot_conditions", "outputs/03_conditions.png"),
+    FigureJob("alcohol", "doc", "plot_alcohol", "outputs/alcohol_fig.pdf"),
+    FigureJob("stat", "get_stat", "plot_stat", "outputs/01_stat.png"),
+]
+
+
+def _analysis_data(df):
+    # plotting functions may replace columns, shallow copy keeps the shared dataframe intact
+    return df.copy(deep=False)
+
+
+def _geo_data(df):
+    import geo
+    # maps show only JHM, other regions are not projected
+    return geo.make_geo(df, regions=["JHM"])
+
+
+def _doc_data(df):
+    df = df.copy(deep=False)
+    df["datum"] = df["date"]
+    return df
+
+
+def _stat_data(df):
+    return {column: df[column].to_numpy() for column in ["region", "p24"]}
+
+
+# conversion of the shared dataframe to input of plotting functions of each module
+data_adapters = {
+    "analysis": _analysis_data,
+    "geo": _geo_data,
+    "doc": _doc_data,
+    "get_stat": _stat_data,
+}
+
+
+def _cluster_arguments():
+    import geo
+    try:
+        # clusters stored by hotspots.py are updated instead of fitted again
+        return {"hotspots": geo.stored_hotspots("JHM", 1)}
+    except OSError:
+        # plot_cluster falls back to clustering the dataset
+        return {}
+
+
+# additional keyword arguments of plotting functions computed when the figure is
+# rendered, by name of the figure
+argument_adapters = {
+    "cluster": _cluster_arguments,
+}
+
+# dataset shared by the worker processes, see _init_worker
+_dataset = None
+
+
+@functools.lru_cache(maxsize=None)
+def module_sources(name):
+    """Get source code of module of this project and of all modules of this project
+    it imports, also from within functions, so changes of helpers are detected.
+
+    Parameters
+    ----------
+    name : String
+        Name of the module, e.g. geo.
+    Returns
+    -------
+    Tuple with source code of the modules sorted by their names.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    sources = {}
+    pending = [name]
+    while pending:
+        name = pending.pop()
+        filename = os.path.join(root, name + ".py")
+        if name in sources or not os.path.isfile(filename):
+            continue
+        with open(filename, "r", encoding="utf-8") as f:
+            sources[name] = f.read()
+        for node in ast.walk(ast.parse(sources[name], filename)):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name.split(".")[0] for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                pending.append(node.module.split(".")[0])
+    return tuple(sources[name] for name in sorted(sources))
+
+
+class FigureCache:
+    """Cache of rendered figures addressed by content of their inputs.
+
+    Key of a figure is hash of data version, source code of the module with the
+    plotting function and of all modules of this project it imports, source code
+    of its data and argument adapters, and arguments of the figure. Keys of rendered figures
+    are stored in JSON file, figure is rebuilt only when its key changes or the
+    file was removed.
+
+    Attributes
+    ----------
+    filename Path to JSON file with keys of rendered figures.
+    figures Dictionary with {figure location : key}.
+    datasets Dictionary with {dataset path : version} of hashed dataset files.
+    """
+
+    def __init__(self, filename="outputs/.figures.json"):
+        """Initializer which loads stored keys.
+
+        Parameters
+        ----------
+        filename : String, optional
+            Path to JSON file with keys of rendered figures.
+        """
+        self.filename = filename
+        self.figures = {}
+        self.datasets = {}
+        try:
+            with open(filename, "r") as f:
+                stored = json.load(f)
+            self.figures = stored.get("figures", {})
+            self.datasets = stored.get("datasets", {})
+        except FileNotFoundError:
+            pass
+
+    def data_version(self, filename="accidents.pkl.gz"):
+        """Get version of dataset used by the figures.
+
+        Parameters
+        ----------
+        filename : String, optional
+            Path to dataset, see load_dataset. Hash of its content is stored
+            with size and modification time of the file, so it is computed only
+            when the file changes. When it doesn't exist, version of downloaded
+            archives is used.
+        Returns
+        -------
+        String with version of the dataset.
+        """
+        if filename is None or not os.path.exists(filename):
+            from download import DataDownloader
+            return DataDownloader().data_version()
+        stat = os.stat(filename)
+        path = os.path.realpath(filename)
+        version = self.datasets.get(path, {})
+        if version.get("size") != stat.st_size or version.get("mtime") != stat.st_mtime_ns:
+            digest = hashlib.sha256()
+            with open(filename, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            version = {"size": stat.st_size, "mtime": stat.st_mtime_ns,
+                       "sha256": digest.hexdigest()}
+            self.datasets[path] = version
+        return version["sha256"]
+
+    @staticmethod
+    def key(job, data_version):
+        """Get key of a figure.
+
+        Parameters
+        ----------
+        job : FigureJob
+            Rendered figure.
+        data_version : String
+            Version of the dataset, see data_version.
+        Returns
+        -------
+        String with SHA-256 hash or None, when the plotting function can't be
+        imported (such figure is always rendered).
+        """
+        try:
+            getattr(importlib.import_module(job.module), job.function)
+            sources = module_sources(job.module)
+        except (ImportError, AttributeError, OSError):
+            return None
+        adapter = inspect.getsource(data_adapters.get(job.module, _analysis_data))
+        if job.name in argument_adapters:
+            adapter += inspect.getsource(argument_adapters[job.name])
+        digest = hashlib.sha256()
+        for part in [data_version, *sources, adapter, job.fig_location,
+                     repr(sorted(job.kwargs.items()))]:
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def is_fresh(self, job, key):
+        """Check that figure is rendered with given key and its file exists."""
+        return (key is not None and self.figures.get(job.fig_location) == key
+                and os.path.exists(job.fig_location))
+
+    def store(self, job, key):
+        """Remember key of rendered figure, see save."""
+        if key is not None:
+            self.figures[job.fig_location] = key
+
+    def save(self):
+        """Store keys of rendered figures and versions of datasets."""
+        from download import atomic_open
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        with atomic_open(self.filename, "w") as f:
+            json.dump({"figures": self.figures, "datasets": self.datasets}, f,
+                      indent=1, sort_keys=True)
+
+
+def stale_figures(jobs, data_version=None, force=False, dry_run=False, cache=None):
+    """Select figures which have to be rendered, figures which are up to date are
+    reported and kept.
+
+    Scripts drawing figures on their own use it as well, so they skip figures
+    whose inputs didn't change. Keys of the returned figures are stored by
+    FigureCache.store and FigureCache.save once they are rendered.
+
+    Parameters
+    ----------
+    jobs : List
+        FigureJobs of the figures.
+    data_version : String, optional
+        Version of the data, version of dataset of DataDownloader by default, see
+        FigureCache.data_version.
+    force : Bool, optional
+        When set to True, all figures are rendered.
+    dry_run : Bool, optional
+        When set to True, figures which would be rendered are reported too.
+    cache : FigureCache, optional
+        Cache of rendered figures, outputs/.figures.json by default.
+    Returns
+    -------
+    Tuple (cache, dictionary {FigureJob : key} of figures to render).
+    """
+    cache = FigureCache() if cache is None else cache
+    data_version = cache.data_version(None) if data_version is None else data_version
+    keys = {job: cache.key(job, data_version) for job in jobs}
+    stale = {job: key for job, key in keys.items() if force or not cache.is_fresh(job, key)}
+    for job in jobs:
+        if job not in stale:
+            print(f"{job.name}: aktuální, {job.fig_location}")
+        elif dry_run:
+            print(f"{job.name}: bude vykreslen, {job.fig_location}")
+    return cache, stale
+
+
+def load_dataset(filename="accidents.pkl.gz"):
+    """Load dataset used by all figures.
+
+    Parameters
+    ----------
+    filename : String, optional
+        Path to dataset exported by DataDownloader.export_dataframe. When the file
+        doesn't exist, dataset is loaded by DataDownloader directly.
+    Returns
+    -------
+    Dataframe with the dataset and date column.
+    """
+    import pandas as pd
+
+    if filename is not None and os.path.exists(filename):
+        df = pd.read_pickle(filename)
+    else:
+        from download import DataDownloader
+        df = DataDownloader().get_dataframe()
+    if "date" not in df:
+        df["date"] = df["p2a"].astype("datetime64[s]")
+    return df
+
+
+def _init_worker(df):
+    """Set dataset and non-interactive backend of worker process."""
+    global _dataset
+    _dataset = df
+    matplotlib.use("Agg")
+
+
+def _render(job):
+    """Render single figure from the shared dataset.
+
+    Parameters
+    ----------
+    job : FigureJob
+        Rendered figure.
+    Returns
+    -------
+    Tuple (name of the figure, time in seconds, error message or None).
+    """
+    import matplotlib.pyplot as plt
+
+    start = time.perf_counter()
+    error = None
+    try:
+        # not all plotting functions create directory of the figure
+        os.makedirs(os.path.dirname(os.path.abspath(job.fig_location)), exist_ok=True)
+        module = importlib.import_module(job.module)
+        data = data_adapters.get(job.module, _analysis_data)(_dataset)
+        kwargs = dict(job.kwargs)
+        if job.name in argument_adapters:
+            kwargs.update(argument_adapters[job.name]())
+        getattr(module, job.function)(data, job.fig_location, show_figure=False,
+                                      **kwargs)
+    except Exception as e:
+        error = "".join(traceback.format_exception_only(type(e), e)).strip()
+    finally:
+        plt.close("all")
+    return job.name, time.perf_counter() - start, error
+
+
+def render(df, jobs=None, workers=None):
+    """Render figures in parallel.
+
+    Dataset is loaded only once by the caller. Worker processes are forked when
+    possible, so they share the dataset without copying it, otherwise it is sent to
+    each worker once. Figures are rendered with non-interactive Agg backend.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Dataset, see load_dataset.
+    jobs : List, optional
+        FigureJobs to render, all figures by default.
+    workers : Int, optional
+        Number of worker processes, number of CPUs by default. With single worker
+        figures are rendered in current process.
+    Returns
+    -------
+    Dictionary with {name of figure : (time in seconds, error message or None)}
+    in order of jobs.
+    """
+    jobs = figures if jobs is None else jobs
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        _init_worker(df)
+        results = [_render(job) for job in jobs]
+    else:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_init_worker, initargs=(df,)) as executor:
+            results = list(executor.map(_render, jobs))
+    return {name: (seconds, error) for name, seconds, error in results}
+
+
+def main(argv=None):
+    """Main function
+
+    Parameters
+    ----------
+    argv Argument vector passed to the ArgumentParser.
+    Following arguments are defined and can be passed from command line:
+        --dataset : Path to dataset exported by DataDownloader.export_dataframe.
+        --workers : Number of processes rendering the figures.
+        --figures : Names of rendered figures.
+        --force : Render figures even when they are up to date.
+        --dry_run : Only list figures which would be rendered.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--dataset",
+        default="accidents.pkl.gz",
+        help="Path to dataset exported by DataDownloader.export_dataframe, "
+             "dataset is downloaded when it doesn't exist."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes rendering the figures (number of CPUs by default)."
+    )
+    parser.add_argument(
+        "--figures",
+        nargs="+",
+        default=None,
+        choices=[job.name for job in figures],
+        help="Names of rendered figures (all by default)."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render figures even when neither data nor plotting code changed."
+    )
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Only list figures which would be rendered."
+    )
+    args = parser.parse_args(argv)
+
+    jobs = figures if args.figures is None else [
+        job for job in figures if job.name in args.figures]
+    start = time.perf_counter()
+    cache = FigureCache()
+    cache, keys = stale_figures(jobs, cache.data_version(args.dataset), args.force,
+                                args.dry_run, cache)
+    stale = list(keys)
+    if args.dry_run or not stale:
+        cache.save()
+        return
+
+    df = load_dataset(args.dataset)
+    print(f"Načtení dat: {time.perf_counter() - start:.2f} s")
+    results = render(df, stale, args.workers)
+    for job in stale:
+        seconds, error = results[job.name]
+        if error is None:
+            cache.store(job, keys[job])
+        status = job.fig_location if error is None else f"chyba: {error}"
+        print(f"{job.name}: {seconds:.2f} s, {status}")
+    cache.save()
+    print(f"Celkem: {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""tiles.py: Cached map tiles used as basemaps of geographical plots"""
+
+__author__ = "David Sedlák"
+__email__ = "xsedla1d@stud.fit.vutbr.cz"
+
+import argparse
+import io
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+# half of the circumference of the Earth in EPSG:3857 coordinates
+_ORIGIN = 20037508.342789244
+# tiles which don't exist on the server are stored as empty data
+_EMPTY = b""
+
+
+class TileMissingError(LookupError):
+    """Tile isn't cached and it can't be downloaded in offline mode."""
+
+
+def lonlat_to_mercator(lon, lat):
+    """Convert WGS 84 coordinates to EPSG:3857.
+
+    Parameters
+    ----------
+    lon, lat : Float or ndarray
+        Longitude and latitude in degrees.
+    Returns
+    -------
+    Tuple (x, y) with coordinates in meters.
+    """
+    x = np.radians(lon) * 6378137.0
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * 6378137.0
+    return x, y
+
+
+def tile_bounds(z, x, y):
+    """Return bounds (xmin, ymin, xmax, ymax) of XYZ tile in EPSG:3857."""
+    size = 2 * _ORIGIN / 2 ** z
+    xmin = -_ORIGIN + x * size
+    ymax = _ORIGIN - y * size
+    return xmin, ymax - size, xmin + size, ymax
+
+
+def tile_range(bbox, zoom):
+    """Get XYZ tiles covering bounding box.
+
+    Parameters
+    ----------
+    bbox : Tuple
+        Bounding box (xmin, ymin, xmax, ymax) in EPSG:3857.
+    zoom : Int
+        Zoom level.
+    Returns
+    -------
+    Tuple (x range, y range) of tile indices.
+    """
+    xmin, ymin, xmax, ymax = bbox
+    n = 2 ** zoom
+    size = 2 * _ORIGIN / n
+
+    def index(value):
+        return min(max(int(math.floor(value / size)), 0), n - 1)
+
+    return (range(index(xmin + _ORIGIN), index(xmax + _ORIGIN) + 1),
+            range(index(_ORIGIN - ymax), index(_ORIGIN - ymin) + 1))
+
+
+class TileCache:
+    """Persistent cache of map tiles in sqlite database.
+
+    Tiles are stored in table with the same columns as MBTiles uses, together
+    with name of their provider, so single file can hold tiles of more providers.
+    Rows are numbered from the top (XYZ scheme), not from the bottom like in MBTiles.
+
+    Attributes
+    ----------
+    filename Path to the database.
+    """
+
+    def __init__(self, filename="data/tiles.mbtiles"):
+        """Initializer which sets path to the database.
+
+        Parameters
+        ----------
+        filename : String, optional
+            Path to the database, it is created when it doesn't exist.
+        """
+        self.filename = filename
+        self._local = threading.local()
+
+    def __getstate__(self):
+        """Drop connections when cache is sent to other processes."""
+        return {"filename": self.filename}
+
+    def __setstate__(self, state):
+        self.__init__(state["filename"])
+
+    def _connection(self):
+        """Return connection of current thread and process."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            dirname = os.path.dirname(os.path.abspath(self.filename))
+            os.makedirs(dirname, exist_ok=True)
+            # concurrent writers from other processes wait for the lock
+            connection = sqlite3.connect(self.filename, timeout=60)
+            connection.execute("CREATE TABLE IF NOT EXISTS tiles (provider TEXT, "
+                               "zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, "
+                               "tile_data BLOB, fetched REAL, PRIMARY KEY "
+                               "(provider, zoom_level, tile_column, tile_row))")
+            connection.commit()
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, provider, z, x, y):
+        """Return data of cached tile or None when it isn't cached."""
+        row = self._connection().execute(
+            "SELECT tile_data FROM tiles WHERE provider = ? AND zoom_level = ? "
+            "AND tile_column = ? AND tile_row = ?", (provider, z, x, y)).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def contains(self, provider, z, x, y):
+        """Check that tile is cached."""
+        return self._connection().execute(
+            "SELECT 1 FROM tiles WHERE provider = ? AND zoom_level = ? "
+            "AND tile_column = ? AND tile_row = ?", (provider, z, x, y)).fetchone() is not None
+
+    def put(self, provider, z, x, y, data):
+        """Store data of tile."""
+        connection = self._connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, ?)",
+                               (provider, z, x, y, sqlite3.Binary(data), time.time()))
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+
+
+class TileSource:
+    """Provider of map tiles with persistent cache.
+
+    Attributes
+    ----------
+    url URL template of tiles with {z}, {x} and {y} fields.
+    name Name of the provider used in the cache.
+    attribution Attribution text of the provider.
+    cache TileCache with downloaded tiles.
+    offline When set to True, only cached tiles are served.
+    """
+
+    def __init__(self, provider, cache=None, offline=False, workers=8, retries=3,
+                 backoff=1.0, timeout=30):
+        """Initializer which sets provider of tiles.
+
+        Parameters
+        ----------
+        provider : String or TileProvider
+            URL template of tiles, e.g. https://tile.openstreetmap.org/{z}/{x}/{y}.png,
+            or provider from contextily.providers (xyzservices.TileProvider).
+        cache : TileCache, optional
+            Cache of tiles, data/tiles.mbtiles by default.
+        offline : Bool, optional
+            When set to True, tiles are never downloaded and missing tiles raise
+            TileMissingError.
+        workers : Int, optional
+            Maximal number of tiles downloaded concurrently.
+        retries : Int, optional
+            Number of retries of failed downloads.
+        backoff : Float, optional
+            Base of exponential delay between retries in seconds.
+        timeout : Float, optional
+            Timeout of single request in seconds.
+        """
+        if isinstance(provider, str):
+            self.url = provider
+            self.name = provider
+            self.attribution = ""
+        else:
+            self.url = provider.build_url()
+            self.name = provider.name
+            self.attribution = provider.get("attribution", "")
+        self.cache = TileCache() if cache is None else cache
+        self.offline = offline
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._session = None
+
+    def __getstate__(self):
+        """Drop session when source is sent to other processes."""
+        state = self.__dict__.copy()
+        state["_session"] = None
+        return state
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(self.workers, 1))
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        return self._session
+
+    def tile(self, z, x, y):
+        """Get data of single tile, from the cache when possible.
+
+        Parameters
+        ----------
+        z, x, y : Int
+            Zoom level, column and row of the tile.
+        Returns
+        -------
+        Bytes with encoded image, empty when the tile doesn't exist.
+        """
+        data = self.cache.get(self.name, z, x, y)
+        if data is not None:
+            return data
+        if self.offline:
+            raise TileMissingError(f"Tile {z}/{x}/{y} of {self.name} isn't cached")
+        data = self._fetch(z, x, y)
+        self.cache.put(self.name, z, x, y, data)
+        return data
+
+    def _fetch(self, z, x, y):
+        """Download tile, retrying when download fails."""
+        url = self.url.format(z=z, x=x, y=y, s="a", r="")
+        for attempt in range(self.retries + 1):
+            try:
+                r = self.session.get(url, timeout=self.timeout)
+                if r.status_code == 404:
+                    return _EMPTY
+                r.raise_for_status()
+                return r.content
+            except OSError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def prewarm(self, bbox, zooms):
+        """Download all tiles covering bounding box, which aren't cached yet.
+
+        Parameters
+        ----------
+        bbox : Tuple
+            Bounding box (xmin, ymin, xmax, ymax) in EPSG:3857.
+        zooms : Iterable
+            Zoom levels.
+        Returns
+        -------
+        Tuple (number of downloaded tiles, number of already cached tiles).
+        """
+        tiles = []
+        for z in zooms:
+            columns, rows = tile_range(bbox, z)
+            tiles += [(z, x, y) for x in columns for y in rows]
+        missing = [tile for tile in tiles if not self.cache.contains(self.name, *tile)]
+        if missing and self.offline:
+            raise TileMissingError(f"{len(missing)} tiles of {self.name} aren't cached")
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor:
+            for _ in executor.map(lambda tile: self.tile(*tile), missing):
+                pass
+        return len(missing), len(tiles) - len(missing)
+
+    def image(self, bbox, zoom):
+        """Stitch tiles covering bounding box into single image.
+
+        Parameters
+        ----------
+        bbox : Tuple
+            Bounding box (xmin, ymin, xmax, ymax) in EPSG:3857.
+        zoom : Int
+            Zoom level.
+        Returns
+        -------
+        Tuple (RGBA ndarray [row, column, channel] of floats, extent
+        (xmin, xmax, ymin, ymax) of the image) usable by imshow.
+        """
+        import matplotlib.image
+
+        columns, rows = tile_range(bbox, zoom)
+        tiles = [(zoom, x, y) for y in rows for x in columns]
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor:
+            data = list(executor.map(lambda tile: self.tile(*tile), tiles))
+
+        image = None
+        for (_, x, y), tile in zip(tiles, data):
+            if tile == _EMPTY:
+                continue
+            pixels = matplotlib.image.imread(io.BytesIO(tile))
+            if pixels.dtype == np.uint8:
+                pixels = pixels / 255
+            if pixels.ndim == 2:
+                pixels = np.repeat(pixels[..., np.newaxis], 3, axis=2)
+            if pixels.shape[2] == 3:
+                pixels = np.dstack([pixels, np.ones(pixels.shape[:2])])
+            if image is None:
+                size = pixels.shape[0]
+                image = np.zeros((len(rows) * size, len(columns) * size, 4))
+            top = (y - rows.start) * size
+            left = (x - columns.start) * size
+            image[top:top + size, left:left + size] = pixels
+        if image is None:
+            image = np.zeros((len(rows), len(columns), 4))
+        xmin, _, _, ymax = tile_bounds(zoom, columns.start, rows.start)
+        _, ymin, xmax, _ = tile_bounds(zoom, columns[-1], rows[-1])
+        return image, (xmin, xmax, ymin, ymax)
+
+    def add_basemap(self, ax, zoom=10, attribution=None, attribution_size=8):
+        """Draw basemap under the data in axes, counterpart of contextily.add_basemap.
+
+        Parameters
+        ----------
+        ax : matplotlib.axes.Axes
+            Axes with data in EPSG:3857.
+        zoom : Int, optional
+            Zoom level of tiles.
+        attribution : String, optional
+            Attribution text, attribution of the provider by default.
+        attribution_size : Int, optional
+            Font size of the attribution.
+        """
+        xmin, xmax = ax.get_xlim()
+        ymin, ymax = ax.get_ylim()
+        image, extent = self.image((xmin, ymin, xmax, ymax), zoom)
+        ax.imshow(image, extent=extent, interpolation="bilinear", zorder=-1)
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+        text = self.attribution if attribution is None else attribution
+        if text:
+            ax.text(0.005, 0.005, text, transform=ax.transAxes, size=attribution_size,
+                    ha="left", va="bottom", wrap=True)
+
+
+def main(argv=None):
+    """Main function
+
+    Parameters
+    ----------
+    argv Argument vector passed to the ArgumentParser.
+    Following arguments are defined and can be passed from command line:
+        --url : URL template of tiles.
+        --bbox : Bounding box in WGS 84 whose tiles are downloaded.
+        --region : Region whose tiles are downloaded.
+        --zoom : Zoom levels of downloaded tiles.
+        --cache : Path to the tile cache.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--url",
+        default=None,
+        help="URL template of tiles, basemap of geo.py by default."
+    )
+    parser.add_argument(
+        "--bbox",
+        nargs=4,
+        type=float,
+        default=None,
+        metavar=("LON_MIN", "LAT_MIN", "LON_MAX", "LAT_MAX"),
+        help="Download tiles covering bounding box given in WGS 84."
+    )
+    parser.add_argument(
+        "--region",
+        default=None,
+        help="Download tiles covering accidents in given region, e.g. JHM."
+    )
+    parser.add_argument(
+        "--zoom",
+        nargs="+",
+        type=int,
+        default=[10],
+        help="Zoom levels of downloaded tiles."
+    )
+    parser.add_argument(
+        "--cache",
+        default="data/tiles.mbtiles",
+        help="Path to the tile cache."
+    )
+    args = parser.parse_args(argv)
+
+    if args.url is None:
+        import geo
+        source = TileSource(geo.basemap_provider(), TileCache(args.cache))
+    else:
+        source = TileSource(args.url, TileCache(args.cache))
+    if args.bbox is not None:
+        xmin, ymin = lonlat_to_mercator(args.bbox[0], args.bbox[1])
+        xmax, ymax = lonlat_to_mercator(args.bbox[2], args.bbox[3])
+        bbox = (xmin, ymin, xmax, ymax)
+    elif args.region is not None:
+        import geo
+        df = geo.load_geo([args.region])
+        bbox = (df["x"].min(), df["y"].min(), df["x"].max(), df["y"].max())
+    else:
+        parser.error("one of --bbox and --region is required")
+    downloaded, cached = source.prewarm(bbox, args.zoom)
+    print(f"Staženo dlaždic: {downloaded}, již uloženo: {cached}")
+
+
+if __name__ == "__main__":
+    main()